@@ -0,0 +1,204 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Which projects, and which contractors' data in them, a user can see
+and change.
+
+models.has_access() and models.has_write_access() answer that for one
+project and contractor, with a few queries each time. Permissions
+answers the same questions for all projects at once, computed with
+three queries. It is kept on the request and in the session.
+
+The permissions in a session are used as long as the versions of the
+user and of the user's organization (see versions.py) haven't changed.
+Signals in models.py renew those versions when roles, profiles,
+projects, project types or activities change."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from lizard_progress import versions as cache_versions
+
+SESSION_KEY = 'lizard_progress_permissions'
+
+def user_version_key(user_id):
+    return 'lizard_progress_access_user_{}'.format(user_id)
+
+
+def organization_version_key(organization_id):
+    return 'lizard_progress_access_organization_{}'.format(organization_id)
+
+
+def forget_user(user_id):
+    """Cached permissions of this user aren't used anymore."""
+    if user_id is not None:
+        cache_versions.renew([user_version_key(user_id)])
+
+
+def forget_organizations(organization_ids):
+    """Cached permissions of users of these organizations aren't used
+    anymore."""
+    cache_versions.renew(
+        organization_version_key(organization_id)
+        for organization_id in set(organization_ids)
+        if organization_id is not None)
+
+
+def versions(user_id, organization_id):
+    """Return the current versions of this user's permissions."""
+    keys = [user_version_key(user_id),
+            organization_version_key(organization_id)]
+    current = cache_versions.get_many(keys)
+    return [current[key] for key in keys]
+
+
+def _id(instance):
+    """Both model instances and their ids can be given."""
+    return getattr(instance, 'id', instance)
+
+
+class Permissions(object):
+    """The projects a user's organization can see completely (all
+    contractors' data), those it can see as a contractor (its own data
+    and the project as a whole) and those it can change.
+
+    Works like has_access() and has_write_access(), for contractors
+    that have activities in the project."""
+
+    def __init__(self, organization_id=None, full_access=(),
+                 contractor_access=(), full_write=(), contractor_write=()):
+        self.organization_id = organization_id
+        self.full_access = frozenset(full_access)
+        self.contractor_access = frozenset(contractor_access)
+        self.full_write = frozenset(full_write)
+        self.contractor_write = frozenset(contractor_write)
+
+    @classmethod
+    def compute(cls, userprofile):
+        """Compute the permissions of this UserProfile (may be None)."""
+        # Need to import here to prevent circular imports
+        from lizard_progress import models
+
+        if userprofile is None:
+            return cls()
+
+        organization_id = userprofile.organization_id
+        manager = userprofile.has_role(models.UserRole.ROLE_MANAGER)
+        uploader = userprofile.has_role(models.UserRole.ROLE_UPLOADER)
+
+        full_access = set()
+        full_write = set()
+        for project_id, is_archived in models.Project.objects.filter(
+                organization_id=organization_id).values_list(
+                'id', 'is_archived'):
+            # Archived projects are only visible for managers
+            if manager:
+                full_access.add(project_id)
+                full_write.add(project_id)
+            elif not is_archived:
+                full_access.add(project_id)
+
+        contractor_access = set()
+        contractor_write = set()
+        activities = models.Activity.objects.filter(
+            contractor_id=organization_id).values_list(
+            'project_id', 'project__is_archived',
+            'project__project_type__simple_upload')
+        for project_id, is_archived, simple in activities:
+            if is_archived:
+                continue
+            if uploader:
+                contractor_write.add(project_id)
+            if project_id not in full_access and (uploader or simple):
+                contractor_access.add(project_id)
+
+        return cls(organization_id, full_access, contractor_access,
+                   full_write, contractor_write)
+
+    def to_dict(self):
+        return {
+            'organization_id': self.organization_id,
+            'full_access': sorted(self.full_access),
+            'contractor_access': sorted(self.contractor_access),
+            'full_write': sorted(self.full_write),
+            'contractor_write': sorted(self.contractor_write),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def can_see(self, project, contractor=None):
+        """Like has_access(): can the user see this project, or this
+        contractor's data in it."""
+        project_id = _id(project)
+        if project_id in self.full_access:
+            return True
+        if project_id not in self.contractor_access:
+            return False
+        return contractor is None or _id(contractor) == self.organization_id
+
+    def can_write(self, project, contractor=None):
+        """Like has_write_access()."""
+        project_id = _id(project)
+        if project_id in self.full_write:
+            return True
+        return (contractor is not None and
+                _id(contractor) == self.organization_id and
+                project_id in self.contractor_write)
+
+    def can_see_activity(self, activity):
+        return self.can_see(activity.project_id, activity.contractor_id)
+
+    def visible_project_ids(self):
+        return self.full_access | self.contractor_access
+
+
+def for_user(user, userprofile=None):
+    """Compute the permissions of a user, without caching."""
+    # Need to import here to prevent circular imports
+    from lizard_progress import models
+
+    if userprofile is None:
+        userprofile = models.UserProfile.get_by_user(user)
+    return Permissions.compute(userprofile)
+
+
+def for_request(request, userprofile=None):
+    """Return the permissions of the request's user, from the request,
+    the session if they are still current there, or computed."""
+    permissions = getattr(request, '_lizard_progress_permissions', None)
+    if permissions is not None:
+        return permissions
+
+    # Need to import here to prevent circular imports
+    from lizard_progress import models
+
+    session = getattr(request, 'session', None)
+    user = request.user
+    stored = session.get(SESSION_KEY) if session is not None else None
+
+    if (stored and stored['user_id'] == user.id and
+            stored['versions'] == versions(
+                user.id, stored['permissions']['organization_id'])):
+        permissions = Permissions.from_dict(stored['permissions'])
+    else:
+        if userprofile is None:
+            userprofile = models.UserProfile.get_by_user(user)
+        # Versions before computing, so that changes made in the
+        # meantime make the stored permissions outdated
+        current = userprofile and versions(
+            user.id, userprofile.organization_id)
+        permissions = Permissions.compute(userprofile)
+        if session is not None and userprofile is not None:
+            session[SESSION_KEY] = {
+                'user_id': user.id,
+                'versions': current,
+                'permissions': permissions.to_dict(),
+            }
+
+    request._lizard_progress_permissions = permissions
+    return permissions
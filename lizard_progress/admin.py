@@ -55,6 +55,13 @@ class UploadedFileAdmin(admin.ModelAdmin):
     ordering = ('-uploaded_at',)
 
 
+class UploadBatchAdmin(admin.ModelAdmin):
+    list_display = ('rel_file_path', 'uploaded_by', 'uploaded_at',
+                    'num_files', 'num_succeeded', 'num_failed', 'finished_at')
+    search_fields = ['activity__name', 'rel_file_path']
+    ordering = ('-uploaded_at',)
+
+
 class UploadedFileErrorAdmin(admin.ModelAdmin):
     raw_id_fields = ['uploaded_file']
 
@@ -86,7 +93,7 @@ class AcceptedFileAdmin(admin.ModelAdmin):
 class ReviewProjectAdmin(admin.ModelAdmin):
     list_display = ('name', 'organization', 'contractor', 'project')
     search_fields = ['name', 'organization', 'contractor', 'project']
-    exclude = ['reviews']
+    exclude = ['feature_collection_geojson']
 
 
 class UserProfileAdmin(admin.ModelAdmin):
@@ -111,6 +118,7 @@ admin.site.register(models.ExpectedAttachment, ExpectedAttachmentAdmin)
 admin.site.register(models.MeasurementTypeAllowed)
 admin.site.register(models.Measurement, MeasurementAdmin)
 admin.site.register(models.UploadedFile, UploadedFileAdmin)
+admin.site.register(models.UploadBatch, UploadBatchAdmin)
 admin.site.register(models.UploadedFileError, UploadedFileErrorAdmin)
 admin.site.register(models.UploadLog)
 admin.site.register(models.AcceptedFile, AcceptedFileAdmin)
@@ -0,0 +1,255 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Uploading a zip file as a batch of uploaded files.
+
+Starting a batch only reads the zip's table of contents, and creates an
+UploadedFile for each member. The members are not extracted up front:
+each one is streamed out of the zip by the task that processes it, so a
+large batch is spread over all workers. The tasks are the header of a
+Celery chord; its callback finishes the batch, removes the zip and
+sends one notification for the whole batch.
+
+A chord needs a result backend (CELERY_RESULT_BACKEND). Without one
+the tasks are started on their own, and the task that counts the last
+file finishes the batch. Files that were removed before their task ran
+aren't counted, so the periodic finish_upload_batches_task finishes
+batches that have no files left to process. Either way a batch is
+finished only once."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import datetime
+import logging
+import os
+import shutil
+import zipfile
+import zlib
+
+from celery import chord
+from celery.backends.base import DisabledBackend
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import F
+
+from lizard_progress import models
+from lizard_progress import process_uploaded_file
+from lizard_progress.email_notifications.models import NotificationType
+from lizard_progress.util import directories
+
+logger = logging.getLogger(__name__)
+
+
+def is_batch(path):
+    return path.lower().endswith('.zip')
+
+
+def decoded_name(info):
+    """Zip members have unicode names only if the zip says their names
+    are UTF-8, otherwise the zip format uses code page 437."""
+    if isinstance(info.filename, bytes):
+        return info.filename.decode('cp437')
+    return info.filename
+
+
+def members(zip_file):
+    """Dictionary of the members of zip_file that should be uploaded,
+    keyed by name. Skips directories and the hidden files that some zip
+    tools add."""
+    result = collections.OrderedDict()
+    for info in zip_file.infolist():
+        name = decoded_name(info)
+        basename = os.path.basename(name)
+        if (not basename or basename.startswith('.') or
+                name.startswith('__MACOSX/')):
+            continue
+        result[name] = info
+    return result
+
+
+def member_path(zip_path, index, name):
+    """Where member number index of the zip at zip_path is extracted.
+    Every member gets its own directory, as zip files can contain
+    the same filename in several directories."""
+    return os.path.join(
+        os.path.dirname(zip_path), 'batch', str(index),
+        os.path.basename(name))
+
+
+def start_batch(activity, user, zip_path):
+    """Create an UploadBatch with an UploadedFile for each member of
+    the zip file at zip_path, which should be in a directory of its
+    own. Processing starts when the current transaction has committed.
+
+    Raises zipfile.BadZipfile if it isn't a zip file."""
+    with zipfile.ZipFile(zip_path) as zip_file:
+        names = list(members(zip_file))
+
+    now = datetime.datetime.now()
+    batch = models.UploadBatch.objects.create(
+        activity=activity, uploaded_by=user, uploaded_at=now,
+        rel_file_path=zip_path, num_files=len(names))
+
+    # bulk_create doesn't call save(), so paths are made relative here
+    models.UploadedFile.objects.bulk_create([
+        models.UploadedFile(
+            activity=activity, uploaded_by=user, uploaded_at=now,
+            rel_file_path=directories.relative(
+                member_path(zip_path, index, name)),
+            batch=batch, batch_member=name)
+        for index, name in enumerate(names)])
+
+    uploaded_file_ids = list(
+        batch.uploadedfile_set.values_list('id', flat=True))
+    connection.on_commit(lambda: schedule(batch.id, uploaded_file_ids))
+    return batch
+
+
+def schedule(batch_id, uploaded_file_ids):
+    """Start a task per uploaded file, and finish the batch when they
+    are all done."""
+    # Need to import here to prevent circular imports
+    from lizard_progress import tasks
+
+    if not uploaded_file_ids:
+        # A chord without tasks wouldn't call its callback
+        tasks.finish_upload_batch_task.delay([], batch_id)
+        return
+
+    if isinstance(tasks.finish_upload_batch_task.backend, DisabledBackend):
+        # No chord without a result backend, process_member finishes
+        # the batch
+        for uploaded_file_id in uploaded_file_ids:
+            tasks.process_batch_member_task.delay(uploaded_file_id)
+        return
+
+    chord([tasks.process_batch_member_task.s(uploaded_file_id)
+           for uploaded_file_id in uploaded_file_ids])(
+        tasks.finish_upload_batch_task.s(batch_id))
+
+
+def extract_member(uploaded_file):
+    """Stream uploaded_file's member out of its batch's zip file."""
+    path = uploaded_file.abs_file_path
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    with zipfile.ZipFile(uploaded_file.batch.abs_file_path) as zip_file:
+        info = members(zip_file)[uploaded_file.batch_member]
+        with zip_file.open(info) as source:
+            with open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+
+
+def process_member(uploaded_file_id):
+    """Extract and process one file of a batch, and count it. Errors
+    are recorded on the uploaded file, not raised, so that one bad
+    file doesn't stop the chord."""
+    try:
+        uploaded_file = models.UploadedFile.objects.select_related(
+            'batch').get(pk=uploaded_file_id)
+    except models.UploadedFile.DoesNotExist:
+        return False  # Deleted in the meantime
+
+    try:
+        extract_member(uploaded_file)
+    except (IOError, OSError, KeyError, RuntimeError,
+            zipfile.BadZipfile, zlib.error) as e:
+        logger.exception("Could not extract %s: %s",
+                         uploaded_file.batch_member, e)
+        uploaded_file.ready = True
+        uploaded_file.success = False
+        uploaded_file.linelike = False
+        uploaded_file.save()
+        uploaded_file.uploadedfileerror_set.create(
+            line=0,
+            error_code="EXCEPTION",
+            error_message=(
+                "Bestand {0} kon niet uit het zipbestand gehaald "
+                "worden.".format(uploaded_file.filename))[:300])
+    else:
+        process_uploaded_file.process_uploaded_file(uploaded_file_id)
+
+    success = models.UploadedFile.objects.filter(
+        pk=uploaded_file_id, success=True).exists()
+    counter = 'num_succeeded' if success else 'num_failed'
+    batches = models.UploadBatch.objects.filter(pk=uploaded_file.batch_id)
+    batches.update(**{counter: F(counter) + 1})
+
+    # Don't depend on the chord's callback (it needs a result backend),
+    # the task that counts the last file finishes the batch as well
+    for num_files, num_succeeded, num_failed in batches.values_list(
+            'num_files', 'num_succeeded', 'num_failed'):
+        if num_succeeded + num_failed >= num_files:
+            finish_batch(uploaded_file.batch_id)
+    return success
+
+
+def finish_batch(batch_id):
+    """Set the final counts from the uploaded files (some may have
+    been removed by the user in the meantime), remove the zip file and
+    notify the contractor. Does nothing if the batch was already
+    finished, both the last member task and the chord's callback call
+    this."""
+    # Claim the batch first, so that only one of them notifies
+    if not models.UploadBatch.objects.filter(
+            pk=batch_id, finished_at__isnull=True).update(
+            finished_at=datetime.datetime.now()):
+        return
+
+    try:
+        batch = models.UploadBatch.objects.select_related(
+            'activity', 'activity__project').get(pk=batch_id)
+    except models.UploadBatch.DoesNotExist:
+        return
+
+    uploaded_files = batch.uploadedfile_set.filter(ready=True)
+    batch.num_succeeded = uploaded_files.filter(success=True).count()
+    batch.num_failed = uploaded_files.filter(success=False).count()
+    batch.save()
+
+    try:
+        os.remove(batch.abs_file_path)
+    except OSError:
+        pass
+
+    notify_finished(batch)
+
+
+def finish_stale_batches():
+    """Finish the batches that weren't finished, although none of their
+    files still has to be processed. Returns the number of batches."""
+    batch_ids = list(models.UploadBatch.objects.filter(
+        finished_at__isnull=True).exclude(
+        uploadedfile__ready=False).values_list('id', flat=True))
+    for batch_id in batch_ids:
+        logger.info("Finishing stale upload batch %s", batch_id)
+        finish_batch(batch_id)
+    return len(batch_ids)
+
+
+def notify_finished(batch):
+    activity = batch.activity
+    notification_type = NotificationType.objects.get(
+        name='upload batch verwerkt')
+    upload_link = Site.objects.get_current().domain + reverse(
+        'lizard_progress_uploadhomeview', kwargs={
+            'project_slug': activity.project.slug,
+            'activity_id': activity.id})
+
+    activity.notify_contractors(
+        notification_type,
+        actor=batch.uploaded_by,
+        action_object=batch.filename,
+        target=activity,
+        extra={
+            'link': upload_link,
+            'num_succeeded': batch.num_succeeded,
+            'num_failed': batch.num_failed,
+        })
@@ -13,12 +13,15 @@ import json
 import logging
 
 from django.contrib.auth.models import User
+from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.core.urlresolvers import reverse
 from django.contrib.gis.db import models
 from django.contrib.sites.models import Site
 from django.dispatch import receiver
 
+from lizard_progress import mapdata
+from lizard_progress.changerequests import stats
 from lizard_progress.util import geo
 from lizard_progress import models as pmodels
 from lizard_progress.email_notifications.models import NotificationType
@@ -621,6 +624,18 @@ def message_request_created(sender, instance, created, **kwargs):
             instance.get_absolute_url()})
 
 
+@receiver(post_save, sender=Request)
+@receiver(post_delete, sender=Request)
+def forget_request_map_data(sender, instance, **kwargs):
+    mapdata.forget_activity(instance.activity_id)
+
+
+@receiver(post_save, sender=Request)
+@receiver(post_delete, sender=Request)
+def forget_request_stats(sender, instance, **kwargs):
+    stats.forget()
+
+
 @receiver(post_save, sender=RequestComment)
 def message_request_comment_created(sender, instance, created, **kwargs):
     notification_type = NotificationType.objects.get(
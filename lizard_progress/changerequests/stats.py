@@ -0,0 +1,111 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Numbers of change requests per project, activity and contractor.
+
+The project list and the dashboards show the number of open requests
+of every project and activity. RequestStats counts them for a set of
+projects with one grouped query, and keeps the result in the cache for
+a short while. Saving or deleting a request renews the version of
+the counts (see versions.py), so counts from before that aren't used
+anymore."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from lizard_progress import versions as cache_versions
+
+VERSION_KEY = 'lizard_progress_request_stats_version'
+
+
+def cache_timeout():
+    return getattr(
+        settings, 'LIZARD_PROGRESS_REQUEST_STATS_CACHE_TIMEOUT', 60)
+
+
+def forget():
+    """Counts in the cache aren't used anymore."""
+    cache_versions.renew([VERSION_KEY])
+
+
+def version():
+    return cache_versions.get(VERSION_KEY)
+
+
+def _id(instance):
+    """Both model instances and their ids can be given."""
+    return getattr(instance, 'id', instance)
+
+
+class RequestStats(object):
+    """Counts of requests per (project_id, activity_id, contractor_id,
+    request_status)."""
+
+    def __init__(self, rows=()):
+        self.rows = [tuple(row) for row in rows]
+
+    @classmethod
+    def compute(cls, project_ids):
+        # Need to import here to prevent circular imports
+        from lizard_progress.changerequests.models import Request
+
+        return cls(Request.objects.filter(
+            activity__project_id__in=project_ids).values_list(
+            'activity__project_id', 'activity_id',
+            'activity__contractor_id', 'request_status').annotate(
+            Count('id')).order_by())
+
+    @classmethod
+    def for_projects(cls, project_ids):
+        """Return the stats of these projects, from the cache if
+        possible."""
+        project_ids = sorted(set(_id(project) for project in project_ids))
+        if not project_ids:
+            return cls()
+
+        key = 'lizard_progress_request_stats_{}_{}'.format(
+            version(), hashlib.sha1(
+                ','.join(str(i) for i in project_ids)).hexdigest())
+        rows = cache.get(key)
+        if rows is None:
+            stats = cls.compute(project_ids)
+            cache.set(key, stats.rows, cache_timeout())
+            return stats
+        return cls(rows)
+
+    def count(self, statuses, project=None, activity=None, contractor=None):
+        """Number of requests with one of these statuses, in this project
+        and/or activity and/or of this contractor."""
+        project_id, activity_id, contractor_id = (
+            _id(project), _id(activity), _id(contractor))
+        return sum(
+            n for (row_project_id, row_activity_id, row_contractor_id,
+                   status, n) in self.rows
+            if status in statuses and
+            (project is None or row_project_id == project_id) and
+            (activity is None or row_activity_id == activity_id) and
+            (contractor is None or row_contractor_id == contractor_id))
+
+    def open(self, **kwargs):
+        from lizard_progress.changerequests.models import Request
+        return self.count((Request.REQUEST_STATUS_OPEN,), **kwargs)
+
+    def closed(self, **kwargs):
+        """Accepted, refused or withdrawn."""
+        from lizard_progress.changerequests.models import Request
+        return self.count((Request.REQUEST_STATUS_ACCEPTED,
+                           Request.REQUEST_STATUS_REFUSED,
+                           Request.REQUEST_STATUS_WITHDRAWN), **kwargs)
+
+    def invalid(self, **kwargs):
+        from lizard_progress.changerequests.models import Request
+        return self.count((Request.REQUEST_STATUS_INVALID,), **kwargs)
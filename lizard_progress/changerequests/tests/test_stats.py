@@ -0,0 +1,77 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Tests for changerequests stats."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from django.core.cache import cache
+
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests import test_models as progresstestmodels
+from lizard_progress.changerequests import models
+from lizard_progress.changerequests import stats
+from lizard_progress.changerequests.stats import RequestStats
+from lizard_progress.changerequests.tests.test_models import RequestF
+
+
+class TestRequestStats(FixturesTestCase):
+    def setUp(self):
+        cache.clear()
+        self.activity = progresstestmodels.ActivityF.create()
+        self.project = self.activity.project
+        self.other_activity = progresstestmodels.ActivityF.create(
+            name='Other activity', project=self.project,
+            contractor=progresstestmodels.OrganizationF.create(
+                name='Other contractor'))
+
+        RequestF.create(activity=self.activity)
+        RequestF.create(activity=self.activity)
+        RequestF.create(
+            activity=self.activity,
+            request_status=models.Request.REQUEST_STATUS_REFUSED)
+        RequestF.create(activity=self.other_activity)
+        RequestF.create(
+            activity=self.other_activity,
+            request_status=models.Request.REQUEST_STATUS_INVALID)
+
+    def test_counts(self):
+        stats = RequestStats.for_projects([self.project])
+        self.assertEquals(stats.open(project=self.project), 3)
+        self.assertEquals(stats.open(activity=self.activity), 2)
+        self.assertEquals(
+            stats.open(contractor=self.other_activity.contractor), 1)
+        self.assertEquals(stats.closed(project=self.project), 1)
+        self.assertEquals(stats.invalid(activity=self.activity), 0)
+        self.assertEquals(stats.invalid(activity=self.other_activity), 1)
+
+    def test_counted_in_one_query_and_cached(self):
+        stats.version()
+        # The version and the counts
+        with self.assertNumQueries(2):
+            RequestStats.for_projects([self.project.id])
+        with self.assertNumQueries(1):
+            RequestStats.for_projects([self.project.id])
+
+    def test_renewed_for_processes_with_their_own_cache(self):
+        RequestStats.for_projects([self.project])
+        version = stats.version()
+        stats.forget()
+        cache.clear()
+        self.assertNotEquals(stats.version(), version)
+
+    def test_saving_a_request_renews_the_counts(self):
+        RequestStats.for_projects([self.project])
+        RequestF.create(activity=self.activity)
+        self.assertEquals(
+            RequestStats.for_projects([self.project]).open(
+                activity=self.activity), 3)
+
+    def test_no_projects(self):
+        with self.assertNumQueries(0):
+            stats = RequestStats.for_projects([])
+        self.assertEquals(stats.open(), 0)
@@ -11,6 +11,7 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+from collections import Mapping
 from collections import namedtuple
 
 from lizard_progress import errors
@@ -298,7 +299,7 @@ CONFIG_OPTIONS = {
             'de kaart.'
         ),
         type='boolean',
-        default=False,
+        default='',
         only_for_error=None,
         for_project=False,
         applies_to_measurement_types=['ribx_reiniging_kolken'],
@@ -306,6 +307,27 @@ CONFIG_OPTIONS = {
 }
 
 
+class ConfigurationSnapshot(Mapping):
+    """Read-only mapping from option names to their translated values,
+    as they were when the snapshot was made.
+
+    Parsers check the same options for every line of a file, looking
+    them up one by one costs several queries each time. A snapshot
+    resolves all of them at once, see Configuration.snapshot()."""
+
+    def __init__(self, values):
+        self.__values = dict(values)
+
+    def __getitem__(self, config_option):
+        return self.__values[config_option]
+
+    def __iter__(self):
+        return iter(self.__values)
+
+    def __len__(self):
+        return len(self.__values)
+
+
 class Configuration(object):
     def __init__(
             self, organization=None, activity=None, project=None,
@@ -391,14 +413,151 @@ class Configuration(object):
             activity_config.save()
         return option.translate(activity_config.value)
 
+    def snapshot(self):
+        """Return a ConfigurationSnapshot. Activities and projects keep
+        theirs until an option is set, see
+        ProjectActivityMixin.config_snapshot."""
+        if self.activity:
+            return self.activity.config_snapshot
+        elif self.project:
+            return self.project.config_snapshot
+        else:
+            return self.build_snapshot()
+
+    def build_snapshot(self):
+        """Resolve all options in a fixed number of queries.
+
+        This gives the same values as calling get() for each option,
+        and like get() it saves the values copied from the
+        organization. For a project, only the options that are
+        for_project are included."""
+        project_options = [
+            option for option in CONFIG_OPTIONS.values()
+            if option.for_project]
+
+        if self.activity:
+            values = self._copied_values(
+                models.ActivityConfig.objects.filter(activity=self.activity),
+                lambda **kwargs: models.ActivityConfig(
+                    activity=self.activity, **kwargs),
+                [option for option in CONFIG_OPTIONS.values()
+                 if not option.for_project],
+                self.activity.project.organization,
+                self.activity.measurement_type)
+            project = self.activity.project
+        elif self.project:
+            values = {}
+            project = self.project
+        else:
+            values = self._organization_values(
+                self.organization, self.measurement_type,
+                CONFIG_OPTIONS.values())
+            project = None
+
+        if project is not None:
+            values.update(self._copied_values(
+                models.ProjectConfig.objects.filter(project=project),
+                lambda **kwargs: models.ProjectConfig(
+                    project=project, **kwargs),
+                project_options, project.organization, None))
+
+        return ConfigurationSnapshot(
+            (key, CONFIG_OPTIONS[key].translate(value))
+            for key, value in values.items())
+
+    @staticmethod
+    def _organization_values(organization, measurement_type, options):
+        """Return a dict of untranslated values of the options for this
+        organization. Like get_organization(), save defaults for
+        options that don't have a value yet."""
+        existing = dict(
+            ((config.config_option, config.measurement_type_id), config)
+            for config in models.OrganizationConfig.objects.filter(
+                organization=organization,
+                config_option__in=[option.option for option in options]))
+
+        values = {}
+        new_configs = []
+        for option in options:
+            option_measurement_type = (
+                None if option.all_measurement_types else measurement_type)
+            config = existing.get((
+                option.option,
+                option_measurement_type and option_measurement_type.id))
+
+            if config is None:
+                config = models.OrganizationConfig(
+                    organization=organization,
+                    measurement_type=option_measurement_type,
+                    config_option=option.option,
+                    value=option.default)
+                new_configs.append(config)
+            elif config.value is None:
+                config.value = option.default
+                config.save()
+            values[option.option] = config.value
+
+        if new_configs:
+            models.OrganizationConfig.objects.bulk_create(new_configs)
+        return values
+
+    @classmethod
+    def _copied_values(
+            cls, queryset, make_config, options, organization,
+            measurement_type):
+        """Return a dict of untranslated values of the options in
+        queryset (the ActivityConfig or ProjectConfig rows of one
+        object). Like get_activity() and get_project(), options that
+        don't have a value yet get the organization's value, which is
+        then saved."""
+        existing = dict(
+            (config.config_option, config) for config in
+            queryset.filter(
+                config_option__in=[option.option for option in options]))
+
+        values = {}
+        missing = []
+        for option in options:
+            config = existing.get(option.option)
+            if config is None or config.value is None:
+                missing.append(option)
+            else:
+                values[option.option] = config.value
+
+        if not missing:
+            return values
+
+        organization_values = cls._organization_values(
+            organization, measurement_type, missing)
+
+        new_configs = []
+        for option in missing:
+            value = organization_values[option.option]
+            config = existing.get(option.option)
+            if config is None:
+                new_configs.append(make_config(
+                    config_option=option.option, value=value))
+            else:
+                config.value = value
+                config.save()
+            values[option.option] = value
+
+        if new_configs:
+            queryset.model.objects.bulk_create(new_configs)
+        return values
+
     def set(self, option, value):
-        """Save some configuration option to this value, and save it"""
+        """Save some configuration option to this value, and save it.
+        The activity's or project's snapshot is out of date after
+        this, so it is forgotten."""
         if self.activity:
-            return self.set_activity(option, value)
+            self.set_activity(option, value)
+            self.activity.forget_config_snapshot()
         elif self.project:
-            return self.set_project(option, value)
+            self.set_project(option, value)
+            self.project.forget_config_snapshot()
         else:
-            return self.set_organization(option, value)
+            self.set_organization(option, value)
 
     def set_activity(self, option, value):
         """Save a configuration option that was set for a project"""
@@ -446,17 +605,18 @@ class Configuration(object):
             measurement_type=measurement_type)
 
         want_for_project = self.project is not None
+        snapshot = self.snapshot()
 
         for (option_key, option) in sorted(CONFIG_OPTIONS.iteritems()):
             if (option.for_project == want_for_project and
                     option.applies_to_errors(error_config) and
                     (self.organization or option.applies_to(
                         measurement_type))):
-                yield (option, self.get(option.option))
+                yield (option, snapshot[option.option])
 
 
 def get(activity, config_option, project=None):
     """Helper function, this is a common way to use this module."""
 
     configuration = Configuration(activity=activity, project=project)
-    return configuration.get(config_option)
+    return configuration.snapshot()[config_option]
@@ -0,0 +1,145 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Progress counters of activities and projects.
+
+An activity stores its number of locations, complete locations and
+measurements, a project the sums of the location counters of its
+activities, so that the project list and the dashboards don't count
+them on every request. Locations that aren't part of the project
+(not_part_of_project) and their measurements aren't counted.
+
+Saving or deleting a Location or Measurement adjusts the counters in
+the same transaction through signals, code that changes them with
+queryset updates or bulk_create should call recount() itself. The
+recount_progress management command recounts all of them."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from django.db import connection
+
+# The WHERE clauses are repeated inside the subqueries, so that
+# recounting a single activity doesn't count all the others.
+RECOUNT_ACTIVITIES = """
+update lizard_progress_activity a set
+  location_count = coalesce(l.location_count, 0),
+  complete_location_count = coalesce(l.complete_location_count, 0),
+  measurement_count = coalesce(m.measurement_count, 0)
+from lizard_progress_activity a2
+left join (
+  select activity_id, count(*) as location_count,
+    count(*) filter (where complete) as complete_location_count
+  from lizard_progress_location
+  where not not_part_of_project {location_where}
+  group by activity_id) l on l.activity_id = a2.id
+left join (
+  select l.activity_id, count(*) as measurement_count
+  from lizard_progress_measurement m
+  join lizard_progress_location l on m.location_id = l.id
+  where not l.not_part_of_project {location_where}
+  group by l.activity_id) m on m.activity_id = a2.id
+where a.id = a2.id {activity_where}
+"""
+
+RECOUNT_PROJECTS = """
+update lizard_progress_project p set
+  location_count = coalesce(a.location_count, 0),
+  complete_location_count = coalesce(a.complete_location_count, 0)
+from lizard_progress_project p2
+left join (
+  select project_id, sum(location_count) as location_count,
+    sum(complete_location_count) as complete_location_count
+  from lizard_progress_activity
+  {project_where}
+  group by project_id) a on a.project_id = p2.id
+where p.id = p2.id {and_project_where}
+"""
+
+ADJUST = """
+with a as (
+  update lizard_progress_activity set
+    location_count = location_count + %s,
+    complete_location_count = complete_location_count + %s
+  where id = %s
+  returning project_id)
+update lizard_progress_project set
+  location_count = location_count + %s,
+  complete_location_count = complete_location_count + %s
+where id in (select project_id from a)
+"""
+
+ADJUST_MEASUREMENTS = """
+update lizard_progress_activity set
+  measurement_count = measurement_count + %s
+where id = (
+  select activity_id from lizard_progress_location
+  where id = %s and not not_part_of_project)
+"""
+
+
+def recount(activity_ids=None):
+    """Count the locations and measurements of these activities (all
+    activities if activity_ids is None) and those of their projects
+    again, with one UPDATE for the activities and one for the
+    projects."""
+    cursor = connection.cursor()
+
+    if activity_ids is None:
+        cursor.execute(RECOUNT_ACTIVITIES.format(
+            location_where='', activity_where=''))
+        cursor.execute(RECOUNT_PROJECTS.format(
+            project_where='', and_project_where=''))
+        return
+
+    activity_ids = list(activity_ids)
+    if not activity_ids:
+        return
+
+    cursor.execute(RECOUNT_ACTIVITIES.format(
+        location_where='and activity_id = any(%s)',
+        activity_where='and a2.id = any(%s)'),
+        [activity_ids, activity_ids, activity_ids])
+
+    project_where = (
+        'project_id in (select project_id from lizard_progress_activity '
+        'where id = any(%s))')
+    cursor.execute(RECOUNT_PROJECTS.format(
+        project_where='where ' + project_where,
+        and_project_where='and p2.id in (select project_id from '
+        'lizard_progress_activity where id = any(%s))'),
+        [activity_ids, activity_ids])
+
+
+def adjust(activity_id, locations=0, complete_locations=0):
+    """Add to the location counters of an activity and its project."""
+    if activity_id is None or not (locations or complete_locations):
+        return
+    connection.cursor().execute(ADJUST, [
+        locations, complete_locations, activity_id,
+        locations, complete_locations])
+
+
+def adjust_measurements(location_id, measurements):
+    """Add to the measurement counter of the activity of this location,
+    if the location is part of its project."""
+    if location_id is None:
+        return
+    connection.cursor().execute(
+        ADJUST_MEASUREMENTS, [measurements, location_id])
+
+
+def location_counts(location):
+    """Return what this location adds to the counters of its activity as
+    (activity_id, part_of_project, complete), the last two as 0 or 1.
+    If the fields haven't been loaded (deferred), return None."""
+    fields = location.__dict__
+    if not all(key in fields for key in (
+            'activity_id', 'not_part_of_project', 'complete')):
+        return None
+    part_of_project = int(not fields['not_part_of_project'])
+    return (fields['activity_id'], part_of_project,
+            part_of_project * int(bool(fields['complete'])))
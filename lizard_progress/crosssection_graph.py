@@ -10,13 +10,23 @@ from __future__ import absolute_import
 from __future__ import division
 
 
+from django.conf import settings
+from django.db import connection
 from fractions import Fraction
 from lizard_progress import models
+from lizard_progress.util import directories
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from metfilelib.util.linear_algebra import Line, Point
 import colorsys
+import hashlib
 import itertools
 import math
+import os
+import tempfile
+
+# Rendered graphs are cached in this directory, relative to
+# directories.BASE_DIR so that the webserver can send them
+CACHE_DIRNAME = 'crosssection_graphs'
 
 
 class PlottingData:
@@ -92,12 +102,13 @@ class PlottingData:
         return line, left, right, p1['bottom']
 
 
-def locations_close_by_graph(organization, location):
-    """Return a graph of locations that within 'distance' meters to this
-    one, in any project of this organization.
+def close_by_measurements(location):
+    """Return the measurements of cross sections that are within
+    Location.CLOSE_BY_DISTANCE meters of this one, in any project of
+    the same organization.
 
     """
-    return graph(location, (
+    return [
         measurement for measurement in
         models.Measurement.objects.filter(
             location__in=location.close_by_locations_of_same_organisation()
@@ -107,7 +118,14 @@ def locations_close_by_graph(organization, location):
             'location__activity__measurement_type',
             'location__activity__project')
         if (measurement.location.activity.measurement_type.implementation_slug
-            == 'dwarsprofiel')))
+            == 'dwarsprofiel')]
+
+
+def location_measurements(location):
+    """Return the measurements shown in the graph of this location."""
+    return list(models.Measurement.objects.filter(
+        location=location).select_related(
+        'location', 'location__activity', 'location__activity__project'))
 
 
 def graph(location, measurements):
@@ -167,6 +185,132 @@ def graph(location, measurements):
     return canvas
 
 
+def cache_size():
+    """Maximum size in bytes of the graph cache."""
+    return getattr(
+        settings, 'LIZARD_PROGRESS_GRAPH_CACHE_SIZE', 500 * 1024 * 1024)
+
+
+def cache_path(location, measurements):
+    """Relative path of the cached graph of these measurements at this
+    location. It includes a hash of the ids and timestamps of the
+    measurements, so a graph is rendered again when they change."""
+    digest = hashlib.sha1(';'.join(
+        '{}:{}'.format(m.id, m.timestamp.isoformat())
+        for m in sorted(measurements, key=lambda m: m.id)).encode('utf-8')
+    ).hexdigest()
+    return os.path.join(
+        CACHE_DIRNAME, '{}-{}.png'.format(location.id, digest))
+
+
+def cached_graph(location, measurements):
+    """Return the relative path of a PNG of the graph of these
+    measurements, rendering it only if it isn't in the cache yet.
+
+    The modification time of a cached file is the last time it was
+    used, see evict(). The cache is not evicted here, that is done
+    periodically by the evict_crosssection_graphs_task."""
+    measurements = sorted(measurements, key=lambda m: m.id)
+    path = cache_path(location, measurements)
+    abs_path = directories.absolute(path)
+
+    try:
+        os.utime(abs_path, None)
+        return path
+    except OSError:
+        pass  # Not cached
+
+    canvas = graph(location, measurements)
+
+    # Write to a temporary file first, so that a half written graph is
+    # never served
+    fd, tmp_path = tempfile.mkstemp(
+        suffix='.tmp', dir=directories.mk_abs(CACHE_DIRNAME))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            canvas.print_png(f)
+        # mkstemp() makes the file readable for us only, but it is sent
+        # by the web server (see protected_file_response)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, abs_path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+    return path
+
+
+def cached_graph_content(location, measurements):
+    """Return the cached graph as a PNG string."""
+    with open(directories.absolute(
+            cached_graph(location, measurements)), 'rb') as f:
+        return f.read()
+
+
+def evict(max_size=None):
+    """Remove the least recently used graphs until the cache is no larger
+    than max_size bytes (default cache_size()). Returns the number of
+    removed graphs."""
+    if max_size is None:
+        max_size = cache_size()
+
+    cache_dir = directories.absolute(CACHE_DIRNAME)
+    if not os.path.isdir(cache_dir):
+        return 0
+    files = []
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith('.png'):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, filename))
+        except OSError:
+            continue  # Removed in the meantime
+        files.append((stat.st_mtime, stat.st_size, filename))
+
+    total = sum(size for mtime, size, filename in files)
+    removed = 0
+    for mtime, size, filename in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, filename))
+            removed += 1
+        except OSError:
+            pass
+        total -= size
+    return removed
+
+
+def render_graphs(location_ids):
+    """Put the graphs of these locations in the cache, and their graphs
+    of close by cross sections in other projects if they have them.
+    Called in the background after an upload, so that the map popups
+    don't have to render them."""
+    for location in models.Location.objects.filter(id__in=location_ids):
+        measurements = location_measurements(location)
+        if not measurements:
+            continue
+        cached_graph(location, measurements)
+
+        close_by = close_by_measurements(location)
+        if len(set(m.location_id for m in close_by)) > 1:
+            cached_graph(location, close_by)
+
+
+def schedule_rendering(activity, location_ids):
+    """If this activity has cross sections, render the graphs of these
+    locations in a task once the current transaction has committed."""
+    # Need to import here to prevent circular imports
+    from lizard_progress import tasks
+
+    if activity.measurement_type.implementation_slug != 'dwarsprofiel':
+        return
+
+    location_ids = sorted(location_ids)
+    connection.on_commit(
+        lambda: tasks.render_crosssection_graphs_task.delay(location_ids))
+
+
 # Create different colors for the graphs.
 
 # Color code taken from Stack Overflow answer by Janus Troelsen at
@@ -21,23 +21,31 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+import collections
+import copy
 import csv
+import io
+import itertools
 import os
 import pkg_resources
 import shutil
+import struct
 import tempfile
 import zipfile
 
-from lxml import etree, objectify
+from django.conf import settings
+from lxml import etree
+import billiard
 import shapefile
 
+from metfilelib.parser import parse_metfile
 from metfilelib.util import dxf
+from metfilelib.util import file_reader
 from metfilelib.util import retrieve_profile
 from metfilelib import exporters
 from lizard_progress import errors
 from lizard_progress import models
 from lizard_progress import lizard_export
-from lizard_progress import configuration
 
 import logging
 
@@ -65,13 +73,18 @@ def start_run(export_run_id, user):
     export_run.clear()
     export_run.record_start(user)
 
+    # Exports that write zip files return a manifest that includes
+    # their entries, for the others we record which measurements there
+    # were when we started.
+    manifest = export_run.current_manifest()
+
     try:
         if export_run.exporttype == "met":
             export_as_metfile(export_run)
         elif export_run.exporttype == "dxf":
-            export_as_dxf(export_run)
+            manifest = export_as_dxf(export_run)
         elif export_run.exporttype == "csv":
-            export_as_csv(export_run)
+            manifest = export_as_csv(export_run)
         elif export_run.exporttype == "pointshape":
             export_as_shapefile(export_run, 'point')
         elif export_run.exporttype == "drainshape":
@@ -87,7 +100,7 @@ def start_run(export_run_id, user):
         elif export_run.exporttype == 'mergeribx':
             export_mergeribx(export_run)
         else:
-            export_all_files(export_run)
+            manifest = export_all_files(export_run)
     except:
         logger.exception('Fout in export run met id: %s', str(export_run.id))
         # Catch-all except, because this is meant to catch all the
@@ -95,29 +108,158 @@ def start_run(export_run_id, user):
         export_run.fail("Onbekende fout, export mislukt")
         return
 
+    export_run.manifest = manifest
     export_run.set_ready_for_download()
 
 
 def export_all_files(export_run):
     """Collect all the most recent (non-updated) files, and put them
-    in a .zip file."""
+    in a .zip file. Files that were in the previous zip file are copied
+    from there, see update_zipfile()."""
 
     zipfile_path = export_run.abs_export_filename(extension="zip")
+    logger.debug(zipfile_path)
 
+    def write_files(z, measurements):
+        entries = {}
+        written = set()
+        for measurement in sorted(
+                measurements, key=lambda m: m.abs_file_path):
+            file_path = measurement.abs_file_path
+            entries[measurement.id] = os.path.basename(file_path)
+            if file_path not in written:
+                logger.debug("Files to add to zipfile: " + str(file_path))
+                z.write(file_path, os.path.basename(file_path))
+                written.add(file_path)
+        return entries
+
+    return update_zipfile(
+        export_run, zipfile_path, export_run.measurements_to_export(),
+        write_files)
+
+
+def update_zipfile(export_run, zipfile_path, measurements, write_entries):
+    """Write the zip file of export_run and return its new manifest.
+
+    write_entries(zipfile, measurements) writes the entries for the
+    given measurements and returns a dictionary of measurement id ->
+    entry name (None for measurements that didn't get an entry).
+
+    If the previous run left a zip file and a manifest, it is only
+    called for the measurements that are new or have a different
+    timestamp; the entries of the others are copied from the previous
+    zip file without compressing them again. The new file is written
+    next to the old one and then moved in its place."""
     if not os.path.isdir(os.path.dirname(zipfile_path)):
         os.makedirs(os.path.dirname(zipfile_path))
 
-    logger.debug(zipfile_path)
-
-    with open_zipfile(zipfile_path) as z:
-        for file_path in sorted(export_run.abs_files_to_export()):
-            logger.debug("Files to add to zipfile: " + str(file_path))
-            z.write(file_path, os.path.basename(file_path))
+    old_zipfile_path = None
+    old_zipfile = None
+    if (export_run.manifest and export_run.rel_file_path and
+            os.path.exists(export_run.abs_file_path)):
+        old_zipfile_path = export_run.abs_file_path
+        try:
+            old_zipfile = zipfile.ZipFile(old_zipfile_path)
+        except zipfile.BadZipfile:
+            logger.warn("Can't reuse %s, not a zip file", old_zipfile_path)
+
+    old_manifest = (
+        export_run.manifest['measurements'] if old_zipfile is not None
+        else {})
+    old_entries = (
+        set(old_zipfile.namelist()) if old_zipfile is not None else set())
+
+    measurements = list(measurements)
+    entries = {}
+    changed = []
+    for measurement in measurements:
+        old = old_manifest.get(unicode(measurement.id))
+        if (old is not None and
+                old['timestamp'] == measurement.timestamp.isoformat() and
+                (old['entry'] is None or old['entry'] in old_entries)):
+            entries[measurement.id] = old['entry']
+        else:
+            changed.append(measurement)
 
+    new_zipfile_path = zipfile_path + '.new'
+    try:
+        with open_zipfile(new_zipfile_path) as z:
+            new_entries = write_entries(z, changed)
+            # Entries that were written again are not copied
+            copy_zip_entries(
+                old_zipfile, z,
+                set(entry for entry in entries.values()
+                    if entry is not None) -
+                set(entry for entry in new_entries.values()
+                    if entry is not None))
+    finally:
+        if old_zipfile is not None:
+            old_zipfile.close()
+
+    os.rename(new_zipfile_path, zipfile_path)
+    if (old_zipfile_path is not None and os.path.exists(old_zipfile_path) and
+            not os.path.samefile(old_zipfile_path, zipfile_path)):
+        os.remove(old_zipfile_path)
+
+    logger.info("Wrote %s entries and kept %s entries in %s",
+                len(changed), len(measurements) - len(changed), zipfile_path)
+
+    entries.update(new_entries)
     export_run.rel_file_path = zipfile_path
     # ^^ absolute path is converted to relative path in the model's save method
     export_run.save()
 
+    return export_run.make_manifest(
+        (measurement.id, measurement.timestamp, entries.get(measurement.id))
+        for measurement in measurements)
+
+
+def copy_zip_entries(source, target, names):
+    """Copy the entries with the given names from the opened ZipFile
+    source to the ZipFile target that is being written. The compressed
+    data is copied as it is, with the entry's CRC, date and compression,
+    so unchanged entries are never decompressed or compressed again."""
+    if source is None or not names:
+        return
+
+    for info in source.infolist():
+        if info.filename not in names:
+            continue
+
+        # The data follows the local header, whose name and extra field
+        # may differ in length from the central directory's
+        source.fp.seek(info.header_offset)
+        header = source.fp.read(zipfile.sizeFileHeader)
+        if (len(header) != zipfile.sizeFileHeader or
+                header[:4] != zipfile.stringFileHeader):
+            raise zipfile.BadZipfile(
+                "Bad local header of {}".format(info.filename))
+        header = struct.unpack(zipfile.structFileHeader, header)
+        source.fp.seek(
+            header[zipfile._FH_FILENAME_LENGTH] +
+            header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+        copied = copy.copy(info)
+        # CRC and sizes are known, so they go in the local header and
+        # not in a data descriptor after the data
+        copied.flag_bits &= ~0x08
+        copied.header_offset = target.fp.tell()
+        target.fp.write(copied.FileHeader())
+
+        remaining = info.compress_size
+        while remaining > 0:
+            data = source.fp.read(min(remaining, 1024 * 1024))
+            if not data:
+                raise zipfile.BadZipfile(
+                    "Data of {} is truncated".format(info.filename))
+            target.fp.write(data)
+            remaining -= len(data)
+
+        # What ZipFile.write() does after writing an entry
+        target.filelist.append(copied)
+        target.NameToInfo[copied.filename] = copied
+        target._didModify = True
+
 
 class RibxElementAnalyzer(object):
     """This class was built specifically for merging Ribx files. It
@@ -187,108 +329,134 @@ class RibxElementAnalyzer(object):
         except:
             return None
 
-    def has_duplicate_ref(self, other_element):
-        other_refs = self.get_ref(other_element, depth=1, _all=True)
-        return self.ref in other_refs
-
-    def has_duplicate_time(self, other_element):
-        other_times = self.get_inspection_time(
-            other_element, depth=1, _all=True)
-        if not self.inspection_time and not other_times:
-            return True
-        return self.inspection_time in other_times
-
-    def has_duplicate_date(self, other_element):
-        other_dates = self.get_inspection_date(
-            other_element, depth=1, _all=True)
-        if not self.inspection_date and not other_dates:
-            return True
-        return self.inspection_date in other_dates
-
-    def has_duplicate_manhole_start(self, other_element):
-        other_manholes = self.get_manhole_start(
-            other_element, depth=1, _all=True)
-        if not self.manhole_start and not other_manholes:
-            return True
-        return self.manhole_start in other_manholes
+    @property
+    def key(self):
+        """Activities with the same key are the same activity, this is
+        used to leave out the activities of older Ribx files that are
+        in newer ones already."""
+        return (self.activity_type, self.ref, self.inspection_date,
+                self.inspection_time, self.manhole_start)
 
     @property
     def is_activity(self):
         return bool(self.activity_type)
 
 
-def merge_ribx(ribx_files):
-    """Merge ribx files into one ElementTree.
+def merge_ribx(ribx_files, merged_ribx_path):
+    """Merge ribx files into one Ribx file.
 
     NOTE: we expect the ribx_files to be sorted by descending date
     already.
 
+    Everything in the first file is kept. Of the other files only the
+    activities are added that aren't in the merged file yet, that is
+    that have a different key (type, reference, date, time and start
+    manhole, see RibxElementAnalyzer.key).
+
+    The files are read element by element with iterparse, and the
+    merged file is written while reading them; only the keys of the
+    activities are kept in memory.
+
     Args:
         ribx_files: a list of ribx file paths sorted by descending date
+        merged_ribx_path: the path to write the merged file to
 
     Returns:
-        a tuple: (lxml.etree.ElementTree, error_msg). If no merged Ribx can
-        be produced the ElementTree is None and the error_msg will contain
-        the reason.
+        an error message, or "" if the merged Ribx was written. If no
+        merged Ribx can be produced the error message contains the
+        reason.
     """
     if not ribx_files:
-        return (None, "Geen Ribx bestanden gevonden.")
-
-    merged_elems = None  # the <DATA> wrapper element
-    for ribxfile in ribx_files:
-        # Parser that ignores comments
-        parser = objectify.makeparser(remove_comments=True)
-        tree = objectify.parse(ribxfile, parser=parser)
-        data = tree.getroot()
-
-        # Set root with initial data in the first loop
-        if merged_elems is None:
-            merged_elems = data
+        return "Geen Ribx bestanden gevonden."
+
+    keys = set()
+    mandatory_tags = set()
+
+    temp_path = merged_ribx_path + '.new'
+    with open(temp_path, 'wb') as output:
+        output.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+        root_start = root_end = None
+
+        for file_index, ribxfile in enumerate(ribx_files):
+            for root, elem in iter_ribx_elements(ribxfile):
+                if root_start is None:
+                    root_start, root_end = ribx_root_tags(root)
+                    output.write(root_start)
+
+                rea = RibxElementAnalyzer(elem)
+                if rea.is_activity:
+                    if file_index > 0 and rea.key in keys:
+                        continue
+                    keys.add(rea.key)
+                elif file_index > 0:
+                    continue
+
+                for tag in ('A2', 'A6'):
+                    if elem.find(tag) is not None:
+                        mandatory_tags.add(tag)
+
+                elem.tail = None
+                output.write(etree.tostring(
+                    elem, encoding='UTF-8', xml_declaration=False,
+                    pretty_print=True))
+
+        if root_end is not None:
+            output.write(root_end)
+
+    # Check some mandatory tags
+    if mandatory_tags != set(['A2', 'A6']):
+        logger.error("No A2 and/or A6 tag in Ribx.")
+        os.remove(temp_path)
+        return "Geen A2 en/of A6 tag in Ribx"
+
+    os.rename(temp_path, merged_ribx_path)
+    return ""
+
+
+def iter_ribx_elements(ribx_file):
+    """Yield (root, element) for each child element of the root of a Ribx
+    file. Elements are removed from memory after they have been used."""
+    depth = 0
+    for event, elem in etree.iterparse(
+            ribx_file, events=('start', 'end'),
+            remove_comments=True, remove_blank_text=True):
+        if event == 'start':
+            depth += 1
             continue
 
-        for elem in data.getchildren():
-            rea = RibxElementAnalyzer(elem)
-            if not rea.is_activity:
-                continue
-            # import pdb; pdb.set_trace()
-            if (rea.has_duplicate_ref(merged_elems) and
-                    rea.has_duplicate_date(merged_elems) and
-                    rea.has_duplicate_time(merged_elems) and
-                    rea.has_duplicate_manhole_start(merged_elems)):
-                continue
-            merged_elems.append(elem)
+        depth -= 1
+        if depth == 1:
+            yield elem.getparent(), elem
+            # Remove it and any earlier siblings
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
 
-    # Check some mandatory tags
-    try:
-        language = merged_elems.xpath('/*/*/A2')[0]
-        ribx_version = merged_elems.xpath('/*/*/A6')[0]
-        logger.debug("A2: %s, A6: %s", language, ribx_version)
-    except IndexError:
-        logger.exception("No A2 and/or A6 tag in Ribx.")
-        return (None, "Geen A2 en/of A6 tag in Ribx")
 
-    return (etree.ElementTree(merged_elems), "")
+def ribx_root_tags(root):
+    """Return the start and end tag of an element, with its attributes and
+    namespace declarations, but without its children."""
+    shell = etree.Element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+    shell.text = '\n'
+    serialized = etree.tostring(
+        shell, encoding='UTF-8', xml_declaration=False)
+    end = serialized.rindex(b'</')
+    return serialized[:end], serialized[end:] + b'\n'
 
 
 def export_mergeribx(export_run):
     ribx_files = [
         f for f in export_run.all_measurement_files_by_desc_timestamp() if
         f.endswith('ribx')]
-    merged_ribx, error_msg = merge_ribx(ribx_files)
-
-    if not merged_ribx:
-        export_run.fail(error_msg)
-        return
 
     merged_ribx_path = export_run.abs_export_filename(extension="ribx")
     if not os.path.isdir(os.path.dirname(merged_ribx_path)):
         os.makedirs(os.path.dirname(merged_ribx_path))
 
-    with open(merged_ribx_path, 'w') as output:
-            xml_string = etree.tostring(merged_ribx, xml_declaration=True,
-                                        encoding=merged_ribx.docinfo.encoding,
-                                        pretty_print=True)
-            output.write(xml_string)
+    error_msg = merge_ribx(ribx_files, merged_ribx_path)
+    if error_msg:
+        export_run.fail(error_msg)
+        return
 
     export_run.rel_file_path = merged_ribx_path
     # ^^ absolute path is converted to relative path in the model's save method
@@ -345,6 +513,13 @@ def export_as_metfile(export_run):
     error. If it does, we assume they want to sort its measurements
     before exporting them."""
 
+    if (export_run.rel_file_path and
+            os.path.exists(export_run.abs_file_path) and
+            export_run.manifest_is_current()):
+        logger.info("Measurements didn't change, keeping %s",
+                    export_run.abs_file_path)
+        return
+
     metfile_path = export_run.abs_export_filename(extension="met")
 
     if not os.path.isdir(os.path.dirname(metfile_path)):
@@ -365,8 +540,10 @@ def export_as_metfile(export_run):
 
     exporter = exporters.MetfileExporter(want_sorted_measurements)
 
-    with open(metfile_path, "w") as f:
+    # Write next to the old file, so that it is never half written
+    with open(metfile_path + '.new', "w") as f:
         f.write(exporter.export_metfile(metfile))
+    os.rename(metfile_path + '.new', metfile_path)
 
     export_run.rel_file_path = metfile_path
     # ^^ absolute path is converted to relative path in the model's save method
@@ -374,91 +551,129 @@ def export_as_metfile(export_run):
 
 
 def export_as_dxf(export_run):
-    # Get a tmp dir
-    temp = tempfile.mkdtemp()
-
-    files = set()
-    # For each measurement, create a dxf file
-    for measurement in export_run.measurements_to_export():
-        file_path = create_dxf(measurement, temp)
-        if file_path is not None:
-            files.add(file_path)
-
-    zipfile_path = export_run.abs_export_filename(extension="dxf.zip")
-
-    if not os.path.isdir(os.path.dirname(zipfile_path)):
-        os.makedirs(os.path.dirname(zipfile_path))
-
-    with open_zipfile(zipfile_path) as z:
-        for file_path in sorted(files):
-            z.write(
-                file_path,
-                os.path.basename(file_path))
-            os.remove(file_path)
-
-    os.rmdir(temp)
-
-    export_run.rel_file_path = zipfile_path
-    # ^^ absolute path is converted to relative path in the model's save method
-    export_run.save()
-
-
-def create_dxf(measurement, temp):
-    retrieved_profile = retrieve_profile.retrieve(
-        measurement.abs_file_path, measurement.location.location_code
-    )
-
-    if retrieved_profile is None:
-        raise ValueError("Profile {} not found in file {}".format(
-            measurement.location.location_code,
-            measurement.abs_file_path))
-
-    series_id, series_name, profile = retrieved_profile
-
-    filename = "{id}.dxf".format(
-        id=measurement.location.location_code)
-    filepath = os.path.join(temp, filename)
-
-    success = dxf.save_as_dxf(profile, filepath)
-
-    return filepath if success else None
+    return export_profiles(export_run, 'dxf')
 
 
 def export_as_csv(export_run):
-    # Get a tmp dir
-    temp = tempfile.mkdtemp()
-
-    files = set()
-    # For each measurement, create a csv file
-    for measurement in export_run.measurements_to_export():
-        file_path = create_csv(measurement, temp)
-        if file_path is not None:
-            files.add(file_path)
-
-    zipfile_path = export_run.abs_export_filename(extension="csv.zip")
+    return export_profiles(export_run, 'csv')
+
+
+def export_profiles(export_run, file_type):
+    """Render a file of file_type for each measurement, and write them
+    straight into a zip file. Only measurements that changed since the
+    previous run are rendered, see update_zipfile()."""
+    zipfile_path = export_run.abs_export_filename(
+        extension="{}.zip".format(file_type))
+
+    def write_profiles(z, measurements):
+        entries = {}
+        filenames = set()
+        for measurement, file_type_, filename, content in render_all_profiles(
+                measurements, [file_type]):
+            if content is None:
+                entries[measurement.id] = None
+                continue
+            if filename not in filenames:
+                z.writestr(filename, content)
+                filenames.add(filename)
+            entries[measurement.id] = filename
+        return entries
+
+    return update_zipfile(
+        export_run, zipfile_path, export_run.measurements_to_export(),
+        write_profiles)
+
+
+def render_all_profiles(measurements, file_types):
+    """Yield (measurement, file_type, filename, content) tuples for all
+    measurements, content is None if no file could be made.
+
+    Measurements are grouped by the MET file they were uploaded in, so
+    that each file is parsed only once, and the files are handed to a
+    pool of worker processes. The number of processes is the
+    LIZARD_PROGRESS_EXPORT_PROCESSES setting, by default the number of
+    CPUs."""
+    measurements_by_file = collections.defaultdict(list)
+    for measurement in measurements:
+        measurements_by_file[measurement.abs_file_path].append(measurement)
 
-    if not os.path.isdir(os.path.dirname(zipfile_path)):
-        os.makedirs(os.path.dirname(zipfile_path))
+    jobs = [
+        (abs_file_path, file_measurements, file_types)
+        for abs_file_path, file_measurements
+        in sorted(measurements_by_file.items())]
 
-    with open_zipfile(zipfile_path) as z:
-        for file_path in sorted(files):
-            z.write(
-                file_path,
-                os.path.basename(file_path))
-            os.remove(file_path)
+    pool = None
+    processes = getattr(settings, 'LIZARD_PROGRESS_EXPORT_PROCESSES', None)
+    if len(jobs) > 1 and processes != 1:
+        try:
+            pool = billiard.Pool(processes)
+        except (AssertionError, OSError):
+            logger.exception(
+                "Can't start worker processes, rendering serially")
 
-    os.rmdir(temp)
+    if pool is None:
+        results = itertools.imap(render_profiles, jobs)
+    else:
+        results = pool.imap(render_profiles, jobs)
 
-    export_run.rel_file_path = zipfile_path
-    # ^^ absolute path is converted to relative path in the model's save method
-    export_run.save()
+    try:
+        for result in results:
+            for item in result:
+                yield item
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def render_profiles(job):
+    """Render all the measurements that were uploaded in one MET file.
+
+    This runs in a worker process, so it may only use what it is
+    given: the measurements were fetched with their locations,
+    activities and projects beforehand (see
+    ExportRun.measurements_to_export()), and the database isn't used."""
+    abs_file_path, measurements, file_types = job
+
+    profiles = {}
+    parsed_metfile = parse_metfile(
+        file_reader.FileReader(abs_file_path, skip_empty_lines=True))
+    if parsed_metfile is not None:
+        for series in parsed_metfile.series:
+            for profile in series.profiles:
+                profiles.setdefault(profile.id, profile)
+
+    results = []
+    for measurement in measurements:
+        location_code = measurement.location.location_code
+        if location_code not in profiles:
+            raise ValueError("Profile {} not found in file {}".format(
+                location_code, abs_file_path))
+
+        for file_type in file_types:
+            content = PROFILE_RENDERERS[file_type](
+                measurement, profiles[location_code])
+            results.append((
+                measurement, file_type,
+                "{id}.{ext}".format(id=location_code, ext=file_type),
+                content))
+    return results
+
+
+def render_dxf(measurement, profile):
+    # metfilelib can only save DXF to a path
+    fd, filepath = tempfile.mkstemp(suffix='.dxf')
+    os.close(fd)
+    try:
+        if dxf.save_as_dxf(profile, filepath):
+            with open(filepath, 'rb') as f:
+                return f.read()
+    finally:
+        os.remove(filepath)
 
 
-def create_csv(measurement, temp):
+def render_csv(measurement, profile):
     location_code = measurement.location.location_code
-    series_id, series_name, profile = retrieve_profile.retrieve(
-        measurement.abs_file_path, location_code
-    )
 
     base_line = profile.line
     midpoint = profile.midpoint
@@ -466,42 +681,46 @@ def create_csv(measurement, temp):
         # No base line. Skip!
         return
 
-    filename = "{id}.csv".format(id=location_code)
-    filepath = os.path.join(temp, filename)
-
-    with open(filepath, 'w') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Location:", location_code])
-        writer.writerow(["X-coordinaat:", profile.midpoint.x])
-        writer.writerow(["Y-coordinaat:", profile.midpoint.y])
-        writer.writerow(["Streefpeil:", -999])
-        writer.writerow(["Gemeten waterstand:", profile.waterlevel])
-        writer.writerow([])
+    f = io.BytesIO()
+    writer = csv.writer(f)
+    writer.writerow(["Location:", location_code])
+    writer.writerow(["X-coordinaat:", profile.midpoint.x])
+    writer.writerow(["Y-coordinaat:", profile.midpoint.y])
+    writer.writerow(["Streefpeil:", -999])
+    writer.writerow(["Gemeten waterstand:", profile.waterlevel])
+    writer.writerow([])
+    writer.writerow([
+        "Afstand tot midden (m)",
+        "Hoogte (m NAP)",
+        "Hoogte zachte bodem (m NAP)"])
+
+    for m in profile.sorted_measurements:
+        distance = base_line.distance_to_midpoint(m.point)
+
         writer.writerow([
-            "Afstand tot midden (m)",
-            "Hoogte (m NAP)",
-            "Hoogte zachte bodem (m NAP)"])
+            "{0:.2f}".format(distance),
+            "{0:.2f}".format(m.z1),
+            "{0:.2f}".format(m.z2)])
 
-        for m in profile.sorted_measurements:
-            distance = base_line.distance_to_midpoint(m.point)
+    return f.getvalue()
 
-            writer.writerow([
-                "{0:.2f}".format(distance),
-                "{0:.2f}".format(m.z1),
-                "{0:.2f}".format(m.z2)])
 
-    return filepath
+def render_png(measurement, profile):
+    # The graph is made from the measurement's data, like on the map.
+    # Exported graphs aren't looked at again, so they aren't cached.
+    from lizard_progress import crosssection_graph
+    canvas = crosssection_graph.graph(measurement.location, [measurement])
 
+    f = io.BytesIO()
+    canvas.print_png(f)
+    return f.getvalue()
 
-def create_png(measurement, temp):
-    from lizard_progress import mtype_specifics
-    handler = mtype_specifics.MetfileSpecifics(measurement.location.activity)
-    location_code = measurement.location.location_code
-    filename = "{id}.png".format(id=location_code)
-    filepath = os.path.join(temp, filename)
 
-    handler.image_handler([measurement.location], open(filepath, 'wb'))
-    return filepath
+PROFILE_RENDERERS = {
+    'dxf': render_dxf,
+    'csv': render_csv,
+    'png': render_png,
+}
 
 
 def export_to_lizard(export_run):
@@ -516,12 +735,25 @@ def export_to_lizard(export_run):
     # Get a tmp dir
     temp = tempfile.mkdtemp()
 
-    # Create files for the relevant measurements
-    for measurement in measurements:
-        measurement.dxf = create_dxf(measurement, temp)
-        measurement.csv = create_csv(measurement, temp)
-        measurement.png = create_png(measurement, temp)
-        lizard_export.upload(measurement, lizard_config)
+    try:
+        # Create files for the relevant measurements
+        files = collections.defaultdict(dict)
+        for measurement, file_type, filename, content in render_all_profiles(
+                measurements, ['dxf', 'csv', 'png']):
+            file_path = None
+            if content is not None:
+                file_path = os.path.join(temp, filename)
+                with open(file_path, 'wb') as f:
+                    f.write(content)
+            files[measurement.id][file_type] = file_path
+
+        for measurement in measurements:
+            measurement.dxf = files[measurement.id].get('dxf')
+            measurement.csv = files[measurement.id].get('csv')
+            measurement.png = files[measurement.id].get('png')
+            lizard_export.upload(measurement, lizard_config)
+    finally:
+        shutil.rmtree(temp)
 
     # Save measurements data to a database table, for Geoserver, including
     # links to the previously saved files
@@ -548,9 +780,8 @@ def export_as_shapefile(export_run, location_type):
         return
 
     if location_type == 'point':
-        fieldname = configuration.get(
-            export_run.activity, 'location_id_field'
-        ).strip().encode('utf8')
+        fieldname = export_run.activity.config_value(
+            'location_id_field').strip().encode('utf8')
     else:
         fieldname = b'Ref'
 
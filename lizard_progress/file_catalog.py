@@ -0,0 +1,290 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""The catalog of downloadable files (models.CatalogFile).
+
+Listing the download directories and stat()ing every file in them is
+slow on network storage, so the download pages read the catalog
+instead, with one query per section. Uploads and deletes add and
+remove their files, scan() makes the catalog of one directory match
+the file system again (for files that are changed outside of the
+site, e.g. results put there by scripts, or zipped by the shapefile
+vacuum), and reconcile() does that for all directories. It runs daily
+in the reconcile_file_catalog_task, and in the reconcile_file_catalog
+management command.
+
+A directory that was never scanned (models.CatalogScan) is scanned
+when a download page shows it, see ensure_scanned(), so the catalog
+needs no filling after upgrading. Results directories are scanned
+again when the page shows them and they changed since their last scan,
+so that results put there by scripts appear right away."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import datetime
+import logging
+import os
+
+from django.db import IntegrityError
+from django.db import transaction
+
+from lizard_progress import models
+from lizard_progress.models import CatalogFile
+from lizard_progress.models import CatalogScan
+from lizard_progress.util import directories
+
+logger = logging.getLogger(__name__)
+
+# Per kind: the field of its owner, the function that returns its
+# directory for an owner, and whether subdirectories are included
+KINDS = {
+    CatalogFile.KIND_ORGANIZATION: (
+        'organization', directories.abs_organization_files_dir, False),
+    CatalogFile.KIND_PROJECT: (
+        'project', directories.abs_project_files_dir, False),
+    CatalogFile.KIND_HYDROVAKKEN: (
+        'project', directories.abs_hydrovakken_dir, True),
+    CatalogFile.KIND_REPORTS: (
+        'activity', directories.abs_reports_dir, False),
+    CatalogFile.KIND_RESULTS: (
+        'activity', directories.abs_results_dir, False),
+    CatalogFile.KIND_SHAPEFILE: (
+        'activity', directories.abs_shapefile_dir, True),
+}
+
+OWNER_MODELS = {
+    'organization': models.Organization,
+    'project': models.Project,
+    'activity': models.Activity,
+}
+
+
+def _stat(abs_path):
+    """Return (size, modification time) of a file, or None if it
+    isn't there."""
+    try:
+        stat = os.stat(abs_path)
+    except OSError:
+        return None
+    return (stat.st_size,
+            datetime.datetime.fromtimestamp(int(stat.st_mtime)))
+
+
+class Directory(object):
+    """A directory whose files are in the catalog, for an owner (an
+    Organization, Project or Activity, depending on the kind)."""
+
+    def __init__(self, kind, owner):
+        self.kind = kind
+        self.owner = owner
+        self.owner_field, self.abs_dir_function, self.recursive = KINDS[kind]
+
+    @classmethod
+    def get(cls, kind, owner_id):
+        """Return the directory of this kind for the owner with this id,
+        or None if it doesn't exist anymore."""
+        owner_field = KINDS[kind][0]
+        try:
+            owner = OWNER_MODELS[owner_field].objects.get(pk=owner_id)
+        except OWNER_MODELS[owner_field].DoesNotExist:
+            return None
+        return cls(kind, owner)
+
+    @property
+    def abs_dir(self):
+        return self.abs_dir_function(self.owner)
+
+    def abs_files(self):
+        if self.recursive:
+            return directories.all_abs_files_in(self.abs_dir)
+        return directories.abs_files_in(self.abs_dir)
+
+    def catalog(self):
+        """The CatalogFiles of this directory."""
+        return CatalogFile.objects.filter(
+            kind=self.kind, **{self.owner_field: self.owner})
+
+    def changed_since(self, scanned_at):
+        """Whether files were added to, removed from or renamed in this
+        directory (not its subdirectories) since scanned_at."""
+        try:
+            modified_at = datetime.datetime.fromtimestamp(
+                os.stat(self.abs_dir).st_mtime)
+        except OSError:
+            return False
+        return modified_at >= scanned_at
+
+    def record_scan(self, scanned_at):
+        scans = CatalogScan.objects.filter(
+            kind=self.kind, **{self.owner_field: self.owner})
+        if not scans.update(scanned_at=scanned_at):
+            CatalogScan.objects.create(
+                kind=self.kind, scanned_at=scanned_at,
+                **{self.owner_field: self.owner})
+
+    def add(self, abs_path, uploaded_at=None):
+        """Put a file in the catalog, or update it if it was there
+        already. Uploaded now, unless uploaded_at is given."""
+        stat = _stat(abs_path)
+        if stat is None:
+            return
+        file_size, modified_at = stat
+
+        catalog_file, created = CatalogFile.objects.get_or_create(
+            rel_file_path=directories.relative(abs_path), defaults=dict(
+                kind=self.kind, file_size=file_size,
+                modified_at=modified_at))
+        catalog_file.kind = self.kind
+        setattr(catalog_file, self.owner_field, self.owner)
+        catalog_file.file_size = file_size
+        catalog_file.modified_at = modified_at
+        catalog_file.uploaded_at = uploaded_at or datetime.datetime.now()
+        catalog_file.save()
+
+    def scan(self):
+        """Make the catalog of this directory match the files in it: add
+        new files, update changed ones and remove those that are gone.
+        Returns the numbers of added, updated and removed files."""
+        # Changes made while scanning should make the directory changed
+        # since its scan
+        started_at = datetime.datetime.now()
+        on_disk = {}
+        for abs_path in self.abs_files():
+            stat = _stat(abs_path)
+            if stat is not None:
+                on_disk[directories.relative(abs_path)] = stat
+
+        catalogued = dict(
+            (catalog_file.rel_file_path, catalog_file)
+            for catalog_file in self.catalog())
+
+        removed = [catalog_file.id
+                   for rel_file_path, catalog_file in catalogued.items()
+                   if rel_file_path not in on_disk]
+
+        new_paths = [rel_file_path for rel_file_path in on_disk
+                     if rel_file_path not in catalogued]
+        # Activities' uploads know when they were uploaded and downloaded
+        accepted = {}
+        if new_paths and self.owner_field == 'activity':
+            accepted = dict(
+                (rel_file_path, (uploaded_at, last_downloaded_at))
+                for rel_file_path, uploaded_at, last_downloaded_at in
+                models.AcceptedFile.objects.filter(
+                    activity=self.owner,
+                    rel_file_path__in=new_paths).values_list(
+                    'rel_file_path', 'uploaded_at', 'last_downloaded_at'))
+
+        new = []
+        for rel_file_path in new_paths:
+            file_size, modified_at = on_disk[rel_file_path]
+            uploaded_at, last_downloaded_at = accepted.get(
+                rel_file_path, (modified_at, None))
+            new.append(CatalogFile(
+                kind=self.kind, rel_file_path=rel_file_path,
+                file_size=file_size, modified_at=modified_at,
+                uploaded_at=uploaded_at,
+                last_downloaded_at=last_downloaded_at,
+                **{self.owner_field: self.owner}))
+
+        updated = 0
+        try:
+            with transaction.atomic():
+                if removed:
+                    CatalogFile.objects.filter(id__in=removed).delete()
+                for rel_file_path, catalog_file in catalogued.items():
+                    if rel_file_path not in on_disk:
+                        continue
+                    file_size, modified_at = on_disk[rel_file_path]
+                    if (catalog_file.file_size, catalog_file.modified_at) != (
+                            file_size, modified_at):
+                        catalog_file.file_size = file_size
+                        catalog_file.modified_at = modified_at
+                        catalog_file.save(
+                            update_fields=['file_size', 'modified_at'])
+                        updated += 1
+                CatalogFile.objects.bulk_create(new)
+                self.record_scan(started_at)
+        except IntegrityError:
+            # Added by an upload in the meantime, the next scan will
+            # find everything in order
+            logger.warning("Catalog of %s changed while scanning it.",
+                           self.abs_dir)
+            return (0, 0, 0)
+
+        return (len(new), updated, len(removed))
+
+
+def add(abs_path, kind, owner, uploaded_at=None):
+    """Put a file of this kind and owner in the catalog."""
+    Directory(kind, owner).add(abs_path, uploaded_at)
+
+
+def remove(abs_path):
+    """Remove a file from the catalog."""
+    CatalogFile.objects.filter(
+        rel_file_path=directories.relative(abs_path)).delete()
+
+
+def scan(kind, owner):
+    """Make the catalog of this directory match the file system."""
+    return Directory(kind, owner).scan()
+
+
+def ensure_scanned(kind, owners, if_changed=False):
+    """Scan the directories of this kind of these owners that were
+    never scanned, so that their catalog is complete. If if_changed is
+    true, also the ones that changed since their last scan; that costs
+    a stat() per directory."""
+    owners = [owner for owner in owners if owner is not None]
+    if not owners:
+        return
+    owner_field = KINDS[kind][0]
+    scanned = dict(CatalogScan.objects.filter(kind=kind, **{
+        owner_field + '__in': owners}).values_list(
+        owner_field + '_id', 'scanned_at'))
+    for owner in owners:
+        directory = Directory(kind, owner)
+        scanned_at = scanned.get(owner.id)
+        if scanned_at is None or (
+                if_changed and directory.changed_since(scanned_at)):
+            directory.scan()
+
+
+def register_download(rel_file_path):
+    CatalogFile.objects.filter(rel_file_path=rel_file_path).update(
+        last_downloaded_at=datetime.datetime.now())
+
+
+def all_directories():
+    """Yield all directories of which files are in the catalog."""
+    for organization in models.Organization.objects.all():
+        yield Directory(CatalogFile.KIND_ORGANIZATION, organization)
+
+    for project in models.Project.objects.select_related('organization'):
+        for kind in (CatalogFile.KIND_PROJECT, CatalogFile.KIND_HYDROVAKKEN):
+            yield Directory(kind, project)
+
+    for activity in models.Activity.objects.select_related(
+            'project__organization'):
+        for kind in (CatalogFile.KIND_REPORTS, CatalogFile.KIND_RESULTS,
+                     CatalogFile.KIND_SHAPEFILE):
+            yield Directory(kind, activity)
+
+
+def reconcile():
+    """Scan all directories. Returns the total numbers of added,
+    updated and removed files."""
+    totals = [0, 0, 0]
+    for directory in all_directories():
+        try:
+            counts = directory.scan()
+        except (IOError, OSError):
+            logger.exception("Could not scan %s.", directory.abs_dir)
+            continue
+        totals = [total + count for total, count in zip(totals, counts)]
+    return tuple(totals)
@@ -0,0 +1,198 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Checking RIBX files with the RIONED GWSW HTTP API.
+
+The check is a separate stage after processing an uploaded file: a
+task submits the file, and another task polls for the result with
+exponential backoff, rescheduling itself with a countdown instead of
+sleeping in the worker. The errors the API finds are added to the
+UploadedFile's errors when they arrive."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import os
+
+import requests
+
+from django.conf import settings
+from django.db import connection
+
+from lizard_progress.util import directories
+
+logger = logging.getLogger(__name__)
+
+
+class GwswError(Exception):
+    """The GWSW API can't be reached or gave an unusable response."""
+    pass
+
+
+def is_enabled(activity):
+    """Only enable GWSW API for non-simple projects."""
+    return (getattr(settings, 'GWSW_API_ENABLED', False) and
+            not activity.project.is_simple)
+
+
+def request_timeout():
+    return getattr(settings, 'LIZARD_PROGRESS_GWSW_TIMEOUT', 60)
+
+
+def max_polls():
+    return getattr(settings, 'LIZARD_PROGRESS_GWSW_MAX_POLLS', 10)
+
+
+def poll_countdown(attempt):
+    """Seconds to wait before request number attempt (0, 1, ...) for
+    the log, doubling each time up to a maximum."""
+    initial_wait = getattr(settings, 'LIZARD_PROGRESS_GWSW_INITIAL_WAIT', 2)
+    max_wait = getattr(settings, 'LIZARD_PROGRESS_GWSW_MAX_WAIT', 300)
+    return min(initial_wait * 2 ** attempt, max_wait)
+
+
+def submit(path):
+    """Upload the file at path to the GWSW API, return the id of its
+    record there."""
+    try:
+        with open(path, 'rb') as f:
+            response = requests.post(
+                settings.GWSW_UPLOAD_URL, files={os.path.basename(path): f},
+                timeout=request_timeout())
+        logger.info("GWSW Upload response: %s", response.text)
+        response.raise_for_status()
+        return int(response.json()['id'])
+    except (IOError, ValueError, KeyError, TypeError,
+            requests.exceptions.RequestException) as e:
+        raise GwswError("Uploading {} failed: {}".format(path, e))
+
+
+def get_log_content(record_id):
+    """Return the log of a record as a list of dicts, or None if it
+    isn't ready yet."""
+    try:
+        response = requests.get(
+            settings.GWSW_GETLOG_URL % record_id, timeout=request_timeout())
+        response.raise_for_status()
+        return response.json().get('logcontent')
+    except (ValueError, AttributeError,
+            requests.exceptions.RequestException) as e:
+        raise GwswError("Getting the log of {} failed: {}".format(
+            record_id, e))
+
+
+def parse_log_content(log_content):
+    """
+    Return list of dicts containing log records.
+
+    Only includes records that have 'type' == 'fout'.
+    """
+    errors = []
+    for record in log_content:
+        if record['type'] == 'fout':
+            errors.append({
+                'line': int(record['regelnummer']),
+                'message': 'GWSW: ' + record['bericht'],
+            })
+    return errors
+
+
+def schedule_check(uploaded_file, parser, rel_file_path):
+    """If files handled by parser need a GWSW check, mark uploaded_file
+    as being checked and start the submit task for the file at
+    rel_file_path (the uploaded file may have been moved) once the
+    current transaction has committed."""
+    # Need to import here to prevent circular imports
+    from lizard_progress import tasks
+
+    if not (parser.GWSW_CHECK and is_enabled(uploaded_file.activity)):
+        return
+
+    uploaded_file.gwsw_status = uploaded_file.GWSW_STATUS_PENDING
+    uploaded_file.save()
+    connection.on_commit(
+        lambda: tasks.gwsw_submit_task.delay(uploaded_file.id, rel_file_path))
+
+
+def submit_uploaded_file(uploaded_file_id, rel_file_path):
+    """Submit the file and schedule the first poll."""
+    from lizard_progress import models
+    from lizard_progress import tasks
+
+    try:
+        uploaded_file = models.UploadedFile.objects.get(pk=uploaded_file_id)
+    except models.UploadedFile.DoesNotExist:
+        return  # Deleted in the meantime
+
+    try:
+        record_id = submit(directories.absolute(rel_file_path))
+    except GwswError:
+        logger.exception("There is an error with (handling) the API")
+        set_status(uploaded_file, uploaded_file.GWSW_STATUS_FAILED)
+        return
+
+    uploaded_file.gwsw_record_id = record_id
+    uploaded_file.save()
+    tasks.gwsw_poll_task.apply_async(
+        (uploaded_file_id, record_id, 0), countdown=poll_countdown(0))
+
+
+def poll(uploaded_file_id, record_id, attempt):
+    """Get the log. If it isn't there yet, schedule the next poll;
+    otherwise add its errors to the uploaded file."""
+    from lizard_progress import models
+    from lizard_progress import tasks
+
+    try:
+        log_content = get_log_content(record_id)
+    except GwswError:
+        logger.exception("Incorrect getlog response for id: %s", record_id)
+        log_content = None
+
+    # If the ribx file has not yet been processed you will get a
+    # log_content of None.
+    if log_content is None:
+        if attempt + 1 < max_polls():
+            tasks.gwsw_poll_task.apply_async(
+                (uploaded_file_id, record_id, attempt + 1),
+                countdown=poll_countdown(attempt + 1))
+        else:
+            logger.error("No GWSW log for id %s after %s tries",
+                         record_id, attempt + 1)
+            models.UploadedFile.objects.filter(pk=uploaded_file_id).update(
+                gwsw_status=models.UploadedFile.GWSW_STATUS_FAILED)
+        return
+
+    try:
+        uploaded_file = models.UploadedFile.objects.get(pk=uploaded_file_id)
+    except models.UploadedFile.DoesNotExist:
+        return
+
+    try:
+        errors = parse_log_content(log_content)
+    except (ValueError, KeyError, TypeError):
+        logger.exception("Incorrect log content for id: %s", record_id)
+        set_status(uploaded_file, uploaded_file.GWSW_STATUS_FAILED)
+        return
+
+    record_errors(uploaded_file, errors)
+
+
+def record_errors(uploaded_file, errors):
+    for error in errors:
+        uploaded_file.uploadedfileerror_set.create(
+            line=error['line'] if uploaded_file.linelike else 0,
+            error_code='GWSW',
+            error_message=error['message'][:300])
+
+    set_status(uploaded_file, uploaded_file.GWSW_STATUS_ERRORS if errors
+               else uploaded_file.GWSW_STATUS_OK)
+
+
+def set_status(uploaded_file, status):
+    uploaded_file.gwsw_status = status
+    uploaded_file.save()
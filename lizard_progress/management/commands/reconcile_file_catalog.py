@@ -0,0 +1,43 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Make the catalog of downloadable files match the file system now,
+instead of waiting for the periodic reconcile_file_catalog_task."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from lizard_progress import file_catalog
+from lizard_progress import tasks
+
+
+class Command(BaseCommand):
+    args = ""
+    help = ("Add new files to the file catalog, update changed ones and "
+            "remove the ones that are gone.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--background',
+                    action='store_true',
+                    dest='background',
+                    default=False,
+                    help='Queue the reconcile_file_catalog_task instead'),
+    )
+
+    def handle(self, *args, **options):
+        if options['background']:
+            tasks.reconcile_file_catalog_task.delay()
+            self.stdout.write("File catalog reconciliation queued.")
+            return
+
+        added, updated, removed = file_catalog.reconcile()
+        self.stdout.write(
+            "File catalog: {} added, {} updated, {} removed.".format(
+                added, updated, removed))
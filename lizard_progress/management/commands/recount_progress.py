@@ -0,0 +1,27 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Count the locations and measurements of all activities and projects
+again, to repair their progress counters."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lizard_progress import counters
+
+
+class Command(BaseCommand):
+    args = ""
+    help = ("Recount the progress counters (locations, complete locations "
+            "and measurements) of all activities and projects.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            counters.recount()
+        self.stdout.write("Progress counters recounted.")
@@ -0,0 +1,42 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Show our Celery queues, or the commands to start their workers."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from optparse import make_option
+
+from celery import current_app
+from django.core.management.base import BaseCommand
+
+from lizard_progress import routing
+
+
+class Command(BaseCommand):
+    help = ("Show the number of waiting tasks in each queue, or with "
+            "--workers the commands to start a worker for each queue.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', action='store_true', default=False,
+                    help='Print a worker command line for each queue'),
+    )
+
+    def handle(self, *args, **options):
+        if options['workers']:
+            for command in routing.worker_commands(current_app):
+                self.stdout.write(command)
+            return
+
+        queues = routing.queues()
+        for name, depth in sorted(
+                routing.queue_depths(current_app).items()):
+            settings = queues.get(name, {})
+            self.stdout.write(
+                "{:<15} {:>8} waiting  (concurrency {}, prefetch {})".format(
+                    name, depth, settings.get('concurrency', '-'),
+                    settings.get('prefetch_multiplier', '-')))
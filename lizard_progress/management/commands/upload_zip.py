@@ -1,103 +1,59 @@
 # -*- coding: utf-8 -*-
 # Copyright 2014 Nelen & Schuurmans
 
-"""Contains hackery that makes it only work for Peilschalen. Need to
-move them from the old HDSR upload server."""
+"""Upload a zip file as a batch, as if it was uploaded on the upload
+page of an activity."""
 
-import datetime
 import os
+import shutil
 import tempfile
 import zipfile
 
-from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
 
-import Image
-
-from lizard_progress.util.coordinates import wgs84_to_rd
+from lizard_progress import batch_upload
 from lizard_progress import models
-from lizard_progress import tasks
-from lizard_progress.util.image import get_exif_data, get_lat_lon
-
-
-def scheduled_measurement_for_jpg(project, contractor, filepath):
-    if filepath.upper().endswith('JPG'):
-        mtype_slug = 'foto'
-    else:
-        return
-
-    measurement_type = models.MeasurementType.objects.get(
-        project=project, mtype__slug=mtype_slug)
-
-    im = Image.open(filepath)
-    exif_data = get_exif_data(im)
-    lat, lon = get_lat_lon(exif_data)
-
-    x, y = wgs84_to_rd(lon, lat)
-
-    uniek_id = os.path.splitext(os.path.basename(filepath))[0].upper()
-    location, created = models.Location.objects.get_or_create(
-        location_code=uniek_id,
-        project=project)
-    location.the_geom = "POINT ({} {})".format(x, y)
-    location.save()
-
-    models.ScheduledMeasurement.objects.get_or_create(
-        project=project,
-        contractor=contractor,
-        location=location,
-        measurement_type=measurement_type)
-
-
-def upload_zipfile(stdout, project, contractor, path):
-    """Create a temporary directory; unzip the zipfile in there;
-    create UploadedFile objects for each file; start the background
-    task for each file."""
-    basedir = os.path.join(
-        settings.BUILDOUT_DIR, 'var', 'lizard_progress', 'uploaded_files')
-    tmpdir = tempfile.mkdtemp(dir=basedir)
-    zipf = zipfile.ZipFile(path)
-    zipf.extractall(tmpdir)
-
-    # Get a user
-    profiles = list(models.UserProfile.objects.filter(
-            organization=contractor.organization))
-
-    if not profiles:
-        raise CommandError("This contractor has no users!")
-
-    user = profiles[0].user
-    stdout.write("Uploading as user {}...\n".format(user))
-
-    for (dirpath, dirnames, filenames) in os.walk(tmpdir):
-        for filename in filenames:
-            fullpath = os.path.join(dirpath, filename)
-            if fullpath.lower().endswith('jpg'):
-                scheduled_measurement_for_jpg(project, contractor, fullpath)
-
-            uploaded_file = models.UploadedFile.objects.create(
-                project=project,
-                contractor=contractor,
-                uploaded_by=user,
-                uploaded_at=datetime.datetime.now(),
-                rel_file_path=fullpath)
-            tasks.process_uploaded_file_task.delay(uploaded_file.id)
-            stdout.write("{} uploaded.\n".format(filename))
+from lizard_progress.util import uploads
+
+
+def upload_zipfile(stdout, activity, user, path):
+    """Copy the zipfile into a directory of its own and start an upload
+    batch for it. Its files are extracted and processed by background
+    tasks."""
+    tmpdir = tempfile.mkdtemp(dir=uploads.uploads_dir())
+    zip_path = os.path.join(tmpdir, os.path.basename(path))
+    shutil.copy(path, zip_path)
+
+    try:
+        batch = batch_upload.start_batch(activity, user, zip_path)
+    except zipfile.BadZipfile:
+        shutil.rmtree(tmpdir)
+        raise CommandError("{} is not a zip file.".format(path))
+
+    stdout.write("Started batch {} with {} files, uploaded as {}.\n".format(
+        batch.id, batch.num_files, user))
 
 
 class Command(BaseCommand):
-    """Command that goes through all uploaded data and re-checks it."""
+    """Command that uploads all files in a zip file."""
 
-    args = "<organizationslug> <projectslug> <contractorslug> <zipfilename>"
-    help = """Unzip a zipfile and "upload" each file."""
+    args = "<organizationname> <projectslug> <activityid> <zipfilename>"
+    help = """Upload each file in a zip file, in a batch."""
 
     def handle(self, *args, **options):
         """Run the command."""
 
         self.check_arguments(args)
+
+        # Get a user
+        profiles = list(models.UserProfile.objects.filter(
+            organization=self.activity.contractor))
+        if not profiles:
+            raise CommandError("This contractor has no users!")
+
         upload_zipfile(
-            self.stdout, self.project, self.contractor, self.zipfile_path)
+            self.stdout, self.activity, profiles[0].user, self.zipfile_path)
 
     def check_arguments(self, args):
         """Check the arguments. Errors write some information to
@@ -140,20 +96,19 @@ class Command(BaseCommand):
 
         if len(args) == 2:
             self.stderr.write("Arguments: %s.\n" % (self.args,))
-            contractors = models.Contractor.objects.filter(
-                project=self.project)
-            if contractors:
-                self.stderr.write("Available contractors for project %s:\n" %
+            activities = models.Activity.objects.filter(project=self.project)
+            if activities:
+                self.stderr.write("Available activities for project %s:\n" %
                                   (self.project.slug,))
-                for contractor in contractors:
-                    self.stderr.write("- %s\n" % (contractor.slug,))
-            raise CommandError("No contractor slug given.")
+                for activity in activities:
+                    self.stderr.write("- %s: %s\n" % (activity.id, activity))
+            raise CommandError("No activity id given.")
 
         try:
-            self.contractor = models.Contractor.objects.get(
-                project=self.project, slug=args[2])
-        except models.Contractor.DoesNotExist:
-            raise CommandError("Contractor '%s' does not exist." % (args[2],))
+            self.activity = models.Activity.objects.get(
+                project=self.project, pk=args[2])
+        except (models.Activity.DoesNotExist, ValueError):
+            raise CommandError("Activity '%s' does not exist." % (args[2],))
 
         if len(args) == 3:
             self.stderr.write("Arguments: %s.\n" % (self.args,))
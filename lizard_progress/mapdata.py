@@ -0,0 +1,605 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+"""GeoJSON layers for the project map.
+
+The layers of a project are made with one query for all locations and
+one for all change requests, and cached. Every activity has a version
+(see versions.py) that is renewed when its locations or change requests
+change; the versions of a project's activities are part of the cache
+key, and are also used for the ETag and Last-Modified headers of the
+map data.
+
+Activities with many locations are shown with Mapbox Vector Tiles
+instead, that are kept on disk per version of the activity's data.
+
+Saving or deleting a Location or Request renews the version of its
+activity through signals, code that changes them with queryset
+updates or bulk_create should call forget_activity() itself."""
+
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import datetime
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from lizard_progress import versions as cache_versions
+from lizard_progress.util import directories
+
+logger = logging.getLogger(__name__)
+
+# Activities of these measurement types are shown on the map
+MAP_MEASUREMENT_TYPES = (
+    'dwarsprofiel',
+    'dwarsprofielen_inpeiling',
+    'dwarsprofielen_uitpeiling',
+    'ribx_reiniging_riool',
+    'ribx_reiniging_kolken',
+    'ribx_reiniging_inspectie_riool',
+)
+
+REQUESTS_LAYER = 'Aanvragen'
+
+LOCATIONS_QUERY = """
+select l.activity_id, json_agg(json_build_object(
+  'type', 'Feature',
+  'geometry', ST_AsGeoJSON(ST_Transform(l.the_geom, 4326))::json,
+  'properties', json_build_object(
+    'type', 'location',
+    'id', l.id,
+    'loc_id', l.id,
+    'code', l.location_code,
+    'activity', a.name,
+    'contractor', o.name,
+    'loc_type', l.location_type,
+    'planned_date', l.planned_date,
+    'complete', l.complete,
+    'measured_date', l.measured_date,
+    'work_impossible', l.work_impossible,
+    'not_part_of_project', l.not_part_of_project,
+    'new', l.new
+  )))::text
+from lizard_progress_location l
+inner join lizard_progress_activity a on a.id = l.activity_id
+inner join lizard_progress_organization o on o.id = a.contractor_id
+where l.the_geom is not null and l.activity_id = any(%(activity_ids)s)
+group by l.activity_id
+"""
+
+# Moving requests (request_type 2) are also shown at the old and the
+# new location. The geometry of an accepted moving request is the old
+# geometry of the location, for the others it is the new one.
+REQUESTS_QUERY = """
+select json_agg(feature)::text from (
+  select json_build_object(
+    'type', 'Feature',
+    'geometry', ST_AsGeoJSON(ST_Transform(cr.the_geom, 4326))::json,
+    'properties', json_build_object(
+      'activity', 'a.name',
+      'type', 'request',
+      'id', cr.id,
+      'req_type', cr.request_type,
+      'loc_type', loc.location_type,
+      'loc_id', loc.id,
+      'loc_geom', ST_AsGeoJSON(ST_Transform(loc.the_geom, 28992))::json,
+      'same_geom', ST_Equals(loc.the_geom, cr.the_geom),
+      'code', cr.location_code,
+      'motivation', cr.motivation,
+      'status', cr.request_status
+    )) as feature
+  from changerequests_request cr
+  inner join lizard_progress_activity a on cr.activity_id = a.id
+  left join lizard_progress_location loc
+    on cr.location_code = loc.location_code
+    and cr.activity_id = loc.activity_id
+  where cr.activity_id = any(%(activity_ids)s)
+    and cr.request_type != 2
+
+  union all
+
+  select json_build_object(
+    'type', 'Feature',
+    'geometry', ST_AsGeoJSON(ST_Transform(cr.the_geom, 4326))::json,
+    'properties', json_build_object(
+      'type', 'request',
+      'old', 1,
+      'id', cr.id,
+      'req_type', cr.request_type,
+      'loc_type', loc.location_type,
+      'loc_id', loc.id,
+      'code', cr.location_code,
+      'motivation', cr.motivation,
+      'status', cr.request_status
+    ))
+  from changerequests_request cr
+  join lizard_progress_location loc
+    on cr.location_code = loc.location_code
+    and cr.activity_id = loc.activity_id
+  where cr.activity_id = any(%(activity_ids)s)
+    and cr.request_type = 2
+
+  union all
+
+  select json_build_object(
+    'type', 'Feature',
+    'geometry', ST_AsGeoJSON(ST_Transform(loc.the_geom, 4326))::json,
+    'properties', json_build_object(
+      'type', 'request',
+      'old', 1,
+      'id', cr.id,
+      'req_type', cr.request_type,
+      'loc_type', loc.location_type,
+      'loc_id', loc.id,
+      'code', cr.location_code,
+      'motivation', cr.motivation,
+      'status', cr.request_status
+    ))
+  from changerequests_request cr
+  join lizard_progress_location loc
+    on cr.location_code = loc.location_code
+    and cr.activity_id = loc.activity_id
+  where cr.activity_id = any(%(activity_ids)s)
+    and cr.request_type = 2 and cr.request_status != 2
+
+  union all
+
+  select json_build_object(
+    'type', 'Feature',
+    'geometry', ST_AsGeoJSON(ST_Transform(cr.the_geom, 4326))::json,
+    'properties', json_build_object(
+      'type', 'request',
+      'old', 0,
+      'id', cr.id,
+      'req_type', cr.request_type,
+      'loc_type', loc.location_type,
+      'loc_id', loc.id,
+      'code', cr.location_code,
+      'motivation', cr.motivation,
+      'status', cr.request_status
+    ))
+  from changerequests_request cr
+  join lizard_progress_location loc
+    on cr.location_code = loc.location_code
+    and cr.activity_id = loc.activity_id
+  where cr.activity_id = any(%(activity_ids)s)
+    and cr.request_type = 2 and cr.request_status != 2
+
+  union all
+
+  select json_build_object(
+    'type', 'Feature',
+    'geometry', ST_AsGeoJSON(ST_Transform(loc.the_geom, 4326))::json,
+    'properties', json_build_object(
+      'type', 'request',
+      'old', 0,
+      'id', cr.id,
+      'req_type', cr.request_type,
+      'loc_type', loc.location_type,
+      'loc_id', loc.id,
+      'code', cr.location_code,
+      'motivation', cr.motivation,
+      'status', cr.request_status
+    ))
+  from changerequests_request cr
+  join lizard_progress_location loc
+    on cr.location_code = loc.location_code
+    and cr.activity_id = loc.activity_id
+  where cr.activity_id = any(%(activity_ids)s)
+    and cr.request_type = 2 and cr.request_status = 2
+) as features
+"""
+
+LOCATION_COUNTS_QUERY = """
+select activity_id, count(*)
+from lizard_progress_location
+where the_geom is not null and activity_id = any(%(activity_ids)s)
+group by activity_id
+"""
+
+WEB_MERCATOR_MAX = 20037508.342789244
+TILE_EXTENT = 4096
+TILE_BUFFER = 256
+
+# The same properties as the GeoJSON features above, except that
+# dates and loc_geom are text. Properties that are NULL are left out.
+TILE_QUERY = """
+with bounds as (
+  select
+    ST_MakeEnvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s, 3857) as tile,
+    ST_Transform(ST_Expand(
+      ST_MakeEnvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s, 3857),
+      %(margin)s), %(srid)s) as search
+),
+locations as (
+  select
+    ST_AsMVTGeom(ST_Transform(l.the_geom, 3857), bounds.tile::box2d,
+                 %(extent)s, %(buffer)s, true) as geom,
+    'location' as type,
+    l.id as id,
+    l.id as loc_id,
+    l.location_code as code,
+    a.name as activity,
+    o.name as contractor,
+    l.location_type as loc_type,
+    l.planned_date::text as planned_date,
+    l.complete as complete,
+    l.measured_date::text as measured_date,
+    l.work_impossible as work_impossible,
+    l.not_part_of_project as not_part_of_project,
+    l.new as new
+  from lizard_progress_location l
+  inner join lizard_progress_activity a on a.id = l.activity_id
+  inner join lizard_progress_organization o on o.id = a.contractor_id
+  cross join bounds
+  where l.activity_id = %(activity_id)s and l.the_geom && bounds.search
+),
+requests as (
+  select
+    ST_AsMVTGeom(ST_Transform(r.the_geom, 3857), bounds.tile::box2d,
+                 %(extent)s, %(buffer)s, true) as geom,
+    r.activity, r.type, r.id, r.req_type, r.loc_type, r.loc_id, r.loc_geom,
+    r.same_geom, r.old, r.code, r.motivation, r.status
+  from (
+    select
+      cr.the_geom,
+      'a.name' as activity,
+      'request' as type,
+      cr.id as id,
+      cr.request_type as req_type,
+      loc.location_type as loc_type,
+      loc.id as loc_id,
+      ST_AsGeoJSON(ST_Transform(loc.the_geom, 28992)) as loc_geom,
+      ST_Equals(loc.the_geom, cr.the_geom) as same_geom,
+      null::integer as old,
+      cr.location_code as code,
+      cr.motivation as motivation,
+      cr.request_status as status
+    from changerequests_request cr
+    left join lizard_progress_location loc
+      on cr.location_code = loc.location_code
+      and cr.activity_id = loc.activity_id
+    where cr.activity_id = %(activity_id)s and cr.request_type != 2
+
+    union all
+
+    select
+      moved.the_geom, null, 'request', cr.id, cr.request_type,
+      loc.location_type, loc.id, null, null, moved.old, cr.location_code,
+      cr.motivation, cr.request_status
+    from changerequests_request cr
+    join lizard_progress_location loc
+      on cr.location_code = loc.location_code
+      and cr.activity_id = loc.activity_id
+    cross join lateral (values
+      (cr.the_geom, 1, true),
+      (loc.the_geom, 1, cr.request_status != 2),
+      (cr.the_geom, 0, cr.request_status != 2),
+      (loc.the_geom, 0, cr.request_status = 2)
+    ) as moved(the_geom, old, shown)
+    where cr.activity_id = %(activity_id)s and cr.request_type = 2
+      and moved.shown
+  ) as r
+  cross join bounds
+  where r.the_geom && bounds.search
+)
+select
+  coalesce((select ST_AsMVT(locations, 'locations', %(extent)s, 'geom')
+            from locations where geom is not null), ''::bytea) ||
+  coalesce((select ST_AsMVT(requests, 'requests', %(extent)s, 'geom')
+            from requests where geom is not null), ''::bytea)
+"""
+
+
+def cache_timeout():
+    return getattr(
+        settings, 'LIZARD_PROGRESS_MAP_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def tiles_from():
+    """Activities with at least this many locations are shown with
+    vector tiles instead of GeoJSON. None means never."""
+    return getattr(settings, 'LIZARD_PROGRESS_MAP_TILES_FROM', 10000)
+
+
+def version_key(activity_id):
+    return 'lizard_progress_map_version_{}'.format(activity_id)
+
+
+def forget_activity(activity_id):
+    """Renew the version of this activity's map data, so that cached
+    layers and tiles that include it aren't used anymore."""
+    if activity_id is not None:
+        cache_versions.renew([version_key(activity_id)])
+
+
+def activity_versions(activity_ids):
+    """Return a dictionary of activity id -> version of its map data."""
+    keys = dict(
+        (version_key(activity_id), activity_id)
+        for activity_id in activity_ids)
+    versions = cache_versions.get_many(keys.keys())
+
+    return dict(
+        (activity_id, versions[key]) for key, activity_id in keys.items())
+
+
+class MapLayers(object):
+    """The map layers of some activities of one project: a layer of
+    locations per activity and one layer of change requests.
+
+    If tile_url is given, activities with many locations get a layer
+    that refers to their vector tiles instead (see activity_tile()):
+    tile_url(activity_id) returns the URL template of their tiles. The
+    change requests of those activities are in their tiles, too."""
+
+    def __init__(self, project_id, activities, tile_url=None):
+        """activities is a list of (id, name) tuples, the order decides
+        which layer is used if two activities have the same name."""
+        self.project_id = project_id
+        self.activities = list(activities)
+        self.tile_url = tile_url
+        self.versions = activity_versions(
+            [activity_id for activity_id, name in self.activities])
+
+    @property
+    def etag(self):
+        return hashlib.md5(json.dumps(
+            [self.activities, sorted(self.versions.items())])).hexdigest()
+
+    @property
+    def last_modified(self):
+        if not self.versions:
+            return None
+        return datetime.datetime.utcfromtimestamp(
+            max(self.versions.values()))
+
+    def geojson(self):
+        """Return the layers as a JSON object of FeatureCollections,
+        from the cache if possible."""
+        key = 'lizard_progress_map_layers_{}_{}'.format(
+            self.project_id, self.etag)
+        compressed = cache.get(key)
+        if compressed is not None:
+            return zlib.decompress(compressed).decode('utf8')
+
+        layers = self.query_layers()
+        cache.set(key, zlib.compress(layers.encode('utf8')), cache_timeout())
+        return layers
+
+    def tiled_activities(self, cursor):
+        """Return the ids of the activities that are shown with vector
+        tiles."""
+        if self.tile_url is None or tiles_from() is None:
+            return set()
+
+        cursor.execute(LOCATION_COUNTS_QUERY, {'activity_ids': [
+            activity_id for activity_id, name in self.activities]})
+        return set(activity_id for activity_id, count in cursor.fetchall()
+                   if count >= tiles_from())
+
+    def query_layers(self):
+        """Build the JSON text of the layers using two queries (three
+        if tiles are used). The features are made into JSON by the
+        database, and aren't parsed here."""
+        if not self.activities:
+            return '{}'
+
+        cursor = connection.cursor()
+        try:
+            tiled = self.tiled_activities(cursor)
+            params = {'activity_ids': [
+                activity_id for activity_id, name in self.activities
+                if activity_id not in tiled]}
+
+            location_features = {}
+            request_features = None
+            if params['activity_ids']:
+                cursor.execute(LOCATIONS_QUERY, params)
+                location_features = dict(cursor.fetchall())
+
+                cursor.execute(REQUESTS_QUERY, params)
+                request_features = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+        layers = {}
+        for activity_id, name in self.activities:
+            if activity_id in tiled:
+                layers[name] = '{{"tiles": {}}}'.format(
+                    json.dumps(self.tile_url(activity_id)))
+            else:
+                layers[name] = (
+                    '{{"type": "FeatureCollection", "features": {}}}'.format(
+                        location_features.get(activity_id, '[]')))
+        if request_features is not None:
+            layers[REQUESTS_LAYER] = (
+                '{{"type": "FeatureCollection", "features": {}}}'.format(
+                    request_features))
+
+        return '{' + ', '.join(
+            '{}: {}'.format(json.dumps(name), layer)
+            for name, layer in sorted(layers.items())) + '}'
+
+
+def tile_bounds(z, x, y):
+    """Return (xmin, ymin, xmax, ymax) of a tile in Web Mercator."""
+    size = 2 * WEB_MERCATOR_MAX / 2 ** z
+    xmin = -WEB_MERCATOR_MAX + x * size
+    ymax = WEB_MERCATOR_MAX - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def version_dirname(version):
+    return '{:d}'.format(int(version * 1000000))
+
+
+def activity_tile(activity_id, version, z, x, y, srid):
+    """Return a Mapbox Vector Tile with layers 'locations' and
+    'requests' of this activity, that have the same properties as the
+    GeoJSON features. srid is that of the geometries in the database.
+
+    Tiles are kept on disk, in a directory for each version of the
+    activity's map data (see activity_versions()). Directories of older
+    versions are removed when the first tile of a new version is
+    made. Other processes may be doing the same at the same time; if
+    our directory disappears while writing the tile, it is returned
+    without keeping it."""
+    tile_dir = directories.abs_tile_cache_dir(activity_id)
+    version_dir = os.path.join(tile_dir, version_dirname(version))
+    tile_path = os.path.join(
+        version_dir, str(z), str(x), '{}.pbf'.format(y))
+
+    if os.path.exists(tile_path):
+        with open(tile_path, 'rb') as f:
+            return f.read()
+
+    tile = query_tile(activity_id, z, x, y, srid)
+
+    if not os.path.isdir(version_dir):
+        purge_tiles(activity_id, older_than=version)
+    try:
+        os.makedirs(os.path.dirname(tile_path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    # Write and rename, so that other processes never read half a tile
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(tile_path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(tile)
+        os.rename(temp_path, tile_path)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+        # Someone else purged this directory in the meantime
+        logger.debug("Tile directory %s was removed, not keeping tile.",
+                     version_dir)
+
+    return tile
+
+
+def purge_tiles(activity_id, older_than=None):
+    """Remove the cached tiles of this activity, or only those of
+    versions older than older_than."""
+    tile_dir = directories.abs_tile_cache_dir(activity_id)
+    if not os.path.isdir(tile_dir):
+        return
+    for dirname in os.listdir(tile_dir):
+        if older_than is not None:
+            try:
+                if int(dirname) >= int(version_dirname(older_than)):
+                    continue
+            except ValueError:
+                # Not a version, e.g. another process's temporary file
+                continue
+        shutil.rmtree(os.path.join(tile_dir, dirname), ignore_errors=True)
+
+
+def query_tile(activity_id, z, x, y, srid):
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(TILE_QUERY, {
+            'activity_id': activity_id,
+            'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax,
+            'margin': (xmax - xmin) * TILE_BUFFER / TILE_EXTENT,
+            'srid': srid,
+            'extent': TILE_EXTENT,
+            'buffer': TILE_BUFFER,
+        })
+        return bytes(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+NEAREST_LOCATIONS_QUERY = """
+with click as (
+  select ST_Transform(
+    ST_SetSRID(ST_MakePoint(%(lng)s, %(lat)s), 4326), %(srid)s) as geom
+)
+select nearest.id
+from unnest(%(location_types)s) as t(location_type)
+cross join click
+cross join lateral (
+  select loc.id
+  from lizard_progress_location loc
+  where loc.activity_id = any(%(activity_ids)s)
+    and loc.location_type = t.location_type
+    and ST_DWithin(loc.the_geom, click.geom, %(radius)s)
+  order by loc.the_geom <-> click.geom
+  limit 1
+) as nearest
+order by t.location_type
+"""
+
+CLOSE_BY_COUNTS_QUERY = """
+select loc.id, count(other.id)
+from lizard_progress_location loc
+join lizard_progress_location other
+  on ST_DWithin(other.the_geom, loc.the_geom, %(distance)s)
+join lizard_progress_activity a on a.id = other.activity_id
+join lizard_progress_project p on p.id = a.project_id
+where loc.id = any(%(location_ids)s)
+  and other.complete
+  and p.organization_id = %(organization_id)s
+group by loc.id
+"""
+
+
+def nearest_locations(
+        activity_ids, lng, lat, radius, location_types, srid):
+    """Return the ids of the locations of these activities that are
+    nearest to a WGS84 point, one of each location type, at most radius
+    (in the units of srid) away.
+
+    Uses a KNN search (the <-> operator) on the spatial index of the
+    locations for each location type."""
+    if not activity_ids:
+        return []
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(NEAREST_LOCATIONS_QUERY, {
+            'activity_ids': list(activity_ids),
+            'lng': lng,
+            'lat': lat,
+            'radius': radius,
+            'location_types': list(location_types),
+            'srid': srid,
+        })
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def close_by_counts(location_ids, organization_id, distance):
+    """Return a dictionary of location id -> the number of complete
+    locations of the organization within distance of it, like
+    Location.close_by_locations_of_same_organisation().count() but for
+    many locations in one query. Locations without any are left out."""
+    if not location_ids:
+        return {}
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(CLOSE_BY_COUNTS_QUERY, {
+            'location_ids': list(location_ids),
+            'organization_id': organization_id,
+            'distance': distance,
+        })
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
@@ -20,7 +20,12 @@ from django.contrib.sites.models import Site
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
 from django.db import connection
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Avg
+from django.db.models import F
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_init
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.http import HttpRequest
@@ -31,15 +36,19 @@ from jsonfield import JSONField
 from lizard_progress.email_notifications import notify
 from lizard_progress.email_notifications.models import NotificationSubscription
 from lizard_progress.email_notifications.models import NotificationType
+from lizard_progress import access
+from lizard_progress import counters
+from lizard_progress import mapdata
 from lizard_progress.util import coordinates
 from lizard_progress.util import directories
 from lizard_progress.util import geo
+from lizard_progress.util import reviews as review_rows
+from lizard_progress.util import uploads
 # from lizard_progress.util import filler
 from lizard_progress.util.autoreviewer import AutoReviewer
-from lizard_progress.util.autoreviewer import Field
-from lizard_progress.util.autoreviewer import Observation
 
 import geojson
+import collections
 import datetime
 import functools
 import json
@@ -426,6 +435,30 @@ class ProjectActivityMixin(object):
         latest_log = UploadLog.latest_for_project(project)
         return latest_log[0] if latest_log else None
 
+    @property
+    def config_snapshot(self):
+        """A configuration.ConfigurationSnapshot of this project or
+        activity. It is made once and kept on this instance, until
+        forget_config_snapshot() is called (configuration.Configuration
+        does that when an option is set)."""
+        if getattr(self, '_config_snapshot', None) is None:
+            from lizard_progress import configuration
+            if isinstance(self, Project):
+                config = configuration.Configuration(project=self)
+            elif isinstance(self, Activity):
+                config = configuration.Configuration(activity=self)
+            else:
+                raise ValueError(
+                    "This mixin only works with Project/Activity")
+            self._config_snapshot = config.build_snapshot()
+        return self._config_snapshot
+
+    def forget_config_snapshot(self):
+        self._config_snapshot = None
+
+    def config_value(self, key):
+        return self.config_snapshot[key]
+
     @staticmethod
     def percentage(total, part):
         try:
@@ -448,18 +481,6 @@ class ProjectActivityMixin(object):
             return "ERROR-percentage-done-is---{}".format(self.percentage_done)
 
 
-class AnnotatedProjectManager(models.Manager):
-    """Special manager that adds often-used annotations
-
-    Otherwise a LOT of queries are done per project instance.
-    """
-
-    def get_queryset(self):
-        return super(AnnotatedProjectManager, self).get_queryset().annotate(
-            counted_number_of_locations=Count('activity__location',
-                                              distinct=True))
-
-
 class Project(ProjectActivityMixin, models.Model):
     name = models.CharField(max_length=50, unique=False,
                             verbose_name='projectnaam')
@@ -470,7 +491,16 @@ class Project(ProjectActivityMixin, models.Model):
     project_type = models.ForeignKey(ProjectType, null=True, blank=True)
     created_at = models.DateTimeField(default=datetime.datetime.now)
 
-    objects = AnnotatedProjectManager()
+    # Sums of the counters of the activities, see counters.py
+    location_count = models.IntegerField(default=0, editable=False)
+    complete_location_count = models.IntegerField(default=0, editable=False)
+
+    # percentage_done in SQL, for ordering. -1 instead of 'N/A', so
+    # that those projects are last when the most complete come first.
+    PERCENTAGE_DONE_SQL = (
+        'CASE WHEN lizard_progress_project.location_count > 0 THEN '
+        '(100 * lizard_progress_project.complete_location_count) / '
+        'lizard_progress_project.location_count ELSE -1 END')
 
     class Meta:
         ordering = ('name',)
@@ -508,13 +538,11 @@ class Project(ProjectActivityMixin, models.Model):
 
     @property
     def number_of_locations(self):
-        return self.counted_number_of_locations
+        return self.location_count
 
     @property
     def number_of_complete_locations(self):
-        return Location.objects.filter(
-            activity__project=self, complete=True,
-            not_part_of_project=False).count()
+        return self.complete_location_count
 
     @property
     def percentage_done(self):
@@ -569,9 +597,10 @@ class Project(ProjectActivityMixin, models.Model):
         """Yield available map layers for user."""
         from lizard_progress.util.workspaces import MapLayer
 
+        permissions = access.for_user(user)
         for activity in self.activity_set.all():
             # Obvious use for Python 3's yield from
-            for layer in activity.available_layers(user):
+            for layer in activity.available_layers(user, permissions):
                 yield layer
 
         if Hydrovak.objects.filter(project=self).exists():
@@ -664,17 +693,21 @@ class ReviewProject(models.Model):
         max_length=1000,
         null=True,
         blank=True)
-    # All performed inspections and their reviews, reviews might be empty
-    reviews = JSONField(null=True, blank=True)
-    # Calculated feature collection (happens in a task).
+    # Link to this project, included in the downloaded reviews. The
+    # inspections and their reviews are ReviewInspections.
+    project_url = models.CharField(max_length=1000, blank=True, default='')
+    # Feature collection stored by generate_feature_collection(). The
+    # map uses feature_collection_json(), made from the inspection rows.
     feature_collection_geojson = models.TextField(null=True, blank=True)
 
     # Whenever a review is uploaded, total progress of the project will be
     # (re)caclulated based on the review
     progress = models.IntegerField(default=0)
 
-    HERSTELMAATREGEL = 'Herstelmaatregel'
-    OPMERKING = 'Opmerking'
+    HERSTELMAATREGEL = review_rows.HERSTELMAATREGEL
+    OPMERKING = review_rows.OPMERKING
+    # Number of inspections that are written or read at once
+    BATCH_SIZE = 500
     # Fields which will be extracted from the Ribx
     ZB_A_FIELDS = ['AAA', 'AAB', 'AAC', 'AAD', 'AAE', 'AAF', 'AAG', 'AAH',
                    'AAI', 'AAJ', 'AAK', 'AAL', 'AAM', 'AAN', 'AAO', 'AAP',
@@ -715,19 +748,11 @@ class ReviewProject(models.Model):
         Assumes each manhole and pipe weights the same independent of the
         number of reviews it has.
 
-        Note: needs feature_collection_geojson being generated from the current reviews.
+        This is the stored progress, see update_progress(), brought up
+        to date.
         """
-        if not self.reviews:
-            return 0
-
-        if not self.feature_collection_geojson:
-            # TODO: return a 'N/A' or so rather than 0
-            return 0
-
-        completion = []
-        for feat in json.loads(self.feature_collection_geojson)['features']:
-            completion.append(feat['properties']['completion'])
-        return (int(round(sum(completion) / len(completion))) if completion else 0)
+        self.update_progress()
+        return self.progress
 
     def _calc_progress_manhole(self, manhole):
         """Return a float indicating how % much the manhole has been reviewed
@@ -829,19 +854,14 @@ class ReviewProject(models.Model):
         return project_review
 
     def setup_project_using_ribx(self, project_url, abs_ribx_path, abs_filler_path):
+        """Fill the reviews with the pipes and manholes in the RIBX file
+        that have observations that need review.
 
-        from itertools import compress
-
-        parser = etree.XMLParser()
-        tree = etree.parse(abs_ribx_path)
-        root = tree.getroot()
-
+        The file is streamed with iterparse, each pipe or manhole is
+        filtered and then removed from the tree, so only the inspections
+        that are kept are in memory at once."""
+        self.project_url = project_url or ''
         reviews = {
-            'project': {
-                'name': self.name,
-                'slug': self.slug,
-                'url': project_url
-            },
             'pipes': [],
             'manholes': []
         }
@@ -853,85 +873,314 @@ class ReviewProject(models.Model):
         else:
             ar = AutoReviewer()
 
-        for elem in root.iter('ZB_A'):
-            # pipes
-            pipe = self._parse_zb_a(elem)
-
-            if 'Beginpunt x' not in pipe:
-                # Geometry information missing, we have no good way to deal with
-                # this. Skip it.
-                logger.info('Skipping pipe', str(elem), str(pipe))
-                continue
-
-            if 'ZC' in pipe:
-
-                keep = [False] * len(pipe['ZC'])
-                zc_idx = 0
-
-                for zc in pipe['ZC']:
-
-                    obs = Observation()
-                    for k in zc.keys():
-                        obs.add_field(Field(k, zc.get(k)))
-
-                    res = ar.test_observation(obs)
-
-                    if bool(res) and res in ar.TRIGGER_CODES.keys():
-                        pipe['ZC'][zc_idx]['Trigger'] = ar.TRIGGER_CODES[res]
-                        pipe['ZC'][zc_idx]['Herstelmaatregel'] = ''
-                        pipe['ZC'][zc_idx]['Opmerking'] = ''
-                        keep[zc_idx] = True
+        for elem in self._iter_inspection_elements(abs_ribx_path):
+            if elem.tag == 'ZB_A':
+                # pipes
+                pipe = self._parse_zb_a(elem)
 
-                    zc_idx += 1
+                if 'Beginpunt x' not in pipe:
+                    # Geometry information missing, we have no good way to
+                    # deal with this. Skip it.
+                    logger.info('Skipping pipe %s', pipe)
+                    continue
 
-                if any(keep):
-                    pipe['Herstelmaatregel'] = ''
-                    pipe['Opmerking'] = ''
-                    pipe['ZC'] = list(compress(pipe['ZC'], keep))
-                    logger.debug(pipe['Beginpunt x'])
+                if self._review_observations(pipe, ar):
                     reviews['pipes'].append(pipe)
+            else:
+                # manholes
+                manhole = self._parse_zb_c(elem)
+                if self._review_observations(manhole, ar):
+                    reviews['manholes'].append(manhole)
 
-        for elem in root.iter('ZB_C'):
-            # manholes
-            manhole = self._parse_zb_c(elem)
+        self.save()
+        self.store_reviews(reviews)
+        self.generate_feature_collection()
 
-            if 'ZC' in manhole:
+    @staticmethod
+    def _iter_inspection_elements(abs_ribx_path):
+        """Yield the ZB_A (pipe) and ZB_C (manhole) elements of a RIBX
+        file in document order. Each element is cleared and removed
+        after it was handled, so memory use doesn't grow with the size
+        of the file."""
+        for event, elem in etree.iterparse(
+                abs_ribx_path, events=('end',), tag=('ZB_A', 'ZB_C'),
+                remove_comments=True):
+            yield elem
+            # Remove it and any earlier siblings
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    def _review_observations(self, inspection, ar):
+        """Let the AutoReviewer test the observations (ZC) of a pipe or
+        manhole. Only the observations that trigger something are kept,
+        with empty review fields. Returns whether any were kept."""
+        kept = []
+        observations = inspection.get('ZC', [])
+        for zc, res in zip(observations, ar.test_observations(observations)):
+            if bool(res) and res in ar.TRIGGER_CODES.keys():
+                zc['Trigger'] = ar.TRIGGER_CODES[res]
+                zc['Herstelmaatregel'] = ''
+                zc['Opmerking'] = ''
+                kept.append(zc)
+
+        if not kept:
+            return False
 
-                keep = [False] * len(manhole['ZC'])
-                zc_idx = 0
+        inspection['Herstelmaatregel'] = ''
+        inspection['Opmerking'] = ''
+        inspection['ZC'] = kept
+        return True
 
-                for zc in manhole['ZC']:
-                    obs = Observation()
-                    for k in zc.keys():
-                        obs.add_field(Field(k, zc.get(k)))
+    def set_reviews(self, the_reviews):
+        """Store the reviews of an uploaded reviews document, see
+        apply_reviews(). Returns its result. The map shows the changed
+        completions at once, see feature_collection_json()."""
+        return self.apply_reviews(the_reviews)
 
-                    res = ar.test_observation(obs)
-                    if bool(res) and res in ar.TRIGGER_CODES.keys():
-                        manhole['ZC'][zc_idx]['Trigger'] = ar.TRIGGER_CODES[res]
-                        manhole['ZC'][zc_idx]['Herstelmaatregel'] = ''
-                        manhole['ZC'][zc_idx]['Opmerking'] = ''
-                        keep[zc_idx] = True
+    def project_info(self):
+        return {
+            'name': self.name,
+            'slug': self.slug,
+            'url': self.project_url,
+        }
 
-                    zc_idx += 1
+    def store_reviews(self, reviews):
+        """Replace the inspections of this project by the pipes and
+        manholes of a reviews dict, and update the progress."""
+        self.inspections.all().delete()
+        for kind, key in review_rows.KINDS:
+            items = reviews.get(key) or []
+            for start in range(0, len(items), self.BATCH_SIZE):
+                self._store_inspections(
+                    kind, start, items[start:start + self.BATCH_SIZE])
+        self.update_progress()
+
+    def _store_inspections(self, kind, first_position, items):
+        """Bulk create the inspections in items, and their
+        observations."""
+        inspections = []
+        observations = []
+        for position, item in enumerate(items, first_position):
+            data, herstelmaatregel, opmerking = review_rows.split(item)
+            zcs = [review_rows.split(zc) for zc in item.get('ZC') or []]
+            inspections.append(ReviewInspection(
+                review_project=self, kind=kind, position=position,
+                data=data, herstelmaatregel=herstelmaatregel,
+                opmerking=opmerking,
+                completion=review_rows.completion(
+                    kind, herstelmaatregel, [zc[1] for zc in zcs])))
+            observations.append(zcs)
+
+        # Transform the coordinates of the whole batch at once
+        for inspection, geometry in zip(inspections, review_rows.geometries(
+                kind, [inspection.data for inspection in inspections])):
+            inspection.geometry = geometry
+        ReviewInspection.objects.bulk_create(inspections)
+
+        # bulk_create doesn't set the primary keys
+        ids = dict(self.inspections.filter(
+            kind=kind, position__gte=first_position,
+            position__lt=first_position + len(items)).values_list(
+                'position', 'id'))
+        ReviewObservation.objects.bulk_create([
+            ReviewObservation(
+                inspection_id=ids[position], position=index,
+                data=zc_data, herstelmaatregel=zc_herstelmaatregel,
+                opmerking=zc_opmerking)
+            for position, inspection_zcs in enumerate(
+                observations, first_position)
+            for index, (zc_data, zc_herstelmaatregel, zc_opmerking)
+            in enumerate(inspection_zcs)])
+
+    def iter_inspections(self, kind):
+        """Yield the pipes or manholes of this project as dicts in the
+        format of the reviews document, with the ids and versions of the
+        inspection and its observations. They are read in batches, with
+        one query for the observations of each batch."""
+        inspections = self.inspections.filter(kind=kind).order_by('position')
+        last_position = -1
+        while True:
+            batch = list(inspections.filter(
+                position__gt=last_position)[:self.BATCH_SIZE])
+            if not batch:
+                return
 
-                if any(keep):
-                    manhole['Herstelmaatregel'] = ''
-                    manhole['Opmerking'] = ''
-                    manhole['ZC'] = list(compress(manhole['ZC'], keep))
-                    reviews['manholes'].append(manhole)
+            zcs = collections.defaultdict(list)
+            for observation in ReviewObservation.objects.filter(
+                    inspection__in=batch).order_by('inspection', 'position'):
+                zcs[observation.inspection_id].append(review_rows.join(
+                    observation.data, observation.herstelmaatregel,
+                    observation.opmerking,
+                    id=observation.id, version=observation.version))
+
+            for inspection in batch:
+                extra = {'id': inspection.id, 'version': inspection.version}
+                if kind == review_rows.PIPE or zcs[inspection.id]:
+                    extra['ZC'] = zcs[inspection.id]
+                yield review_rows.join(
+                    inspection.data, inspection.herstelmaatregel,
+                    inspection.opmerking, **extra)
+            last_position = batch[-1].position
+
+    def get_reviews(self):
+        """Return the reviews document of this project: a dict with its
+        pipes and manholes and their observations."""
+        reviews = {'project': self.project_info()}
+        for kind, key in review_rows.KINDS:
+            reviews[key] = list(self.iter_inspections(kind))
+        return reviews
+
+    def iter_reviews_json(self):
+        """Yield the reviews document as JSON, in parts, so that it can
+        be streamed."""
+        yield '{"project": %s' % json.dumps(self.project_info())
+        for kind, key in review_rows.KINDS:
+            yield ',\n"%s": [' % key
+            for index, item in enumerate(self.iter_inspections(kind)):
+                yield (',\n' if index else '\n') + json.dumps(
+                    item, indent=2)
+            yield ']'
+        yield '}\n'
+
+    def apply_reviews(self, reviews):
+        """Store the review fields of an uploaded reviews document. Pipes
+        and manholes are matched on their id, or, if they have none, on
+        their position in the document. Observations likewise. Versions
+        are not checked, the upload wins. See update_reviews()."""
+        positions = dict(
+            ((kind, position), pk) for pk, kind, position in
+            self.inspections.values_list('id', 'kind', 'position'))
+
+        items = []
+        for kind, key in review_rows.KINDS:
+            if not isinstance(reviews, dict):
+                break
+            for position, item in enumerate(reviews.get(key) or []):
+                if not isinstance(item, dict):
+                    continue
+                pk = item.get('id') or positions.get((kind, position))
+                if pk is not None:
+                    items.append(dict(item, id=pk))
+        return self.update_reviews(items, check_versions=False)
+
+    def update_reviews(self, items, check_versions=True):
+        """Apply the reviews in items, which are dicts like those of
+        iter_inspections() but only need the id and the fields that
+        changed. Their observations (ZC) can be partial too, if they
+        have ids. Only the inspections and observations that changed are
+        written, their version is increased.
+
+        If check_versions is true, items and observations that have a
+        version that isn't the current one are not applied, because
+        they were changed by someone else in the meantime.
+
+        Returns a dict with the new versions of the updated inspections
+        ('updated', a list of dicts with 'id' and 'version'), the ids
+        of conflicting items ('conflicts') and the ids that aren't
+        inspections of this project ('unknown')."""
+        items = dict((item['id'], item) for item in items)
+        ids = sorted(items)
+        result = {'updated': [], 'conflicts': [], 'unknown': []}
+
+        with transaction.atomic():
+            for start in range(0, len(ids), self.BATCH_SIZE):
+                chunk = ids[start:start + self.BATCH_SIZE]
+                # Lock them, observations are only changed along with
+                # their inspection
+                inspections = ReviewInspection.objects.filter(
+                    review_project=self, id__in=chunk).select_for_update()
+                inspections = inspections.values_list(
+                    'id', 'kind', 'herstelmaatregel', 'opmerking', 'version')
+                observations = collections.defaultdict(list)
+                for row in ReviewObservation.objects.filter(
+                        inspection__in=chunk).order_by(
+                            'position').values_list(
+                                'inspection', 'id', 'herstelmaatregel',
+                                'opmerking', 'version'):
+                    observations[row[0]].append(row[1:])
+
+                found = set()
+                for row in inspections:
+                    pk, version = row[0], row[-1]
+                    found.add(pk)
+                    new_version = self._update_inspection(
+                        items[pk], row, observations[pk], check_versions)
+                    if new_version is None:
+                        result['conflicts'].append(pk)
+                    elif new_version != version:
+                        result['updated'].append(
+                            {'id': pk, 'version': new_version})
+                result['unknown'].extend(
+                    pk for pk in chunk if pk not in found)
+
+            if result['updated']:
+                self.update_progress()
 
-        self.set_reviews(reviews, from_task=True)  # Saves
+        return result
 
-    def set_reviews(self, the_reviews, from_task=False):
-        self.reviews = the_reviews
-        self.save()
+    def _update_inspection(self, item, row, observations, check_versions):
+        """Apply item to one inspection. row is the inspection's (id,
+        kind, herstelmaatregel, opmerking, version), observations a list
+        of its observations' (id, herstelmaatregel, opmerking, version).
+        Returns its new version, or None in case of a conflict."""
+        pk, kind, herstelmaatregel, opmerking, version = row
+        if check_versions and item.get('version', version) != version:
+            return None
 
-        # Run the calculation async; except if we already are.
-        if from_task:
-            self.generate_feature_collection()
-        else:
-            from lizard_progress.tasks import calculate_reviewproject_feature_collection
-            calculate_reviewproject_feature_collection.delay(self.pk)
+        by_id = dict((observation[0], observation)
+                     for observation in observations)
+        herstelmaatregels = dict((observation[0], observation[1])
+                                 for observation in observations)
+        changes = []
+        for index, zc in enumerate(item.get('ZC') or []):
+            if 'id' in zc:
+                observation = by_id.get(zc['id'])
+            elif index < len(observations):
+                observation = observations[index]
+            else:
+                observation = None
+            if observation is None:
+                continue
+
+            observation_id, old_herstelmaatregel, old_opmerking, \
+                observation_version = observation
+            if (check_versions and
+                    zc.get('version', observation_version) !=
+                    observation_version):
+                return None
+            new = (zc.get(self.HERSTELMAATREGEL, old_herstelmaatregel) or '',
+                   zc.get(self.OPMERKING, old_opmerking) or '')
+            if new != (old_herstelmaatregel, old_opmerking):
+                changes.append((observation_id, new))
+                herstelmaatregels[observation_id] = new[0]
+
+        new = (item.get(self.HERSTELMAATREGEL, herstelmaatregel) or '',
+               item.get(self.OPMERKING, opmerking) or '')
+        if not changes and new == (herstelmaatregel, opmerking):
+            return version
+
+        for observation_id, (new_herstelmaatregel, new_opmerking) in changes:
+            ReviewObservation.objects.filter(pk=observation_id).update(
+                herstelmaatregel=new_herstelmaatregel,
+                opmerking=new_opmerking,
+                version=F('version') + 1)
+        ReviewInspection.objects.filter(pk=pk).update(
+            herstelmaatregel=new[0],
+            opmerking=new[1],
+            completion=review_rows.completion(
+                kind, new[0], list(herstelmaatregels.values())),
+            version=version + 1)
+        return version + 1
+
+    def update_progress(self):
+        """Set progress to the mean completion of the inspections, using
+        an aggregate query."""
+        completion = self.inspections.aggregate(
+            completion=Avg('completion'))['completion']
+        self.progress = int(round(completion or 0))
+        ReviewProject.objects.filter(pk=self.pk).update(
+            progress=self.progress)
 
     def _parse_zb_a(self, zb_a):
         """Parse a zb_a (pipe) and extract all relevant info (as stated in the
@@ -1037,20 +1286,18 @@ class ReviewProject(models.Model):
 
         :return: tuple of x, y coordinates in WSG84
         """
-        # Try to get the first pipe coordinate
-        if len(self.reviews['pipes']) > 0:
-            if self.reviews['pipes'][0].get('Beginpunt x') and \
-                    self.reviews['pipes'][0].get('Beginpunt x'):
-                x = float(self.reviews['pipes'][0].get('Beginpunt x'))
-                y = float(self.reviews['pipes'][0].get('Beginpunt y'))
-                return coordinates.rd_to_wgs84(x, y)
-        # else try to get the first manhole coordinate
-        elif len(self.reviews['manholes']) > 0:
-            if self.reviews['manholes'][0].get('x') and \
-                    self.reviews['manholes'][0].get('y'):
-                x = float(self.reviews['manholes'][0].get('x'))
-                y = float(self.reviews['manholes'][0].get('y'))
-                return coordinates.rd_to_wgs84(x, y)
+        for kind, x_key, y_key in (
+                (review_rows.PIPE, 'Beginpunt x', 'Beginpunt y'),
+                (review_rows.MANHOLE, 'x', 'y')):
+            first = self.inspections.filter(
+                kind=kind).order_by('position').first()
+            if first is not None:
+                # Try the coordinate of the first pipe, or else of the
+                # first manhole
+                if first.data.get(x_key) and first.data.get(y_key):
+                    return coordinates.rd_to_wgs84(
+                        float(first.data[x_key]), float(first.data[y_key]))
+                break
         # else just center on the Netherlands
         return (52.422, 5.268316940015781)
 
@@ -1081,86 +1328,111 @@ class ReviewProject(models.Model):
         pipes_geo = self._pipes_to_lines()
         return geojson.GeometryCollection([manholes_geo, pipes_geo])
 
+    def _geometries(self, kind=None):
+        """The stored geometries of the inspections, manholes first, as
+        (geometry dict, completion) tuples."""
+        inspections = self.inspections.filter(geometry__isnull=False)
+        if kind is not None:
+            inspections = inspections.filter(kind=kind)
+        for geometry, completion in inspections.order_by(
+                'kind', 'position').values_list(
+                    'geometry', 'completion').iterator():
+            yield json.loads(geometry), completion
+
     def _manholes_to_points(self):
         """Convert the manholes to a MultiPoint geojson object"""
-        points = []
-        for manhole in self.reviews['manholes']:
-            x, y = manhole['x'], manhole['y']
-            points.append(coordinates.rd_to_wgs84(x, y))
-        return geojson.MultiPoint(points)
+        return geojson.MultiPoint([
+            geometry['coordinates'] for geometry, completion in
+            self._geometries(review_rows.MANHOLE)])
 
     def _pipes_to_lines(self):
         """Convert the pipes to a MultiLineString geojson object"""
-        lines = []
-        for pipe in self.reviews['pipes']:
-            start = [float(pipe['Beginpunt x']),
-                     float(pipe['Beginpunt y'])]
-            start = coordinates.rd_to_wgs84(start[0], start[1])
-            end = [float(pipe['Eindpunt x']),
-                   float(pipe['Eindpunt y'])]
-            end = coordinates.rd_to_wgs84(end[0], end[1])
-            lines.append([start, end])
-        return geojson.MultiLineString(lines)
+        return geojson.MultiLineString([
+            geometry['coordinates'] for geometry, completion in
+            self._geometries(review_rows.PIPE)])
 
-    def generate_feature_collection(self):
-        """Create a feature collection of the reviews.
+    def feature_collection_json(self):
+        """Return a feature collection of the reviews as GeoJSON text,
+        made from the inspection rows with one query, so that it always
+        shows their current completion.
 
         Each feature gets a set of properties:
-            - Completion: float between 0-1, indicating how much it has been
-            reviews (manhole is either 0 or 1, but pipes can contain many
-            reviews.
+            - Completion: float between 0-100, indicating how much it has
+            been reviewed (a manhole is either 0 or 100, but pipes can
+            contain many reviews).
 
-        Total progress will be calculated as the mean of all features' progress.
+        The geometries were calculated (as GeoJSON text) when the
+        inspections were stored, they aren't parsed here. Inspections
+        without coordinates are skipped.
         """
-        features = []
-        progress_tot = 0
-        # total number of measure points (manholes and pipes )
-        cnt = 1
+        features = (
+            '{{"geometry": {}, "properties": {{"completion": {}}}, '
+            '"type": "Feature"}}'.format(geometry, json.dumps(completion))
+            for geometry, completion in self.inspections.filter(
+                geometry__isnull=False).order_by(
+                    'kind', 'position').values_list(
+                        'geometry', 'completion').iterator())
+        return '{{"features": [{}], "type": "FeatureCollection"}}'.format(
+            ', '.join(features))
 
-        # manholes
-        for manhole in self.reviews['manholes']:
-            try:
-                x, y = manhole['x'], manhole['y']
-            except KeyError:
-                # some manholes are missing coordinates, we can't do anything
-                # for those
-                continue
-            coord = coordinates.rd_to_wgs84(x, y)
-            geom = geojson.Point(coord)
-            completion = self._calc_progress_manhole(manhole)
-            progress_tot += completion
-            cnt += 1
-            feature = geojson.Feature(geometry=geom,
-                                      properties={"completion": completion})
-            features.append(feature)
-
-        # pipes
-        for pipe in self.reviews['pipes']:
-            try:
-                start = [float(pipe['Beginpunt x']),
-                         float(pipe['Beginpunt y'])]
-                start = coordinates.rd_to_wgs84(start[0], start[1])
-                end = [float(pipe['Eindpunt x']),
-                       float(pipe['Eindpunt y'])]
-                end = coordinates.rd_to_wgs84(end[0], end[1])
-            except KeyError:
-                # missing coordinates, can't create geojson...
-                continue
-            geom = geojson.LineString([start, end])
+    def generate_feature_collection(self):
+        """Store feature_collection_json() in feature_collection_geojson."""
+        self.feature_collection_geojson = self.feature_collection_json()
+        ReviewProject.objects.filter(pk=self.pk).update(
+            feature_collection_geojson=self.feature_collection_geojson)
 
-            completion = self._calc_progress_pipe(pipe)
-            progress_tot += completion
-            cnt += 1
-            feature = geojson.Feature(geometry=geom,
-                                      properties={"completion": completion})
-            features.append(feature)
 
-        self.progress = progress_tot / cnt
+class ReviewInspection(models.Model):
+    """A pipe or manhole of a review project, with its review.
 
-        self.feature_collection_geojson = geojson.dumps(
-            geojson.FeatureCollection(features),
-            sort_keys=True)
-        self.save()
+    The fields from the RIBX file are in data, the review fields have
+    columns of their own. The version is increased whenever the review
+    of the inspection or of one of its observations changes."""
+    KIND_CHOICES = (
+        (review_rows.PIPE, 'Pipe'),
+        (review_rows.MANHOLE, 'Manhole'),
+    )
+
+    review_project = models.ForeignKey(
+        ReviewProject, related_name='inspections')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Position in the project's list of pipes or manholes
+    position = models.IntegerField()
+    data = JSONField()
+
+    herstelmaatregel = models.TextField(blank=True, default='')
+    opmerking = models.TextField(blank=True, default='')
+    version = models.IntegerField(default=1)
+
+    # Percentage reviewed, see util.reviews.completion()
+    completion = models.FloatField(default=0)
+    # GeoJSON geometry in WGS84, calculated once when it is stored
+    geometry = models.TextField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (('review_project', 'kind', 'position'),)
+        ordering = ('kind', 'position')
+
+    def __unicode__(self):
+        return '{} {} of {}'.format(
+            self.kind, self.position, self.review_project_id)
+
+
+class ReviewObservation(models.Model):
+    """An observation (ZC) of a ReviewInspection, with its review."""
+    inspection = models.ForeignKey(
+        ReviewInspection, related_name='observations')
+    # Position in the inspection's list of observations
+    position = models.IntegerField()
+    data = JSONField()
+
+    herstelmaatregel = models.TextField(blank=True, default='')
+    opmerking = models.TextField(blank=True, default='')
+    version = models.IntegerField(default=1)
+
+    class Meta:
+        unique_together = (('inspection', 'position'),)
+        ordering = ('position',)
 
 
 class AcceptedFile(models.Model):
@@ -1180,15 +1452,22 @@ class AcceptedFile(models.Model):
         blank=True)
     uploaded_at = models.DateTimeField(
         default=datetime.datetime.now)
+    # SHA-256 of the file's content, to find identical files
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    # Number of measurements parsed from the file when it was accepted
+    num_measurements = models.IntegerField(null=True, blank=True)
 
     class Meta:
         unique_together = (("activity", "rel_file_path"),)
+        index_together = (("activity", "content_hash"),)
 
     @classmethod
-    def create_from_path(cls, activity, rel_file_path):
+    def create_from_path(cls, activity, rel_file_path, content_hash=None,
+                         num_measurements=None):
         """Create and return accepted file
 
-        Set attributes like file size according to the actual file.
+        Set attributes like file size according to the actual file. The
+        content hash is computed if it isn't given.
         """
         accepted_file, created = cls.objects.get_or_create(
             activity=activity,
@@ -1197,9 +1476,93 @@ class AcceptedFile(models.Model):
         accepted_file.file_size = os.path.getsize(abs_file_path)
         accepted_file.uploaded_at = datetime.datetime.fromtimestamp(
             os.path.getmtime(abs_file_path))
+        accepted_file.content_hash = (
+            content_hash or uploads.file_digest(abs_file_path))
+        accepted_file.num_measurements = num_measurements
         accepted_file.save()
         return accepted_file
 
+    @property
+    def abs_file_path(self):
+        return directories.absolute(self.rel_file_path)
+
+
+class CatalogFile(models.Model):
+    """A file that can be downloaded from the download pages: the files
+    of an organization or project, hydrovakken shapefiles, and the
+    reports, results and shapefiles of activities. The download pages
+    list them from here instead of from the file system, see
+    file_catalog.py."""
+    KIND_ORGANIZATION = 'organization'
+    KIND_PROJECT = 'project'
+    KIND_HYDROVAKKEN = 'hydrovakken'
+    KIND_REPORTS = 'reports'
+    KIND_RESULTS = 'results'
+    KIND_SHAPEFILE = 'shapefile'
+
+    KIND_CHOICES = (
+        (KIND_ORGANIZATION, 'Organization files'),
+        (KIND_PROJECT, 'Project files'),
+        (KIND_HYDROVAKKEN, 'Hydrovakken'),
+        (KIND_REPORTS, 'Reports'),
+        (KIND_RESULTS, 'Results'),
+        (KIND_SHAPEFILE, 'Shapefiles'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+
+    # Only the one the kind belongs to is set
+    organization = models.ForeignKey(Organization, null=True, blank=True)
+    project = models.ForeignKey(Project, null=True, blank=True)
+    activity = models.ForeignKey('Activity', null=True, blank=True)
+
+    rel_file_path = models.CharField(max_length=1000, unique=True)
+    file_size = models.BigIntegerField()  # in bytes
+    modified_at = models.DateTimeField()
+    uploaded_at = models.DateTimeField(null=True, blank=True)
+    last_downloaded_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = (
+            ('organization', 'kind'),
+            ('project', 'kind'),
+            ('activity', 'kind'),
+        )
+
+    def __unicode__(self):
+        return self.rel_file_path
+
+    @property
+    def filename(self):
+        return os.path.basename(self.rel_file_path)
+
+    @property
+    def abs_file_path(self):
+        return directories.absolute(self.rel_file_path)
+
+    @property
+    def human_size(self):
+        return directories.format_size(self.file_size)
+
+
+class CatalogScan(models.Model):
+    """When a directory of the file catalog was last scanned. Until it
+    has been scanned once, its catalog may be incomplete."""
+    kind = models.CharField(max_length=20, choices=CatalogFile.KIND_CHOICES)
+
+    organization = models.ForeignKey(Organization, null=True, blank=True)
+    project = models.ForeignKey(Project, null=True, blank=True)
+    activity = models.ForeignKey('Activity', null=True, blank=True)
+
+    scanned_at = models.DateTimeField()
+
+    class Meta:
+        index_together = (
+            ('organization', 'kind'),
+            ('project', 'kind'),
+            ('activity', 'kind'),
+        )
+
 
 class Location(models.Model):
     LOCATION_TYPE_POINT = 'point'
@@ -1316,9 +1679,11 @@ class Location(models.Model):
             kwargs={'project_slug': self.activity.project.slug,
                     'location_code': self.location_code})
 
-    def plan_location(self, location):
+    def plan_location(self, location, save=True):
         """Set our geometrical location, IF it wasn't set yet.
-        location can be either a Point or a LineString."""
+        location can be either a Point or a LineString.
+
+        Return True if the location was set."""
         if hasattr(location, 'ExportToWkt'):
             if geo.is_line(location):
                 location = geo.osgeo_3d_line_to_2d_wkt(location)
@@ -1328,7 +1693,10 @@ class Location(models.Model):
         if self.the_geom is None:
             self.the_geom = location
             self.is_point = not geo.is_line(location)
-            self.save()
+            if save:
+                self.save()
+            return True
+        return False
 
     def plan_date(self, date):
         """Set a location's planned date. Can't change anymore once
@@ -1490,6 +1858,11 @@ class Activity(ProjectActivityMixin, models.Model):
         'Activity', verbose_name='Activity to copy locations from',
         null=True, blank=True)
 
+    # Progress counters, kept up to date by counters.py
+    location_count = models.IntegerField(default=0, editable=False)
+    complete_location_count = models.IntegerField(default=0, editable=False)
+    measurement_count = models.IntegerField(default=0, editable=False)
+
     class NoLocationException(Exception):
         pass
 
@@ -1501,11 +1874,6 @@ class Activity(ProjectActivityMixin, models.Model):
             'lizard_progress_activity_dashboard',
             kwargs={'activity_id': self.id, 'project_slug': self.project.slug})
 
-    def config_value(self, key):
-        from lizard_progress import configuration
-        config = configuration.Configuration(activity=self)
-        return config.get(key)
-
     def error_configuration(self):
         from lizard_progress import errors
         return errors.ErrorConfiguration(
@@ -1558,24 +1926,20 @@ class Activity(ProjectActivityMixin, models.Model):
             self.project.is_manager(user) or
             self.contractor == Organization.get_by_user(user))
 
-    @cached_property
+    @property
     def num_locations(self):
-        return self.location_set.filter(
-            not_part_of_project=False).count()
+        return self.location_count
 
     def has_locations(self):
         return self.location_set.filter(not_part_of_project=False).exists()
 
     @property
     def num_complete_locations(self):
-        return self.location_set.filter(
-            complete=True, not_part_of_project=False).count()
+        return self.complete_location_count
 
-    @cached_property
+    @property
     def num_measurements(self):
-        return Measurement.objects.filter(
-            location__activity=self,
-            location__not_part_of_project=False).count()
+        return self.measurement_count
 
     def has_measurements(self):
         return self.num_measurements > 0
@@ -1653,9 +2017,11 @@ class Activity(ProjectActivityMixin, models.Model):
 
         return activity
 
-    def available_layers(self, user):
+    def available_layers(self, user, permissions=None):
         """Yield available map layers."""
-        if not has_access(user, self.project, self.contractor):
+        if permissions is None:
+            permissions = access.for_user(user)
+        if not permissions.can_see_activity(self):
             return
 
         if not self.measurement_type.can_be_displayed:
@@ -1722,7 +2088,7 @@ class Activity(ProjectActivityMixin, models.Model):
 
     @property
     def percentage_done(self):
-        if self.has_locations():
+        if self.num_locations:
             return self.percentage(self.num_locations,
                                    self.num_complete_locations)
         else:
@@ -1885,12 +2251,14 @@ class Measurement(models.Model):
 
     objects = models.GeoManager()
 
-    def record_location(self, location):
+    def record_location(self, location, save=True):
         """Save where this measurement was taken. THEN, plan that
         location in our Location object (only sets it if the location
         didn't have a point yet.
 
-        location can be a Point or a LineString."""
+        location can be a Point or a LineString. With save=False
+        nothing is saved, which is left to the caller; return True if
+        the Location was planned."""
         self.is_point = not geo.is_line(location)
 
         if hasattr(location, 'ExportToWkt'):
@@ -1899,8 +2267,9 @@ class Measurement(models.Model):
             else:
                 location = geo.osgeo_3d_line_to_2d_wkt(location)
         self.the_geom = location
-        self.save()
-        self.location.plan_location(location)
+        if save:
+            self.save()
+        return self.location.plan_location(location, save=save)
 
     def get_absolute_url(self):
         """Return the URL to the uploaded file that contained this
@@ -2129,12 +2498,7 @@ class Hydrovak(models.Model):
 
         datasource = DataSource(abs_shapefile_path)
 
-        # We only import configuration here, because it imports this module
-        # for the OrganizationConfig and ProjectConfig models.
-        from lizard_progress import configuration
-        id_field_name = configuration.get(
-            activity=None, project=project,
-            config_option='hydrovakken_id_field')
+        id_field_name = project.config_value('hydrovakken_id_field')
 
         layer = datasource[0]
 
@@ -2162,6 +2526,72 @@ class Hydrovak(models.Model):
                     .format(id_field_name))
 
 
+class UploadBatch(models.Model):
+    """A zip file that was uploaded as a whole. Each of its members
+    becomes an UploadedFile of the batch, that is extracted from the zip
+    and processed by its own background task, so that all workers can
+    work on a large batch at once. The counters are kept up to date by
+    those tasks to show progress; when the last one is done, the batch
+    is marked finished."""
+
+    activity = models.ForeignKey(Activity)
+
+    uploaded_by = models.ForeignKey(User)
+    uploaded_at = models.DateTimeField()
+
+    # The zip file, kept until the batch is finished
+    rel_file_path = models.CharField(max_length=255)
+
+    num_files = models.IntegerField(default=0)
+    num_succeeded = models.IntegerField(default=0)
+    num_failed = models.IntegerField(default=0)
+
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-uploaded_at',)
+
+    def __unicode__(self):
+        return "{} ({}/{} files processed)".format(
+            self.filename, self.num_processed, self.num_files)
+
+    @property
+    def filename(self):
+        return os.path.basename(self.rel_file_path)
+
+    @property
+    def abs_file_path(self):
+        return directories.absolute(self.rel_file_path)
+
+    @property
+    def num_processed(self):
+        return self.num_succeeded + self.num_failed
+
+    @property
+    def num_pending(self):
+        return max(self.num_files - self.num_processed, 0)
+
+    def as_dict(self):
+        """This will be turned into JSON to send to the UI."""
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'uploaded_by': self.uploaded_by.get_full_name() or
+            self.uploaded_by.username,
+            'uploaded_at': self.uploaded_at.strftime("%d/%m/%y %H:%M"),
+            'num_files': self.num_files,
+            'num_succeeded': self.num_succeeded,
+            'num_failed': self.num_failed,
+            'num_pending': self.num_pending,
+            'finished': self.finished_at is not None,
+        }
+
+    def save(self, *args, **kwargs):
+        if self.rel_file_path.startswith('/'):
+            self.rel_file_path = directories.relative(self.rel_file_path)
+        super(UploadBatch, self).save(*args, **kwargs)
+
+
 class UploadedFile(models.Model):
     """This model represents a file that was uploaded.
 
@@ -2207,6 +2637,37 @@ class UploadedFile(models.Model):
     # image).
     linelike = models.BooleanField(default=True)
 
+    # RIBX files are also checked by the GWSW API, after they were
+    # processed. Its errors are added to this file's errors when they
+    # arrive.
+    GWSW_STATUS_NONE = ''
+    GWSW_STATUS_PENDING = 'pending'
+    GWSW_STATUS_OK = 'ok'
+    GWSW_STATUS_ERRORS = 'errors'
+    GWSW_STATUS_FAILED = 'failed'
+    GWSW_STATUS_CHOICES = (
+        (GWSW_STATUS_NONE, 'Niet gecontroleerd'),
+        (GWSW_STATUS_PENDING, 'Wordt gecontroleerd'),
+        (GWSW_STATUS_OK, 'Geen fouten'),
+        (GWSW_STATUS_ERRORS, 'Fouten gevonden'),
+        (GWSW_STATUS_FAILED, 'Controle mislukt'),
+    )
+    gwsw_status = models.CharField(
+        max_length=10, choices=GWSW_STATUS_CHOICES, default=GWSW_STATUS_NONE,
+        blank=True)
+    gwsw_record_id = models.IntegerField(null=True, blank=True)
+
+    # SHA-256 of the file's content, set when it is processed
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+
+    # Files that came out of a zip file uploaded as a batch remember
+    # their batch and their name inside the zip.
+    batch = models.ForeignKey(UploadBatch, null=True, blank=True)
+    batch_member = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        index_together = (("activity", "content_hash"),)
+
     class PathDoesNotExist(Exception):
         pass
 
@@ -2223,20 +2684,35 @@ class UploadedFile(models.Model):
 
         new_uf.schedule_processing()
 
-    def schedule_processing(self):
+    def schedule_processing(self, size=None):
         """Queue the 'process_uploaded_file' task for this uploaded file when
         the current database transaction has committed, using
         django-transaction-hooks.
+
+        If our TaskRouter is used, the queue depends on the size of
+        the file in bytes (see routing.upload_queue()), it is looked up
+        if it isn't given. Otherwise the task goes to the default queue.
         """
         # Need to import here to prevent circular imports
+        from . import routing
         from . import tasks
 
+        options = {}
+        if routing.is_enabled():
+            if size is None:
+                try:
+                    size = os.path.getsize(self.abs_file_path)
+                except OSError:
+                    pass  # Processing will find out
+            options['queue'] = routing.upload_queue(size)
+
         # connection.on_commit is provided by our custom database
         # engine (lizard_progress.db_engine). It takes a callable
         # without arguments, so we use lambda here.
 
         connection.on_commit(
-            lambda: tasks.process_uploaded_file_task.delay(self.id))
+            lambda: tasks.process_uploaded_file_task.apply_async(
+                args=[self.id], **options))
 
     @property
     def filename(self):
@@ -2311,7 +2787,8 @@ class UploadedFile(models.Model):
                     'activity_id': self.activity.id,
                     'uploaded_file_id': self.id
                 }),
-            'has_possible_requests': self.has_possible_requests()
+            'has_possible_requests': self.has_possible_requests(),
+            'gwsw_status': self.gwsw_status,
         }
 
     def has_possible_requests(self):
@@ -2383,6 +2860,16 @@ class ExportRun(models.Model):
 
     error_message = models.CharField(max_length=100, null=True, blank=True)
 
+    # What the last run exported: for each measurement its timestamp
+    # and the name of its entry in the zip file (if any), that
+    # up_to_date compares with the current measurements. See
+    # make_manifest().
+    manifest = JSONField(null=True, blank=True)
+
+    # These exports write zip files that are updated by the next run,
+    # instead of being generated from scratch.
+    INCREMENTAL_EXPORTTYPES = ('allfiles', 'dxf', 'csv')
+
     @property
     def generates_directory(self):
         # At the moment there's one export type that generates a directory
@@ -2409,13 +2896,16 @@ class ExportRun(models.Model):
         return instance
 
     @classmethod
-    def all_in_project(cls, project, user):
+    def all_in_project(cls, project, user, permissions=None):
         """Yield all the export runs user has access to in this
-        project."""
+        project. Permissions (see access.py) are computed if they
+        aren't given."""
+        if permissions is None:
+            permissions = access.for_user(user)
 
         for activity in project.activity_set.all():
             mtype = activity.measurement_type
-            if has_access(user, project, activity.contractor):
+            if permissions.can_see_activity(activity):
                 if mtype.implementation_slug == 'dwarsprofiel':
                     yield cls.get_or_create(activity, 'met')
                     yield cls.get_or_create(activity, 'dxf')
@@ -2487,6 +2977,9 @@ class ExportRun(models.Model):
         if self.generates_directory:
             logger.debug(
                 "Not clearing directory, we only want to update new files")
+        elif self.exporttype in self.INCREMENTAL_EXPORTTYPES + ('met',):
+            logger.debug(
+                "Not removing file, the next run only replaces what changed")
         else:
             if self.rel_file_path and os.path.exists(self.abs_file_path):
                 os.remove(self.abs_file_path)
@@ -2514,19 +3007,64 @@ class ExportRun(models.Model):
         if self.exporttype == 'pointshape':
             return False  # We can't check if it's up to date
 
-        measurement_dates = [
-            measurement.timestamp
-            for measurement in self.measurements_to_export()
-        ]
+        if not self.available:
+            return False
+
+        if self.manifest is None:
+            # Exported before we had manifests
+            latest = self.measurements_to_export().aggregate(
+                models.Max('timestamp'))['timestamp__max']
+            return latest is None or self.created_at > latest
+
+        return self.manifest_is_current()
+
+    def manifest_is_current(self):
+        """Return True if the measurements to export are still the same
+        as in our manifest, with the same timestamps. Uses one query
+        for the ids and timestamps."""
+        if not self.manifest:
+            return False
+
+        exported = dict(
+            (measurement_id, measurement['timestamp'])
+            for measurement_id, measurement
+            in self.manifest.get('measurements', {}).items())
+        current = self.current_manifest()['measurements']
+
+        return exported == dict(
+            (measurement_id, measurement['timestamp'])
+            for measurement_id, measurement in current.items())
 
-        return (self.available and
-                (not measurement_dates or
-                 self.created_at > max(measurement_dates)))
+    @staticmethod
+    def make_manifest(measurements):
+        """Make a manifest out of (measurement id, timestamp, entry name)
+        tuples, entry name is None if the measurement has no entry of its
+        own in the exported file."""
+        manifest = {}
+        for measurement_id, timestamp, entry in measurements:
+            manifest[unicode(measurement_id)] = {
+                'timestamp': timestamp.isoformat(),
+                'entry': entry,
+            }
+
+        return {'measurements': manifest}
+
+    def current_manifest(self):
+        """Manifest of the measurements to export as they are now,
+        without entries."""
+        return self.make_manifest(
+            (measurement_id, timestamp, None)
+            for measurement_id, timestamp
+            in self.measurements_to_export().values_list('id', 'timestamp'))
 
     def measurements_to_export(self):
+        # The renderers in exports.py use the location and its activity
+        # in worker processes that can't query the database. A bare
+        # select_related() doesn't follow the nullable location.
         return Measurement.objects.filter(
             location__activity=self.activity,
-            location__complete=True).select_related()
+            location__complete=True).select_related(
+                'location__activity__project')
 
     def abs_files_to_export(self):
         return set(
@@ -2661,29 +3199,146 @@ class LizardConfiguration(models.Model):
         return self.name or self.geoserver_database_engine
 
 
-@receiver(post_save, sender=Location)
-def message_project_complete(sender, instance, **kwargs):
-    kwargs = {
-        'action_object': instance.activity.project,
-        'extra': {'link': Site.objects.get_current().domain +
-                  instance.activity.project.get_absolute_url(), }
-    }
-    if instance.complete and instance.activity.project.is_complete():
+# Versions of cached data, see versions.py
+
+class CacheVersion(models.Model):
+    """The current version of some cached data. Kept in the database
+    instead of the cache, so that all processes see a new version even
+    if each has a cache of its own."""
+    key = models.CharField(max_length=100, unique=True)
+    version = models.FloatField()
+
+    def __unicode__(self):
+        return "{}: {}".format(self.key, self.version)
+
+
+def notify_project_complete(activity):
+    """Notify the managers if the activity's project is complete."""
+    if activity.project.is_complete():
         notification_type = NotificationType.objects.get(
             name="project voltooid")
-        return instance.activity.notify_managers(notification_type, **kwargs)
+        return activity.notify_managers(
+            notification_type,
+            action_object=activity.project,
+            extra={'link': Site.objects.get_current().domain +
+                   activity.project.get_absolute_url()})
 
 
-@receiver(post_save, sender=Location)
-def message_activity_complete(sender, instance, **kwargs):
-    kwargs = {
-        'action_object': instance.activity,
-        'target': instance.activity.project,
-        'extra': {'link': Site.objects.get_current().domain +
-                  instance.activity.get_absolute_url(), }
-    }
-
-    if instance.complete and instance.activity.is_complete():
+def notify_activity_complete(activity):
+    """Notify the managers if the activity is complete."""
+    if activity.is_complete():
         notification_type = NotificationType.objects.get(
             name="werkzaamheid voltooid")
-        return instance.activity.notify_managers(notification_type, **kwargs)
+        return activity.notify_managers(
+            notification_type,
+            action_object=activity,
+            target=activity.project,
+            extra={'link': Site.objects.get_current().domain +
+                   activity.get_absolute_url()})
+
+
+@receiver(post_save, sender=Location)
+def message_project_complete(sender, instance, **kwargs):
+    if instance.complete:
+        return notify_project_complete(instance.activity)
+
+
+@receiver(post_save, sender=Location)
+def message_activity_complete(sender, instance, **kwargs):
+    if instance.complete:
+        return notify_activity_complete(instance.activity)
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def forget_location_map_data(sender, instance, **kwargs):
+    mapdata.forget_activity(instance.activity_id)
+
+
+@receiver(post_init, sender=Location)
+def remember_location_counts(sender, instance, **kwargs):
+    instance._counts = counters.location_counts(instance)
+
+
+@receiver(post_save, sender=Location)
+def count_location(sender, instance, created, **kwargs):
+    old = getattr(instance, '_counts', None)
+    new = instance._counts = counters.location_counts(instance)
+
+    if created:
+        counters.adjust(new[0], new[1], new[2])
+    elif old is None or new is None or old[:2] != new[:2]:
+        # Not completely loaded, or moved to another activity or in or
+        # out of the project, which changes the counted measurements too
+        counters.recount(
+            set([instance.activity_id] + ([old[0]] if old else [])))
+    else:
+        counters.adjust(new[0], 0, new[2] - old[2])
+
+
+@receiver(post_delete, sender=Location)
+def uncount_location(sender, instance, **kwargs):
+    counts = getattr(instance, '_counts', None)
+    if counts is None:
+        counters.recount([instance.activity_id])
+    else:
+        counters.adjust(counts[0], -counts[1], -counts[2])
+
+
+@receiver(post_save, sender=Measurement)
+def count_measurement(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust_measurements(instance.location_id, 1)
+
+
+@receiver(post_delete, sender=Measurement)
+def uncount_measurement(sender, instance, **kwargs):
+    counters.adjust_measurements(instance.location_id, -1)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def forget_profile_permissions(sender, instance, **kwargs):
+    access.forget_user(instance.user_id)
+
+
+@receiver(m2m_changed, sender=UserProfile.roles.through)
+def forget_role_permissions(sender, instance, reverse, pk_set, **kwargs):
+    if not reverse:
+        access.forget_user(instance.user_id)
+    elif pk_set:
+        for user_id in UserProfile.objects.filter(
+                id__in=pk_set).values_list('user_id', flat=True):
+            access.forget_user(user_id)
+
+
+@receiver(post_init, sender=Activity)
+def remember_activity_contractor(sender, instance, **kwargs):
+    instance._initial_contractor_id = instance.__dict__.get('contractor_id')
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def forget_activity_permissions(sender, instance, **kwargs):
+    access.forget_organizations([
+        instance.contractor_id, instance._initial_contractor_id,
+        instance.project.organization_id])
+    instance._initial_contractor_id = instance.contractor_id
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def forget_project_permissions(sender, instance, **kwargs):
+    access.forget_organizations(
+        [instance.organization_id] + list(Activity.objects.filter(
+            project=instance).values_list('contractor_id', flat=True)))
+
+
+@receiver(post_save, sender=ProjectType)
+def forget_project_type_permissions(sender, instance, **kwargs):
+    organization_ids = set([instance.organization_id])
+    for contractor_id, organization_id in Activity.objects.filter(
+            project__project_type=instance).values_list(
+            'contractor_id', 'project__organization_id'):
+        organization_ids.update((contractor_id, organization_id))
+    access.forget_organizations(organization_ids)
@@ -103,10 +103,11 @@ class MetfileSpecifics(GenericSpecifics):
         measurements = models.Measurement.objects.filter(
             location__in=locations)
 
-        canvas = crosssection_graph.graph(locations[0], measurements)
+        content = crosssection_graph.cached_graph_content(
+            locations[0], measurements)
 
         response = response_object or HttpResponse(content_type='image/png')
-        canvas.print_png(response)
+        response.write(content)
         return response
 
     def html_handler(self, html_default, locations,
@@ -2,6 +2,8 @@
 functions in hdsr.progress.py return the function in this file to
 lizard-progress, which then calls them."""
 
+import collections
+import datetime
 import itertools
 import logging
 import math
@@ -41,8 +43,6 @@ class MetParser(specifics.ProgressParser):
             # File is not a MET file. Returned empty successful result.
             return specifics.SuccessfulParserResult(())
 
-        measurements = []
-
         if self.file_object.errors:
             # There were errors, record them
             for error in self.file_object.errors:
@@ -51,39 +51,148 @@ class MetParser(specifics.ProgressParser):
 
         self.check_content(parsed_metfile)
 
-        # Save the measured profiles.
+        # Find the locations of all profiles first. This can record
+        # errors (unknown or misplaced locations), and if there are
+        # any, nothing would be kept anyway, so we don't need to
+        # write anything.
+        self.preload_locations()
+
+        located_profiles = []
         for series in parsed_metfile.series:
             for profile in series.profiles:
                 location = self.get_location(profile)
-                if location is None:
-                    continue
-
-                m, created = models.Measurement.objects.get_or_create(
-                    location=location)
-                m.date = profile.date_measurement
-
-                m.data = [{
-                    'x': float(measurement.x),
-                    'y': float(measurement.y),
-                    'type': measurement.profile_point_type,
-                    'top': measurement.z1,
-                    'bottom': measurement.z2
-                }
-                    for measurement in profile.sorted_measurements
-                ]
+                if location is not None:
+                    located_profiles.append(profile)
 
-                if len(m.data) > 0:
-                    # Use x, y of first point
-                    m.record_location(Point(
-                        m.data[0]['x'], m.data[0]['y'], srid=models.SRID))
+        if self.errors:
+            return self._parser_result([])
 
-                location.complete = True
-                location.save()
-
-                measurements.append(m)
+        measurements = self.save_measurements(located_profiles)
 
         return self._parser_result(measurements)
 
+    def preload_locations(self):
+        """Fetch all of the activity's locations in one query, so that
+        looking up the location of a profile doesn't need a query per
+        profile. Locations that need to be created are collected in
+        self.new_locations and saved by save_measurements()."""
+        self.locations = dict(
+            (location.location_code, location)
+            for location in self.activity.location_set.all())
+        self.new_locations = []
+
+    def get_or_create_location(self, location_code, point):
+        """Same as Activity.get_or_create_location, but uses the
+        preloaded locations and doesn't save new locations yet."""
+        if location_code in self.locations:
+            return self.locations[location_code], models.Activity.METHOD_GET
+
+        if self.activity.source_activity is not None:
+            # Copying locations from the source activity is rare, let
+            # the activity take care of it.
+            location, method = self.activity.get_or_create_location(
+                location_code=location_code, point=point)
+            self.locations[location_code] = location
+            return location, method
+
+        if self.activity.needs_predefined_locations():
+            raise models.Activity.NoLocationException()
+
+        location = models.Location(
+            activity=self.activity, location_code=location_code,
+            the_geom=point, complete=False)
+        self.locations[location_code] = location
+        self.new_locations.append(location)
+        return location, models.Activity.METHOD_NEW
+
+    def save_measurements(self, profiles):
+        """Save a measurement for each profile, and mark their
+        locations complete.
+
+        All existing measurements are fetched in one query, new
+        locations and measurements are inserted with bulk_create and
+        the locations are updated with a single UPDATE. Only
+        measurements that already existed are saved one by one.
+
+        If a profile occurs more than once, the last one wins."""
+        if self.new_locations:
+            models.Location.objects.bulk_create(self.new_locations)
+            # bulk_create doesn't give us primary keys, fetch them
+            for location in self.activity.location_set.filter(
+                    location_code__in=[
+                        location.location_code
+                        for location in self.new_locations]):
+                self.locations[location.location_code] = location
+            self.new_locations = []
+
+        profiles = collections.OrderedDict(
+            (profile.id, profile) for profile in profiles)
+        locations = [self.locations[location_code]
+                     for location_code in profiles]
+
+        existing_measurements = {}
+        for measurement in models.Measurement.objects.filter(
+                location__in=locations):
+            existing_measurements.setdefault(
+                measurement.location_id, measurement)
+
+        new_measurements = []
+        locations_to_plan = []
+
+        for location, profile in zip(locations, profiles.values()):
+            m = existing_measurements.get(location.id)
+            if m is None:
+                m = models.Measurement(location=location)
+                new_measurements.append(m)
+
+            m.date = profile.date_measurement
+
+            m.data = [{
+                'x': float(measurement.x),
+                'y': float(measurement.y),
+                'type': measurement.profile_point_type,
+                'top': measurement.z1,
+                'bottom': measurement.z2
+            }
+                for measurement in profile.sorted_measurements
+            ]
+
+            if len(m.data) > 0:
+                # Use x, y of first point
+                m.the_geom = Point(
+                    m.data[0]['x'], m.data[0]['y'], srid=models.SRID)
+                m.is_point = True
+
+                if location.the_geom is None:
+                    # Same as Location.plan_location
+                    location.the_geom = m.the_geom
+                    location.is_point = True
+                    locations_to_plan.append(location)
+
+            if m.id is not None:
+                m.save()
+
+        if new_measurements:
+            models.Measurement.objects.bulk_create(new_measurements)
+
+        for location in locations_to_plan:
+            models.Location.objects.filter(pk=location.pk).update(
+                the_geom=location.the_geom, is_point=location.is_point)
+
+        models.Location.objects.filter(
+            pk__in=[location.pk for location in locations]).update(
+            complete=True, timestamp=datetime.datetime.now())
+        for location in locations:
+            location.complete = True
+
+        measurements = list(existing_measurements.values())
+        if new_measurements:
+            # Again, fetch the primary keys that bulk_create didn't set.
+            measurements.extend(models.Measurement.objects.filter(
+                location__in=[location for location in locations
+                              if location.id not in existing_measurements]))
+        return measurements
+
     def check_content(self, parsed_metfile):
         for series in parsed_metfile.series:
             self.check_series(series)
@@ -239,10 +348,10 @@ class MetParser(specifics.ProgressParser):
 
             x_descending = None
             y_descending = None
+            max_measurement_distance = self.config_value(
+                'max_measurement_distance')
             for m1, m2 in pairs(profile.measurements):
                 # Points should be close to each other.
-                max_measurement_distance = self.config_value(
-                    'max_measurement_distance')
                 if m1.point.distance(m2.point) > max_measurement_distance:
                     self.record_error_code(
                         m2.line_number,
@@ -557,7 +666,7 @@ class MetParser(specifics.ProgressParser):
         mid_or_start_point = self.get_profile_mid_or_start_point(profile)
         try:
             point = Point(mid_or_start_point.x, mid_or_start_point.y)
-            location, method = self.activity.get_or_create_location(
+            location, method = self.get_or_create_location(
                 location_code=profile.id, point=point)
             if self._needs_max_distance_check(method):
                 self._check_max_distance(location, profile)
@@ -8,23 +8,25 @@ from __future__ import absolute_import
 from __future__ import division
 
 from contextlib import contextmanager
+import collections
+import datetime
 import itertools
 import json
 import logging
 import os
-import time
 
 from PIL.ImageFile import ImageFile
-import requests
 from osgeo import ogr
 
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.db import connection
 from django.utils import translation
 
 from ribxlib import models as ribxmodels
 from ribxlib import parsers
 
+from lizard_progress import mapdata
 from lizard_progress import models
 from lizard_progress.changerequests.models import Request
 from lizard_progress.email_notifications.models import NotificationType
@@ -35,104 +37,341 @@ from lizard_progress.specifics import UnSuccessfulParserResult
 logger = logging.getLogger(__name__)
 
 
-def _get_log_content(record_id):
-    """
-    Return the logcontent as dict or None.
-    This one actually fetches the log from the GWSW API.
-    """
-    data = requests.get(settings.GWSW_GETLOG_URL % record_id).json()
-    return data.get('logcontent')
+def ribx_date(date):
+    """Measurement.date is a DateTimeField, RIBX inspection dates may be
+    dates. Return them as they come back from the database, so they can
+    be used as keys."""
+    if isinstance(date, datetime.datetime) or date is None:
+        return date
+    return datetime.datetime.combine(date, datetime.time())
 
 
-def get_log_content(filename, retries=10, initial_wait=2):
-    """Get the log from an uploaded ribx file.
+def batches(items, size):
+    """Yield lists of at most size items."""
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
 
-    Args:
-        filename: name of the file
-        retries: max number of retries to the HTTP API
-        initial_wait: a guess on how the external API takes to process the
-            ribx file
-    """
-    tries = 1 + retries  # We try and retry, just like in life.
-    time.sleep(initial_wait)
-    for i in range(tries):
-        logger.debug("get_log_content try number %s", i)
-        log_content = _get_log_content(filename)
-        # If the ribx file has not yet been processed you will get a
-        # log_content with the value ['']. This join operation is to guard
-        # against these blank values.
-        if log_content is None:
-            time.sleep(2*i**2 + 1)
-        else:
-            logger.debug("get_log_content succesful")
-            return log_content
-    return None
 
+class RibxStore(object):
+    """Looks up and saves the Locations, Measurements and
+    ExpectedAttachments a RIBX file refers to, one object at a time.
 
-def parse_log_content(log_content):
-    """
-    Return list of dicts containing log records.
+    RibxParser does all its database work through a store, so that
+    RibxBulkStore can do the same in bulk."""
 
-    Only includes records that have 'type' == 'fout'.
-    """
-    errors = []
-    for record in log_content:
-        if record['type'] == 'fout':
-            errors.append({
-                'line': int(record['regelnummer']),
-                'message': 'GWSW: ' + record['bericht'],
-            })
-    return errors
-
-
-@contextmanager
-def reopen_file(file_obj, mode):
-    """Reopen a file object."""
-    filepath = os.path.abspath(file_obj.name)
-    try:
-        f = open(filepath, mode)
-        yield f
-    finally:
-        f.close()
-
-
-def check_gwsw(file_obj):
-    """Check the ribx file using the RIONED GWSW HTTP API.
-
-    What is a little weird is that we re-open the file object. For some reason
-    the opened file object is not usable; after re-opening it as 'rb' it
-    works though. The cause is probably that the file has already been read,
-    so the cursor is at the end of the file. file_obj.seek(0) is a possible
-    alternative fix, but less clear...
-
-    Raises:
-        ValueError, KeyError, requests.exceptins.HTTPError
-    """
-    with reopen_file(file_obj, 'rb') as f:
-        logger.info("Uploading file to RIONED GWSW API...")
-        r_upload = requests.post(settings.GWSW_UPLOAD_URL,
-                                 files={file_obj.name: f})
-    logger.info("GWSW Upload response: %s", r_upload.text)
-    errors = []
-    if r_upload.ok:
-        record_id = None
-        try:
-            resp = json.loads(r_upload.text)
-            record_id = int(resp['id'])
-        except (ValueError, KeyError):
-            logger.exception("Can't get id from response: %s", r_upload)
-            raise
+    def __init__(self, activity):
+        self.activity = activity
+
+    def get_location(self, location_code):
         try:
-            log_content = get_log_content(record_id, retries=10)
-            errors = parse_log_content(log_content)
-        except (ValueError, KeyError):
-            logger.exception("Incorrect getlog response for id: %s",
-                             record_id)
-            raise
-        return errors
-    else:
-        logger.error("Can't make request to %s", r_upload.url)
-        r_upload.raise_for_status()
+            return self.activity.location_set.get(
+                location_code=location_code)
+        except models.Location.DoesNotExist:
+            return None
+
+    def add_location(self, location):
+        """location was created by the parser."""
+        pass
+
+    def ribx_measurements(self, location, date):
+        """Return the RIBX measurements at location on date."""
+        return [
+            measurement for measurement in models.Measurement.objects.filter(
+                location=location, date=date)
+            if measurement.data and measurement.data.get('filetype') == 'ribx']
+
+    def record_location(self, measurement, geom):
+        """Save measurement (which may be new) with its geometry."""
+        measurement.record_location(geom)
+
+    def setup_expected_attachments(self, measurement, filenames):
+        return measurement.setup_expected_attachments(filenames)
+
+    def set_complete(self, location, complete):
+        location.complete = complete
+        location.save()
+
+    def set_completeness(self, location):
+        location.set_completeness()
+
+    def set_flag(self, location, flag):
+        """Set a boolean field (work_impossible, new) of location."""
+        setattr(location, flag, True)
+        location.save()
+
+    def flush(self):
+        pass
+
+
+def reserve_ids(model, number):
+    """Take number ids from the id sequence of model's table. Objects
+    that get them can be inserted with bulk_create, which doesn't return
+    the ids of the rows it inserts."""
+    cursor = connection.cursor()
+    cursor.execute(
+        "select nextval(pg_get_serial_sequence(%s, 'id')) "
+        "from generate_series(1, %s)", [model._meta.db_table, number])
+    return [row[0] for row in cursor.fetchall()]
+
+
+class RibxBulkStore(RibxStore):
+    """Store that loads the activity's locations, RIBX measurements and
+    expected attachments into dicts at the start, and writes all changes
+    in batches in flush().
+
+    The number of queries doesn't depend on the number of objects in
+    the file, except for new locations and deletion requests, that are
+    still created one by one because they send notifications."""
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, activity):
+        super(RibxBulkStore, self).__init__(activity)
+
+        self.locations = dict(
+            (location.location_code, location)
+            for location in activity.location_set.all())
+
+        # (location id, date) -> RIBX measurements
+        self.measurements = collections.defaultdict(list)
+        for measurement in models.Measurement.objects.filter(
+                location__activity=activity).order_by('id'):
+            if (measurement.data and
+                    measurement.data.get('filetype') == 'ribx'):
+                self.measurements[
+                    (measurement.location_id, measurement.date)].append(
+                    measurement)
+
+        # Attachments by filename. Filenames are unique within an
+        # activity, except in some projects from before July 2015.
+        self.attachments = {}
+        filenames = {}
+        for attachment in models.ExpectedAttachment.objects.filter(
+                measurements__location__activity=activity).distinct(
+                ).order_by('id'):
+            self.attachments.setdefault(attachment.filename, attachment)
+            filenames[attachment.id] = attachment.filename
+
+        # Filenames attached to each measurement. Measurements are
+        # identified by their handle(), as new ones have no id yet.
+        self.links = collections.defaultdict(set)
+        # (measurement id, filename) -> (link id, attachment id)
+        self.link_ids = {}
+        self.location_measurements = collections.defaultdict(set)
+        Link = models.Measurement.expected_attachments.through
+        for link_id, measurement_id, location_id, attachment_id in (
+                Link.objects.filter(
+                    measurement__location__activity=activity).values_list(
+                    'id', 'measurement_id', 'measurement__location_id',
+                    'expectedattachment_id')):
+            filename = filenames[attachment_id]
+            self.links[measurement_id].add(filename)
+            self.link_ids[(measurement_id, filename)] = (
+                link_id, attachment_id)
+            self.location_measurements[location_id].add(measurement_id)
+        self.old_links = dict(
+            (measurement_id, set(filenames))
+            for measurement_id, filenames in self.links.items())
+
+        self.new_measurements = []
+        self.changed_measurements = {}
+        self.changed_links = set()
+        self.planned_locations = {}
+        self.completed_locations = {}
+        self.locations_to_check = {}
+        self.flags = collections.defaultdict(set)
+
+    @staticmethod
+    def handle(measurement):
+        if measurement.id is None:
+            return ('new', id(measurement))
+        return measurement.id
+
+    def get_location(self, location_code):
+        return self.locations.get(location_code)
+
+    def add_location(self, location):
+        self.locations[location.location_code] = location
+
+    def ribx_measurements(self, location, date):
+        measurements = self.measurements.get(
+            (location.id, ribx_date(date)), [])
+        for measurement in measurements:
+            # Prevent a query for measurement.location
+            measurement.location = location
+        return measurements
+
+    def record_location(self, measurement, geom):
+        if measurement.record_location(geom, save=False):
+            self.planned_locations[measurement.location.id] = (
+                measurement.location)
+
+        if measurement.id is not None:
+            self.changed_measurements[measurement.id] = measurement
+        elif self.handle(measurement) not in self.links:
+            # New, and not seen before
+            measurement.date = ribx_date(measurement.date)
+            self.new_measurements.append(measurement)
+            self.measurements[
+                (measurement.location.id, measurement.date)].append(
+                measurement)
+            self.links[self.handle(measurement)] = set()
+        self.location_measurements[measurement.location.id].add(
+            self.handle(measurement))
+
+    def setup_expected_attachments(self, measurement, filenames):
+        """Same as Measurement.setup_expected_attachments, in memory.
+        Nothing changes if an AlreadyUploadedError is raised."""
+        filenames = set(filenames)
+        handle = self.handle(measurement)
+        new_filenames = filenames - self.links[handle]
+
+        for filename in new_filenames:
+            attachment = self.attachments.get(filename)
+            if attachment is not None and attachment.uploaded:
+                raise models.AlreadyUploadedError(filename)
+
+        for filename in new_filenames:
+            if filename not in self.attachments:
+                self.attachments[filename] = models.ExpectedAttachment(
+                    filename=filename, uploaded=False)
+
+        self.links[handle] = filenames
+        self.changed_links.add(handle)
+        return all(self.attachments[filename].uploaded
+                   for filename in filenames)
+
+    def set_complete(self, location, complete):
+        location.complete = complete
+        self.completed_locations[location.id] = location
+
+    def set_completeness(self, location):
+        self.locations_to_check[location.id] = location
+
+    def set_flag(self, location, flag):
+        setattr(location, flag, True)
+        self.flags[flag].add(location.id)
+
+    def flush(self):
+        """Write everything to the database. New measurements get their
+        ids."""
+        now = datetime.datetime.now()
+        handles = dict(
+            (self.handle(measurement), measurement)
+            for measurement in self.new_measurements)
+        handles.update(self.changed_measurements)
+
+        self.insert_attachments()
+        self.insert_measurements()
+
+        self.update_geometries(models.Measurement, [
+            (measurement.id, measurement.the_geom, measurement.is_point)
+            for measurement in self.changed_measurements.values()], now)
+        self.update_links(handles)
+
+        # Completeness as in Location.set_completeness; the location
+        # has a measurement now.
+        for location_id, location in self.locations_to_check.items():
+            location.complete = all(
+                self.attachments[filename].uploaded
+                for handle in self.location_measurements[location_id]
+                for filename in self.links[handle])
+            self.completed_locations[location_id] = location
+
+        self.update_geometries(models.Location, [
+            (location.id, location.the_geom, location.is_point)
+            for location in self.planned_locations.values()], now)
+        for complete in (True, False):
+            self.update_locations([
+                location.id for location in self.completed_locations.values()
+                if location.complete == complete],
+                complete=complete, timestamp=now)
+        for flag, location_ids in self.flags.items():
+            self.update_locations(location_ids, **{flag: True})
+
+        mapdata.forget_activity(self.activity.id)
+
+    def insert_attachments(self):
+        new_attachments = [
+            attachment for attachment in self.attachments.values()
+            if attachment.id is None]
+        if not new_attachments:
+            return
+
+        for attachment, attachment_id in zip(
+                new_attachments,
+                reserve_ids(models.ExpectedAttachment, len(new_attachments))):
+            attachment.id = attachment_id
+        models.ExpectedAttachment.objects.bulk_create(
+            new_attachments, batch_size=self.BATCH_SIZE)
+
+    def insert_measurements(self):
+        if not self.new_measurements:
+            return
+
+        for measurement, measurement_id in zip(
+                self.new_measurements,
+                reserve_ids(models.Measurement, len(self.new_measurements))):
+            measurement.id = measurement_id
+        models.Measurement.objects.bulk_create(
+            self.new_measurements, batch_size=self.BATCH_SIZE)
+
+    def update_links(self, handles):
+        """Attach and detach expected attachments, and delete the ones
+        that aren't attached to anything anymore."""
+        Link = models.Measurement.expected_attachments.through
+        new_links = []
+        dropped_links = []
+        dropped_attachments = set()
+
+        for handle in self.changed_links:
+            measurement_id = handles[handle].id
+            filenames = self.links[handle]
+            old_filenames = self.old_links.get(handle, set())
+
+            for filename in filenames - old_filenames:
+                new_links.append(Link(
+                    measurement_id=measurement_id,
+                    expectedattachment_id=self.attachments[filename].id))
+            for filename in old_filenames - filenames:
+                link_id, attachment_id = self.link_ids[
+                    (measurement_id, filename)]
+                dropped_links.append(link_id)
+                dropped_attachments.add(attachment_id)
+
+        for batch in batches(dropped_links, self.BATCH_SIZE):
+            Link.objects.filter(id__in=batch).delete()
+        Link.objects.bulk_create(new_links, batch_size=self.BATCH_SIZE)
+        for batch in batches(dropped_attachments, self.BATCH_SIZE):
+            models.ExpectedAttachment.objects.filter(
+                id__in=batch, measurements__isnull=True).delete()
+
+    def update_geometries(self, model, rows, timestamp):
+        """Set the_geom and is_point of (id, wkt, is_point) rows, in one
+        UPDATE per batch."""
+        table = model._meta.db_table
+        cursor = connection.cursor()
+        for batch in batches(rows, self.BATCH_SIZE):
+            values = ', '.join(['(%s, %s, %s)'] * len(batch))
+            cursor.execute("""
+                update {table} set
+                    the_geom = st_geomfromtext(v.wkt, %s),
+                    is_point = v.is_point,
+                    timestamp = %s
+                from (values {values}) as v(id, wkt, is_point)
+                where {table}.id = v.id
+            """.format(table=table, values=values),
+                [models.SRID, timestamp] +
+                [value for row in batch
+                 for value in (row[0], unicode(row[1]), row[2])])
+
+    def update_locations(self, location_ids, **fields):
+        for batch in batches(location_ids, self.BATCH_SIZE):
+            models.Location.objects.filter(id__in=batch).update(**fields)
 
 
 class RibxParser(ProgressParser):
@@ -146,11 +385,28 @@ class RibxParser(ProgressParser):
         "Kies een nieuwe naam.",
     }
 
+    # Files that this parser handled are checked by the GWSW API
+    # afterwards, see lizard_progress.gwsw.
+    GWSW_CHECK = True
+
+    bulk_store = None
+
     @property
-    def gwsw_is_enabled(self):
-        """Only enable GWSW API for non-simple projects."""
-        return (
-            settings.GWSW_API_ENABLED and not self.activity.project.is_simple)
+    def store(self):
+        """The RibxBulkStore while in bulk_mode(), otherwise a store
+        that saves objects one at a time."""
+        return self.bulk_store or RibxStore(self.activity)
+
+    @contextmanager
+    def bulk_mode(self):
+        """Within this block, objects are looked up in and saved by a
+        RibxBulkStore. Everything is written at the end."""
+        self.bulk_store = RibxBulkStore(self.activity)
+        try:
+            yield self.bulk_store
+            self.bulk_store.flush()
+        finally:
+            self.bulk_store = None
 
     def parse(self, check_only=False):
         if isinstance(self.file_object, ImageFile):
@@ -165,15 +421,6 @@ class RibxParser(ProgressParser):
             # Return, because unusable XML.
             return self._parser_result([])
 
-        if self.gwsw_is_enabled:
-            try:
-                gwsw_errors = check_gwsw(self.file_object)
-            except (ValueError, KeyError, requests.exceptions.HTTPError):
-                logger.exception("There is an error with (handling) the API")
-            else:
-                for error in gwsw_errors:
-                    self.record_error(error['line'], None, error['message'])
-
         measurements = self.get_measurements(ribx)
 
         if not measurements:
@@ -185,30 +432,31 @@ class RibxParser(ProgressParser):
 
     def get_measurements(self, ribx):
         # Use these to check whether locations are inside extent
-        self.min_x = self.activity.config_value('minimum_x_coordinate')
-        self.max_x = self.activity.config_value('maximum_x_coordinate')
-        self.min_y = self.activity.config_value('minimum_y_coordinate')
-        self.max_y = self.activity.config_value('maximum_y_coordinate')
+        self.min_x = self.config_value('minimum_x_coordinate')
+        self.max_x = self.config_value('maximum_x_coordinate')
+        self.min_y = self.config_value('minimum_y_coordinate')
+        self.max_y = self.config_value('maximum_y_coordinate')
 
         measurements = []
-        for item in itertools.chain(
-                ribx.inspection_pipes, ribx.cleaning_pipes,
-                ribx.inspection_manholes, ribx.cleaning_manholes,
-                ribx.drains):
-            error = self.check_coordinates(item)
-            if not error:
-                if item.work_impossible:
-                    # This is not a measurement, but a claim that (1) the
-                    # assigned work couldn't be done OR (2) that the location
-                    # of the object wasn't found (don't ask). Open a deletion
-                    # request instead of recording a measurement.
-                    # Creating the request also automatically
-                    # sends an email notification.
-                    self.create_deletion_request(item)
-                else:
-                    measurement = self.save_measurement(item)
-                    if measurement is not None:
-                        measurements.append(measurement)
+        with self.bulk_mode():
+            for item in itertools.chain(
+                    ribx.inspection_pipes, ribx.cleaning_pipes,
+                    ribx.inspection_manholes, ribx.cleaning_manholes,
+                    ribx.drains):
+                error = self.check_coordinates(item)
+                if not error:
+                    if item.work_impossible:
+                        # This is not a measurement, but a claim that (1)
+                        # the assigned work couldn't be done OR (2) that
+                        # the location of the object wasn't found (don't
+                        # ask). Open a deletion request instead of
+                        # recording a measurement. Creating the request
+                        # also automatically sends an email notification.
+                        self.create_deletion_request(item)
+                    else:
+                        measurement = self.save_measurement(item)
+                        if measurement is not None:
+                            measurements.append(measurement)
         return measurements
 
     def check_coordinates(self, item):
@@ -301,14 +549,12 @@ class RibxParser(ProgressParser):
         if geo.is_line(geom):
             geom = geo.get_midpoint(geom)
 
-        try:
-            location = self.activity.location_set.get(location_code=item.ref)
+        location = self.store.get_location(item.ref)
+        if location is not None:
             Request.create_deletion_request(
                 location, motivation=item.work_impossible,
                 user_is_manager=False, geom=geom)
-        except models.Location.DoesNotExist:
-            # Already deleted?
-            pass
+        # Else already deleted?
 
     def save_measurement(self, item):
         """item is a pipe, drain or manhole object that has properties
@@ -317,10 +563,8 @@ class RibxParser(ProgressParser):
         Note: the behavior of this method changes depending on the attributes
         of the item (i.e.: 'work_impossible', 'new')
         """
-        try:
-            location = self.activity.location_set.get(
-                location_code=item.ref)
-        except models.Location.DoesNotExist:
+        location = self.store.get_location(item.ref)
+        if location is None:
             # The reason for this check is because of the altered
             # get_measurements in the RibxReinigingKolkenParser. Via the
             # RibxParser you can't get here. It probably doesn't do much
@@ -357,12 +601,12 @@ class RibxParser(ProgressParser):
 
         # Record the location regardless of whether it was uploaded before --
         # maybe someone corrected the previous upload.
-        measurement.record_location(item.geom)  # Saves
+        self.store.record_location(measurement, item.geom)
         associated_files = getattr(item, 'media', ())
 
         try:
-            all_uploaded = measurement.setup_expected_attachments(
-                associated_files)
+            all_uploaded = self.store.setup_expected_attachments(
+                measurement, associated_files)
         except models.AlreadyUploadedError as e:
             self.record_error(
                 item.sourceline, 'ATTACHMENT_ALREADY_EXISTS',
@@ -370,17 +614,14 @@ class RibxParser(ProgressParser):
             return None
 
         # Update completeness of location
-        location.complete = all_uploaded
-        location.save()
+        self.store.set_complete(location, all_uploaded)
 
         return measurement
 
     def find_existing_ribx_measurement(self, location, inspection_date):
-        for measurement in models.Measurement.objects.filter(
-                location=location, date=inspection_date):
-            if (measurement.data and
-                    measurement.data.get('filetype') == 'ribx'):
-                return measurement
+        measurements = self.store.ribx_measurements(location, inspection_date)
+        if measurements:
+            return measurements[0]
 
         return None
 
@@ -431,6 +672,7 @@ class RibxParser(ProgressParser):
             information=json.dumps({
                 "remark": "Added automatically by {}".format(
                     self.file_object.name)}))
+        self.store.add_location(location)
 
         notification_type = NotificationType.objects.get(
             name='new location from ribx')
@@ -457,15 +699,13 @@ class RibxReinigingInspectieRioolParser(RibxParser):
 
     def find_existing_ribx_measurement(self, location, inspection_date,
                                        manhole_start):
-        for measurement in models.Measurement.objects.filter(
-                location=location, date=inspection_date):
-            if (measurement.data and
-                    measurement.data.get('filetype') == 'ribx'):
-                if manhole_start is None:
+        for measurement in self.store.ribx_measurements(
+                location, inspection_date):
+            if manhole_start is None:
+                return measurement
+            else:
+                if measurement.data.get('manhole_start') == manhole_start:
                     return measurement
-                else:
-                    if measurement.data.get('manhole_start') == manhole_start:
-                        return measurement
         return None
 
     def find_or_create_ribx_measurement(self, location, inspection_date,
@@ -496,10 +736,8 @@ class RibxReinigingInspectieRioolParser(RibxParser):
         Note: the behavior of this method changes depending on the attributes
         of the item (i.e.: 'work_impossible', 'new')
         """
-        try:
-            location = self.activity.location_set.get(
-                location_code=item.ref)
-        except models.Location.DoesNotExist:
+        location = self.store.get_location(item.ref)
+        if location is None:
             # The reason for this check is because of the altered
             # get_measurements in the RibxReinigingKolkenParser. Via the
             # RibxParser you can't get here. It probably doesn't do much
@@ -523,11 +761,12 @@ class RibxReinigingInspectieRioolParser(RibxParser):
 
         # Record the location regardless of whether it was uploaded before --
         # maybe someone corrected the previous upload.
-        measurement.record_location(item.geom)  # Saves
+        self.store.record_location(measurement, item.geom)
         associated_files = getattr(item, 'media', ())
 
         try:
-            measurement.setup_expected_attachments(associated_files)
+            self.store.setup_expected_attachments(
+                measurement, associated_files)
         except models.AlreadyUploadedError as e:
             self.record_error(
                 item.sourceline, 'ATTACHMENT_ALREADY_EXISTS',
@@ -540,7 +779,7 @@ class RibxReinigingInspectieRioolParser(RibxParser):
         # have to determine the completeness of all related measurements
         # and 'and' them together. Location.set_completeness should cover this
         # use case.
-        location.set_completeness()
+        self.store.set_completeness(location)
 
         return measurement
 
@@ -560,27 +799,27 @@ class RibxReinigingKolkenParser(RibxParser):
 
     def get_measurements(self, ribx):
         # Use these to check whether locations are inside extent
-        self.min_x = self.activity.config_value('minimum_x_coordinate')
-        self.max_x = self.activity.config_value('maximum_x_coordinate')
-        self.min_y = self.activity.config_value('minimum_y_coordinate')
-        self.max_y = self.activity.config_value('maximum_y_coordinate')
+        self.min_x = self.config_value('minimum_x_coordinate')
+        self.max_x = self.config_value('maximum_x_coordinate')
+        self.min_y = self.config_value('minimum_y_coordinate')
+        self.max_y = self.config_value('maximum_y_coordinate')
 
         measurements = []
-        for item in itertools.chain(
-                ribx.inspection_pipes, ribx.cleaning_pipes,
-                ribx.inspection_manholes, ribx.cleaning_manholes,
-                ribx.drains):
-            error = self.check_coordinates(item)
-            if not error:
-                measurement = self.save_measurement(item)
-                if measurement is not None:
-                    # Mark the locations with these flags for visualization.
-                    location = measurement.location
-                    if item.work_impossible:
-                        location.work_impossible = True
-                        location.save()
-                    if item.new:
-                        location.new = True
-                        location.save()
-                    measurements.append(measurement)
+        with self.bulk_mode():
+            for item in itertools.chain(
+                    ribx.inspection_pipes, ribx.cleaning_pipes,
+                    ribx.inspection_manholes, ribx.cleaning_manholes,
+                    ribx.drains):
+                error = self.check_coordinates(item)
+                if not error:
+                    measurement = self.save_measurement(item)
+                    if measurement is not None:
+                        # Mark the locations with these flags for
+                        # visualization.
+                        location = measurement.location
+                        if item.work_impossible:
+                            self.store.set_flag(location, 'work_impossible')
+                        if item.new:
+                            self.store.set_flag(location, 'new')
+                        measurements.append(measurement)
         return measurements
@@ -1,4 +1,8 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from lizard_progress import models
+from lizard_progress import gwsw
 from lizard_progress.changerequests.models import Request
 from lizard_progress.parsers import ribx_parser
 from lizard_progress.tests import test_models
@@ -43,13 +47,13 @@ class TestLogContentParser(TestCase):
     def test_parse_log_content(self):
         # content without error
         content = [{'type': 'commentaar'}]
-        errors = ribx_parser.parse_log_content(content)
+        errors = gwsw.parse_log_content(content)
         self.assertEqual(errors, [])
 
         # content with error
         content = [{'type': 'fout', 'bericht': 'test', 'regelnummer': '7'}]
         expected = [{'line': 7, u'message': 'GWSW: test'}]
-        errors = ribx_parser.parse_log_content(content)
+        errors = gwsw.parse_log_content(content)
         self.assertEqual(errors, expected)
 
 
@@ -173,6 +177,94 @@ class TestRibxParser2(FixturesTestCase):
         self.assertEquals(m4.id, m1.id)
 
 
+class TestRibxParserBulkMode(FixturesTestCase):
+    def setUp(self):
+        self.mtype = test_models.AvailableMeasurementTypeF.create(
+            slug='ribx_reiniging_inspectie_riool')
+        self.activity = test_models.ActivityF.create(
+            measurement_type=self.mtype)
+
+    def upload(self, refs, media=()):
+        # A fresh activity, so that both uploads in a test do the same
+        # configuration queries.
+        parser = ribx_parser.RibxReinigingInspectieRioolParser(
+            models.Activity.objects.get(pk=self.activity.pk), None)
+        ribx = MockRibx()
+        for ref in refs:
+            test_models.LocationF.create(
+                activity=self.activity, location_code=ref)
+            ribx.drains.append(MockItem(
+                ref, today, amersfoort,
+                media=set(ref + filename for filename in media)))
+
+        with CaptureQueriesContext(connection) as queries:
+            measurements = parser.get_measurements(ribx)
+        return measurements, len(queries)
+
+    def test_number_of_queries_doesnt_depend_on_size(self):
+        measurements, few_queries = self.upload(
+            ['A1', 'A2'], media=['.jpg'])
+        self.assertEquals(len(measurements), 2)
+
+        measurements, many_queries = self.upload(
+            ['B{}'.format(i) for i in range(20)], media=['.jpg'])
+        self.assertEquals(len(measurements), 20)
+
+        self.assertEquals(few_queries, many_queries)
+
+    def test_measurements_and_attachments_are_saved(self):
+        measurements, queries = self.upload(['A1'], media=['.jpg', '.mpg'])
+
+        measurement = models.Measurement.objects.get(
+            location__location_code='A1')
+        self.assertEquals(measurements[0].id, measurement.id)
+        self.assertEquals(
+            sorted(measurement.expected_attachments.values_list(
+                'filename', flat=True)),
+            ['A1.jpg', 'A1.mpg'])
+        self.assertTrue(measurement.the_geom)
+        self.assertFalse(measurement.location.complete)
+
+    def test_second_upload_updates_attachments(self):
+        self.upload(['A1'], media=['.jpg', '.mpg'])
+
+        parser = ribx_parser.RibxReinigingInspectieRioolParser(
+            self.activity, None)
+        ribx = MockRibx()
+        ribx.drains.append(MockItem('A1', today, amersfoort, media=[]))
+        measurements = parser.get_measurements(ribx)
+
+        self.assertEquals(models.Measurement.objects.filter(
+            location__location_code='A1').count(), 1)
+        self.assertFalse(models.ExpectedAttachment.objects.exists())
+        self.assertTrue(models.Location.objects.get(
+            pk=measurements[0].location_id).complete)
+
+    def test_new_rows_get_their_own_ids(self):
+        store = ribx_parser.RibxBulkStore(self.activity)
+        location = test_models.LocationF.create(activity=self.activity)
+        # Same location, date and manhole_start
+        store.new_measurements = [
+            models.Measurement(
+                location=location, date=today, data={'filetype': 'ribx'})
+            for i in range(2)]
+        store.attachments = {
+            'a.jpg': models.ExpectedAttachment(
+                filename='a.jpg', uploaded=False)}
+
+        store.insert_attachments()
+        store.insert_measurements()
+
+        ids = [measurement.id for measurement in store.new_measurements]
+        self.assertEquals(
+            sorted(models.Measurement.objects.filter(
+                location=location).values_list('id', flat=True)),
+            sorted(ids))
+        self.assertEquals(
+            models.ExpectedAttachment.objects.get(
+                pk=store.attachments['a.jpg'].id).filename, 'a.jpg')
+
+
 class TestRibxParserAngleCheck(TestCase):
 
     def setUp(self):
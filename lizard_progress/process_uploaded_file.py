@@ -10,6 +10,8 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+import collections
+import datetime
 import logging
 import os
 import shutil
@@ -17,11 +19,17 @@ import tempfile
 import time
 
 from django.db import transaction
+from django.db.models import Max
 
+from lizard_progress import counters
+from lizard_progress import crosssection_graph
+from lizard_progress import gwsw
+from lizard_progress import mapdata
 from lizard_progress import models
 from lizard_progress.changerequests.models import PossibleRequest
 from lizard_progress import specifics
 from lizard_progress.util import directories
+from lizard_progress.util import uploads
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +77,12 @@ def process_capturing_errors(uploaded_file):
 def process(uploaded_file):
     filename = uploaded_file.filename
 
+    uploaded_file.content_hash = uploads.file_digest(
+        uploaded_file.abs_file_path)
+    uploaded_file.save()
+    if is_accepted_already(uploaded_file):
+        return
+
     # Since the latest change, where each measurement type has its own
     # upload button, there should always be a single possible parser per
     # uploaded file. However, we keep the functionality around of multiple
@@ -90,6 +104,8 @@ def process(uploaded_file):
             uploaded_file.ready = True
             uploaded_file.success = False
             uploaded_file.save()
+            gwsw.schedule_check(
+                uploaded_file, parser, uploaded_file.rel_file_path)
 
             # Record errors
             for error in errors:
@@ -117,6 +133,53 @@ def process(uploaded_file):
             "Onbekend filetype."))
 
 
+def is_accepted_already(uploaded_file):
+    """If the same file (same name, same content) was accepted in this
+    activity before and all the measurements parsed from it are still
+    current, parsing it again wouldn't change anything. In that case
+    mark the uploaded file as successful, remove it and return True.
+
+    If some of its measurements were deleted or replaced by those of
+    another file since, the file is parsed normally."""
+    for accepted_file in models.AcceptedFile.objects.filter(
+            activity=uploaded_file.activity,
+            content_hash=uploaded_file.content_hash,
+            num_measurements__isnull=False):
+        if (os.path.basename(accepted_file.rel_file_path) ==
+                uploaded_file.filename and
+                os.path.exists(accepted_file.abs_file_path) and
+                models.Measurement.objects.filter(
+                    rel_file_path=accepted_file.rel_file_path).count() ==
+                accepted_file.num_measurements):
+            logger.info("%s is the same as %s, not processed again.",
+                        uploaded_file.rel_file_path,
+                        accepted_file.rel_file_path)
+            os.remove(uploaded_file.abs_file_path)
+            uploaded_file.ready = True
+            uploaded_file.success = True
+            uploaded_file.save()
+            return True
+    return False
+
+
+def store_accepted_file(uploaded_file, target_path):
+    """Move the uploaded file to target_path. If an identical file was
+    accepted in this activity before, hardlink to that one instead, so
+    that the content is stored once."""
+    for accepted_file in models.AcceptedFile.objects.filter(
+            activity=uploaded_file.activity,
+            content_hash=uploaded_file.content_hash):
+        try:
+            os.link(accepted_file.abs_file_path, target_path)
+        except OSError:
+            # Gone, or on another file system
+            continue
+        os.remove(uploaded_file.abs_file_path)
+        return
+
+    shutil.move(uploaded_file.abs_file_path, target_path)
+
+
 def try_parser(uploaded_file, parser):
     """Tries a particular parser. Wraps everything in a database
     transaction so that nothing is changed in the database in case
@@ -147,20 +210,21 @@ def try_parser(uploaded_file, parser):
                     uploaded_file.activity,
                     os.path.basename(uploaded_file.filename))
 
-                shutil.move(uploaded_file.abs_file_path, target_path)
+                store_accepted_file(uploaded_file, target_path)
 
+                rel_file_path = directories.relative(target_path)
                 models.AcceptedFile.create_from_path(
                     activity=uploaded_file.activity,
-                    rel_file_path=directories.relative(target_path))
+                    rel_file_path=rel_file_path,
+                    content_hash=uploaded_file.content_hash,
+                    num_measurements=len(set(
+                        m.id for m in parseresult.measurements)))
 
                 # Update measurements and locations.
-                for m in parseresult.measurements:
-                    m.rel_file_path = target_path
-                    m.save()
-                    location = m.location
-                    location.one_measurement_uploaded = True
-                    location.measured_date = location.latest_measurement_date()
-                    location.save()
+                update_measurements_and_locations(
+                    uploaded_file.activity, parseresult.measurements,
+                    rel_file_path)
+                gwsw.schedule_check(uploaded_file, parser, rel_file_path)
 
                 # Log success
                 uploaded_file.log_success(parseresult.measurements)
@@ -199,6 +263,51 @@ def try_parser(uploaded_file, parser):
     return False, errors, possible_requests
 
 
+def update_measurements_and_locations(
+        activity, measurements, rel_file_path):
+    """Set the file path of the parser's measurements, and update
+    the fields of their locations that depend on measurements.
+
+    The parsers have already saved the measurements, so this uses a
+    few set-based UPDATEs instead of saving every measurement and
+    location again. Because Location's post_save signal isn't sent
+    that way, completeness notifications are checked, the progress
+    counters are recounted and the map data is forgotten once
+    here. Graphs of the locations are rendered in the background."""
+    now = datetime.datetime.now()
+    location_ids = set(m.location_id for m in measurements)
+    crosssection_graph.schedule_rendering(activity, location_ids)
+
+    models.Measurement.objects.filter(
+        id__in=[m.id for m in measurements]).update(
+        rel_file_path=rel_file_path, timestamp=now)
+    for m in measurements:
+        m.rel_file_path = rel_file_path
+
+    # Location.measured_date is the date of its latest measurement,
+    # group the locations by that date so we need one UPDATE per date.
+    locations_by_date = collections.defaultdict(set)
+    latest_dates = models.Measurement.objects.filter(
+        location__in=list(location_ids), date__isnull=False).values(
+        'location').annotate(latest_date=Max('date'))
+    for row in latest_dates:
+        locations_by_date[row['latest_date'].date()].add(row['location'])
+        location_ids.discard(row['location'])
+    if location_ids:
+        locations_by_date[None] = location_ids
+
+    for measured_date, ids in locations_by_date.items():
+        models.Location.objects.filter(id__in=ids).update(
+            one_measurement_uploaded=True,
+            measured_date=measured_date,
+            timestamp=now)
+
+    counters.recount([activity.id])
+    mapdata.forget_activity(activity.id)
+    models.notify_activity_complete(activity)
+    models.notify_project_complete(activity)
+
+
 def call_parser(uploaded_file, parser):
     """Actually call the parser. Open files. Return result."""
 
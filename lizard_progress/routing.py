@@ -0,0 +1,153 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Routing of our Celery tasks to separate queues.
+
+Uploads are split by size: small uploaded files go to the 'uploads'
+queue, large ones and the files of zip batches to 'uploads_large', so
+that a single photo isn't stuck behind a big RIBX file. The queue of
+an uploaded file is chosen where it is scheduled (see upload_queue()
+and UploadedFile.schedule_processing()), so the router doesn't need to
+look it up. That only happens if the router is used (see is_enabled()),
+so that workers of the default queue still get all tasks otherwise.
+Exports, review
+project setup and maintenance tasks get queues of their own. Each
+queue should have its own worker, see the task_queues management
+command.
+
+To use it, add this to the site's settings::
+
+    CELERY_ROUTES = ('lizard_progress.routing.TaskRouter',)
+
+Tasks that aren't routed here go to the default queue."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+from django.conf import settings
+
+UPLOADS = 'uploads'
+UPLOADS_LARGE = 'uploads_large'
+EXPORTS = 'exports'
+REVIEW = 'review'
+MAINTENANCE = 'maintenance'
+
+# Worker settings per queue, can be changed per queue with the
+# LIZARD_PROGRESS_TASK_QUEUES setting. Long running tasks shouldn't
+# prefetch, or other tasks wait for them while a worker is idle.
+DEFAULT_QUEUES = {
+    UPLOADS: {'concurrency': 4, 'prefetch_multiplier': 4},
+    UPLOADS_LARGE: {'concurrency': 2, 'prefetch_multiplier': 1},
+    EXPORTS: {'concurrency': 1, 'prefetch_multiplier': 1},
+    REVIEW: {'concurrency': 1, 'prefetch_multiplier': 1},
+    MAINTENANCE: {'concurrency': 1, 'prefetch_multiplier': 1},
+}
+
+# Queues of tasks that don't depend on their arguments
+TASK_QUEUES = {
+    # Unless scheduled with a queue of its own, see upload_queue()
+    'lizard_progress.tasks.process_uploaded_file_task': UPLOADS,
+    'lizard_progress.tasks.process_batch_member_task': UPLOADS_LARGE,
+    'lizard_progress.tasks.finish_upload_batch_task': UPLOADS,
+    'lizard_progress.tasks.gwsw_submit_task': UPLOADS,
+    'lizard_progress.tasks.gwsw_poll_task': UPLOADS,
+    'lizard_progress.tasks.start_export_run': EXPORTS,
+    'lizard_progress.tasks.setup_project_using_ribx_task': REVIEW,
+    'lizard_progress.tasks.calculate_reviewproject_feature_collection':
+    REVIEW,
+    'lizard_progress.tasks.shapefile_vacuum': MAINTENANCE,
+    'lizard_progress.tasks.archive_task': MAINTENANCE,
+    'lizard_progress.tasks.render_crosssection_graphs_task': MAINTENANCE,
+    'lizard_progress.tasks.evict_crosssection_graphs_task': MAINTENANCE,
+    'lizard_progress.tasks.finish_upload_batches_task': MAINTENANCE,
+    'lizard_progress.tasks.reconcile_file_catalog_task': MAINTENANCE,
+    'lizard_progress.tasks.remove_abandoned_uploads_task': MAINTENANCE,
+}
+
+
+def queues():
+    """Return the worker settings of each queue."""
+    result = {}
+    overrides = getattr(settings, 'LIZARD_PROGRESS_TASK_QUEUES', {})
+    for name, options in DEFAULT_QUEUES.items():
+        result[name] = dict(options, **overrides.get(name, {}))
+    return result
+
+
+def large_upload_size():
+    """Uploaded files of at least this many bytes are large."""
+    return getattr(
+        settings, 'LIZARD_PROGRESS_LARGE_UPLOAD_SIZE', 5 * 1024 * 1024)
+
+
+def is_enabled():
+    """Whether TaskRouter is in the CELERY_ROUTES setting."""
+    routes = getattr(settings, 'CELERY_ROUTES', None)
+    if routes is None:
+        return False
+    if not isinstance(routes, (list, tuple)):
+        routes = (routes,)
+    return any(
+        route == 'lizard_progress.routing.TaskRouter' or
+        isinstance(route, TaskRouter)
+        for route in routes)
+
+
+def upload_queue(size):
+    """The queue for processing an uploaded file of this size in
+    bytes. If its size isn't known (None), processing will be quick."""
+    if size is not None and size >= large_upload_size():
+        return UPLOADS_LARGE
+    return UPLOADS
+
+
+class TaskRouter(object):
+    """Celery router, see the module docstring."""
+
+    def route_for_task(self, task, args=None, kwargs=None):
+        if task in TASK_QUEUES:
+            return {'queue': TASK_QUEUES[task]}
+
+        return None
+
+
+def queue_depths(app):
+    """Return the number of messages waiting in each of our queues, and
+    in the default queue, as a dict."""
+    names = sorted(queues()) + [app.conf.CELERY_DEFAULT_QUEUE]
+    depths = {}
+
+    with app.connection() as connection:
+        channel = connection.channel()
+        for name in names:
+            try:
+                # Returns (queue, message_count, consumer_count)
+                depths[name] = channel.queue_declare(
+                    queue=name, passive=True)[1]
+            except connection.channel_errors:
+                # The queue doesn't exist (yet). The broker may close
+                # the channel after this error.
+                depths[name] = 0
+                channel = connection.channel()
+        channel.close()
+
+    return depths
+
+
+def worker_commands(app, command='bin/django celery worker'):
+    """Return a command line to start a worker for each queue. The
+    default queue is handled by the maintenance worker."""
+    commands = []
+    for name, options in sorted(queues().items()):
+        queue_names = name
+        if name == MAINTENANCE:
+            queue_names += ',' + app.conf.CELERY_DEFAULT_QUEUE
+        # Options after '--' are worker settings (CELERYD_*)
+        commands.append(
+            '{command} -Q {queues} -n {name}.%h -c {concurrency} '
+            '-- celeryd.prefetch_multiplier={prefetch_multiplier}'.format(
+                command=command, queues=queue_names, name=name, **options))
+    return commands
@@ -160,6 +160,10 @@ class ProgressParser(object):
 
     FILE_TYPE = FILE_NORMAL
 
+    # Whether files this parser handled should be checked by the GWSW
+    # API afterwards.
+    GWSW_CHECK = False
+
     def __init__(
             self, activity, file_object):
         self.activity = activity
@@ -248,6 +252,9 @@ class ProgressParser(object):
         return SuccessfulParserResult(measurements)
 
     def config_value(self, key):
+        """Look up a configuration option in the activity's
+        configuration snapshot; parsers call this for every line, so
+        it must not cost queries."""
         return self.activity.config_value(key)
 
 
@@ -469,12 +469,37 @@ function build_map(gj, extent, OoI) {
 	}
     };
 
+    /* large activities come as vector tiles, with the same properties
+       as the GeoJSON features */
+    function tileStyle(properties, zoom) {
+	var style = geojsonLayerOptions.style({properties: properties});
+	style.radius = 3;
+	style.fill = true;
+	return style;
+    }
+    var vectorTileOptions = {
+	rendererFactory: L.canvas.tile,
+	interactive: true,
+	maxZoom: MAXZOOM,
+	vectorTileLayerStyles: {
+	    locations: tileStyle,
+	    requests: tileStyle
+	}
+    };
+
     for (var activity in gj) {
 	var geoJsonDocument = gj[activity];
 	if (activity == 'Aanvragen') {
 	    continue;
 	} else if (activity == 'OoI') {
 	    continue;
+	} else if ('tiles' in geoJsonDocument) {
+	    var layer = L.vectorGrid.protobuf(geoJsonDocument.tiles, vectorTileOptions);
+	    layer.on('mouseover', function(e){
+		setCurrObjId(e.layer.properties.type, e.layer.properties.id);});
+	    layer.on('mouseout', function(e){setCurrObjId('', '');});
+	    layer.addTo(mymap); /* show everything by default */
+	    overlayMaps[activity] = layer;
 	} else {
 	    // If we render using the Canvas, Points need to be rendered after LineStrings, or
 	    // else they become very difficult to click.
@@ -1,15 +1,34 @@
 var upload_page_functions = upload_page_functions || (function () {
     var id_not_ready_div = "#uploaded_files_not_ready";
     var id_ready_div = "#uploaded_files_ready";
+    var id_batches_div = "#upload_batches";
 
     var make_row_id = function (uploaded_file) {
         if (uploaded_file.ready) {
-            return "uploaded-file-ready-" + uploaded_file.id;
+            // The row is replaced when the GWSW check finishes.
+            return "uploaded-file-ready-" + uploaded_file.id +
+                (uploaded_file.gwsw_status ?
+                 "-gwsw-" + uploaded_file.gwsw_status : "");
         } else {
             return "uploaded-file-not-ready-" + uploaded_file.id;
         }
     };
 
+    var error_cell = function (uploaded_file) {
+        if (!uploaded_file.success ||
+            uploaded_file.gwsw_status === "errors") {
+            return $("<a>").attr("href", uploaded_file.error_url)
+                .attr("target", "_")
+                .text(uploaded_file.success ?
+                      "bekijk GWSW-fouten" : "bekijk fouten");
+        } else if (uploaded_file.gwsw_status === "pending") {
+            return "GWSW-controle loopt";
+        } else if (uploaded_file.gwsw_status === "failed") {
+            return "GWSW-controle mislukt";
+        }
+        return "";
+    };
+
     var add_to_ready_table = function (uploaded_file) {
         $(id_ready_div + " table").append(
             $("<tr>")
@@ -18,11 +37,7 @@ var upload_page_functions = upload_page_functions || (function () {
                   .append($("<td>").append(uploaded_file.filename))
                   .append($("<td>").append(uploaded_file.uploaded_by))
                   .append($("<td>").append(uploaded_file.uploaded_at))
-                  .append($("<td>").append(
-                      uploaded_file.success ? "" :
-                            ($("<a>").attr("href", uploaded_file.error_url)
-                            .attr("target", "_")
-                             .text("bekijk fouten"))))
+                  .append($("<td>").append(error_cell(uploaded_file)))
                   .append($("<td>").append(
                       uploaded_file.has_possible_requests ?
                             $("<a>").attr("href", uploaded_file.requests_url)
@@ -47,14 +62,52 @@ var upload_page_functions = upload_page_functions || (function () {
         $(id_not_ready_div).fadeIn();
     };
 
+    var refresh_upload_batches = function () {
+        // Batches are small in number, so the table is simply redrawn
+        $.getJSON($(id_batches_div).attr("data-refresh-url"), function (data) {
+            var tbody = $(id_batches_div + " table tbody").empty();
+            var unfinished = false;
+
+            $.each(data, function(i, batch) {
+                unfinished = unfinished || !batch.finished;
+                tbody.append(
+                    $("<tr>")
+                        .attr("class", batch.finished ?
+                              (batch.num_failed ? "error" : "success") : "")
+                        .append($("<td>").append(batch.filename))
+                        .append($("<td>").append(batch.uploaded_by))
+                        .append($("<td>").append(batch.uploaded_at))
+                        .append($("<td>").append(batch.num_succeeded))
+                        .append($("<td>").append(batch.num_failed))
+                        .append($("<td>").append(batch.num_pending))
+                );
+            });
+
+            if (data.length === 0) {
+                $(id_batches_div).fadeOut();
+            } else {
+                $(id_batches_div).fadeIn();
+            }
+
+            if (unfinished &&
+                $(id_not_ready_div + " table tbody tr").length === 0) {
+                // The last files are done, wait for the batch to finish
+                setTimeout(refresh_upload_batches, 2000);
+            }
+        });
+    };
+
     var refresh_uploaded_file_tables = function () {
         refresh_url = $(id_not_ready_div).attr("data-refresh-url");
 
         // To get it working in IE
         $.ajaxSetup({ cache: false });
 
+        refresh_upload_batches();
+
         $.getJSON(refresh_url, function (data) {
             var ids_to_keep = {};
+            var gwsw_pending = false;
 
             // Sync our tables to the ids in the data
             // First we go to the data, adding any rows not present yet,
@@ -65,6 +118,9 @@ var upload_page_functions = upload_page_functions || (function () {
             $.each(data, function(i, uploaded_file) {
                 var row_id = make_row_id(uploaded_file);
                 ids_to_keep[row_id] = true;
+                if (uploaded_file.gwsw_status === "pending") {
+                    gwsw_pending = true;
+                }
 
                 if ($("#"+row_id).length === 0) {
                     if (uploaded_file.ready) {
@@ -84,6 +140,10 @@ var upload_page_functions = upload_page_functions || (function () {
 
             if ($(id_not_ready_div + " table tbody tr").length === 0) {
                 $(id_not_ready_div).fadeOut();
+                if (gwsw_pending) {
+                    // GWSW checks take a while, refresh less often
+                    setTimeout(refresh_uploaded_file_tables, 10000);
+                }
             } else {
                 // Keep refreshing until this table is empty
                 setTimeout(refresh_uploaded_file_tables, 1000);
@@ -6,12 +6,20 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+from datetime import timedelta
+
+from celery.task import periodic_task
 from celery.task import task
 
 from lizard_progress import archive
+from lizard_progress import batch_upload
+from lizard_progress import crosssection_graph
+from lizard_progress import file_catalog
+from lizard_progress import gwsw
 from lizard_progress import process_uploaded_file
 from lizard_progress import exports
 from lizard_progress.util import shapevac
+from lizard_progress.util import uploads
 
 import logging
 logger = logging.getLogger(__name__)
@@ -33,6 +41,50 @@ def process_uploaded_file_task(uploaded_file_id):
         raise
 
 
+@task
+def process_batch_member_task(uploaded_file_id):
+    """Extract one file of an upload batch from its zip file and
+    process it. Returns whether it was successful."""
+    try:
+        return batch_upload.process_member(uploaded_file_id)
+    except:
+        logger.exception("Error in task 'process_batch_member_task'.")
+        raise
+
+
+@task
+def finish_upload_batch_task(results, batch_id):
+    """Chord callback that finishes an upload batch when all its files
+    were processed, unless the last process_batch_member_task already
+    did. Results are the process_batch_member_task results."""
+    try:
+        batch_upload.finish_batch(batch_id)
+    except:
+        logger.exception("Error in task 'finish_upload_batch_task'.")
+        raise
+
+
+@task
+def gwsw_submit_task(uploaded_file_id, rel_file_path):
+    """Submit an uploaded file to the GWSW API."""
+    try:
+        gwsw.submit_uploaded_file(uploaded_file_id, rel_file_path)
+    except:
+        logger.exception("Error in task 'gwsw_submit_task'.")
+        raise
+
+
+@task
+def gwsw_poll_task(uploaded_file_id, record_id, attempt):
+    """Ask the GWSW API for the log of an uploaded file. Reschedules
+    itself until the log is there."""
+    try:
+        gwsw.poll(uploaded_file_id, record_id, attempt)
+    except:
+        logger.exception("Error in task 'gwsw_poll_task'.")
+        raise
+
+
 @task
 def start_export_run(export_run_id, user):
     """Start the given export run."""
@@ -44,15 +96,65 @@ def start_export_run(export_run_id, user):
 
 
 @task
-def shapefile_vacuum(directory):
-    """Put shapefile parts into zip files in directory."""
+def shapefile_vacuum(directory, catalog_kind=None, catalog_owner_id=None):
+    """Put shapefile parts into zip files in directory. If the kind
+    and owner of the directory in the file catalog are given, scan it
+    afterwards."""
     try:
         shapevac.shapefile_vacuum_directory(directory)
+        if catalog_kind is not None:
+            catalog_directory = file_catalog.Directory.get(
+                catalog_kind, catalog_owner_id)
+            if catalog_directory is not None:
+                catalog_directory.scan()
     except:
         logger.exception("Error in task 'shapefile_vacuum'.")
         raise
 
 
+@periodic_task(run_every=timedelta(hours=1))
+def remove_abandoned_uploads_task():
+    """Remove the staging files of chunked uploads that were abandoned."""
+    try:
+        return uploads.remove_abandoned()
+    except:
+        logger.exception("Error in task 'remove_abandoned_uploads_task'.")
+        raise
+
+
+@periodic_task(run_every=timedelta(minutes=15))
+def finish_upload_batches_task():
+    """Finish upload batches whose last files were removed before they
+    were processed."""
+    try:
+        return batch_upload.finish_stale_batches()
+    except:
+        logger.exception("Error in task 'finish_upload_batches_task'.")
+        raise
+
+
+@periodic_task(run_every=timedelta(minutes=15))
+def evict_crosssection_graphs_task():
+    """Keep the cache of cross section graphs within its size."""
+    try:
+        return crosssection_graph.evict()
+    except:
+        logger.exception("Error in task 'evict_crosssection_graphs_task'.")
+        raise
+
+
+@periodic_task(run_every=timedelta(days=1))
+def reconcile_file_catalog_task():
+    """Make the file catalog match the file system, e.g. for files that
+    were changed in place. New results are picked up by the download
+    page already."""
+    try:
+        return file_catalog.reconcile()
+    except:
+        logger.exception("Error in task 'reconcile_file_catalog_task'.")
+        raise
+
+
 @task
 def archive_task(project_id):
     """Call the archive function."""
@@ -62,6 +164,16 @@ def archive_task(project_id):
         logger.exception("Error in task 'archive_task'.")
         raise
 
+@task
+def render_crosssection_graphs_task(location_ids):
+    """Put the graphs of these locations in the graph cache."""
+    try:
+        crosssection_graph.render_graphs(location_ids)
+    except:
+        logger.exception("Error in task 'render_crosssection_graphs_task'.")
+        raise
+
+
 @task
 def calculate_reviewproject_feature_collection(project_id):
     logger.debug('Entered calculate_reviewproject_feature_collection task, project {}'.format(project_id))
@@ -0,0 +1,119 @@
+"""Tests for access.py"""
+
+import itertools
+
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.test.client import RequestFactory
+
+from lizard_progress import access
+from lizard_progress import models
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import ActivityF
+from lizard_progress.tests.test_models import OrganizationF
+from lizard_progress.tests.test_models import ProjectF
+from lizard_progress.tests.test_models import UserF
+from lizard_progress.tests.test_models import UserProfileF
+
+
+class TestPermissions(FixturesTestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = OrganizationF.create(name='Owner')
+        self.contractor = OrganizationF.create(name='Contractor')
+        self.other = OrganizationF.create(name='Other')
+
+        simple_type = models.ProjectType.objects.create(
+            name='Simple', organization=self.owner, simple_upload=True)
+
+        self.projects = []
+        for i, (is_archived, project_type) in enumerate(
+                itertools.product((False, True), (None, simple_type))):
+            project = ProjectF.create(
+                name='Project {}'.format(i), slug='project{}'.format(i),
+                organization=self.owner, is_archived=is_archived,
+                project_type=project_type)
+            ActivityF.create(project=project, contractor=self.contractor)
+            ActivityF.create(
+                project=project, contractor=self.owner, name='Own activity')
+            self.projects.append(project)
+
+    def profile(self, organization, *roles):
+        profile = UserProfileF.create(
+            user=UserF.create(username='user{}'.format(
+                models.UserProfile.objects.count())),
+            organization=organization)
+        for role in roles:
+            profile.roles.add(models.UserRole.objects.get(code=role))
+        return models.UserProfile.objects.get(pk=profile.pk)
+
+    def test_same_as_has_access(self):
+        profiles = [
+            self.profile(organization, *roles)
+            for organization in (self.owner, self.contractor, self.other)
+            for roles in ((), (models.UserRole.ROLE_MANAGER,),
+                          (models.UserRole.ROLE_UPLOADER,))]
+
+        for profile in profiles:
+            permissions = access.Permissions.compute(profile)
+            for project in self.projects:
+                # Contractors that have activities in the project
+                for contractor in (None, self.owner, self.contractor):
+                    self.assertEquals(
+                        permissions.can_see(project, contractor),
+                        models.has_access(
+                            project=project, contractor=contractor,
+                            userprofile=profile),
+                        (profile, project, contractor))
+                    self.assertEquals(
+                        permissions.can_write(project, contractor),
+                        bool(models.has_write_access(
+                            project=project, contractor=contractor,
+                            userprofile=profile)),
+                        (profile, project, contractor))
+
+    def test_no_profile_sees_nothing(self):
+        permissions = access.Permissions.compute(None)
+        self.assertFalse(permissions.can_see(self.projects[0]))
+        self.assertFalse(permissions.visible_project_ids())
+
+    def test_computed_with_few_queries(self):
+        profile = self.profile(self.contractor, models.UserRole.ROLE_UPLOADER)
+        with self.assertNumQueries(3):
+            access.Permissions.compute(profile)
+
+    def request(self, user, session):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.session = session
+        return request
+
+    def test_kept_in_session_until_roles_change(self):
+        profile = self.profile(self.contractor)
+        session = SessionStore()
+
+        permissions = access.for_request(self.request(profile.user, session))
+        self.assertFalse(permissions.can_see(self.projects[0]))
+
+        # Only the versions are looked up
+        with self.assertNumQueries(1):
+            access.for_request(self.request(profile.user, session))
+
+        profile.roles.add(models.UserRole.objects.get(
+            code=models.UserRole.ROLE_UPLOADER))
+        permissions = access.for_request(self.request(profile.user, session))
+        self.assertTrue(permissions.can_see(
+            self.projects[0], self.contractor))
+
+    def test_forgotten_when_activities_change(self):
+        profile = self.profile(self.other, models.UserRole.ROLE_UPLOADER)
+        session = SessionStore()
+
+        permissions = access.for_request(self.request(profile.user, session))
+        self.assertFalse(permissions.can_see(self.projects[0]))
+
+        ActivityF.create(
+            project=self.projects[0], contractor=self.other,
+            name='Other activity')
+        permissions = access.for_request(self.request(profile.user, session))
+        self.assertTrue(permissions.can_see(self.projects[0]))
@@ -0,0 +1,141 @@
+"""Tests for batch_upload.py"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+import mock
+
+from lizard_progress import batch_upload
+from lizard_progress import models
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import ActivityF
+from lizard_progress.tests.test_models import UserF
+
+
+def fake_process(uploaded_file_id):
+    """Files named bad.* fail, the rest succeed."""
+    uploaded_file = models.UploadedFile.objects.get(pk=uploaded_file_id)
+    uploaded_file.ready = True
+    uploaded_file.success = not uploaded_file.filename.startswith('bad')
+    uploaded_file.save()
+
+
+class TestBatchUpload(FixturesTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.tmp_dir, 'photos.zip')
+        with zipfile.ZipFile(self.zip_path, 'w') as zip_file:
+            zip_file.writestr('a/photo.jpg', 'first photo')
+            zip_file.writestr('b/photo.jpg', 'second photo')
+            zip_file.writestr('bad.jpg', 'not a photo')
+            zip_file.writestr('__MACOSX/a/._photo.jpg', 'resource fork')
+            zip_file.writestr('empty/', '')
+
+        self.activity = ActivityF.create()
+        self.user = UserF.create()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def start(self):
+        with mock.patch('lizard_progress.batch_upload.schedule'):
+            return batch_upload.start_batch(
+                self.activity, self.user, self.zip_path)
+
+    def test_start_creates_uploaded_files_without_extracting(self):
+        batch = self.start()
+
+        self.assertEquals(batch.num_files, 3)
+        self.assertEquals(
+            sorted(batch.uploadedfile_set.values_list(
+                'batch_member', flat=True)),
+            ['a/photo.jpg', 'b/photo.jpg', 'bad.jpg'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp_dir, 'batch')))
+
+    def test_members_get_their_own_directories(self):
+        batch = self.start()
+
+        paths = [uploaded_file.abs_file_path
+                 for uploaded_file in batch.uploadedfile_set.all()]
+        self.assertEquals(len(set(paths)), 3)
+
+    @mock.patch('lizard_progress.batch_upload.finish_batch')
+    @mock.patch('lizard_progress.process_uploaded_file.process_uploaded_file',
+                side_effect=fake_process)
+    def test_process_member_extracts_and_counts(self, process, finish):
+        batch = self.start()
+
+        for uploaded_file in batch.uploadedfile_set.all():
+            self.assertEquals(
+                batch_upload.process_member(uploaded_file.id),
+                uploaded_file.batch_member != 'bad.jpg')
+            with open(uploaded_file.abs_file_path) as f:
+                self.assertTrue(f.read())
+
+        batch = models.UploadBatch.objects.get(pk=batch.pk)
+        self.assertEquals(
+            (batch.num_succeeded, batch.num_failed, batch.num_pending),
+            (2, 1, 0))
+        # Only the last one finishes the batch
+        finish.assert_called_once_with(batch.id)
+
+    def test_member_that_cant_be_extracted_fails(self):
+        batch = self.start()
+        uploaded_file = batch.uploadedfile_set.all()[0]
+        os.remove(self.zip_path)
+
+        self.assertFalse(batch_upload.process_member(uploaded_file.id))
+
+        uploaded_file = models.UploadedFile.objects.get(pk=uploaded_file.pk)
+        self.assertTrue(uploaded_file.ready)
+        self.assertFalse(uploaded_file.success)
+        self.assertEquals(uploaded_file.uploadedfileerror_set.count(), 1)
+        self.assertEquals(
+            models.UploadBatch.objects.get(pk=batch.pk).num_failed, 1)
+
+    @mock.patch('lizard_progress.process_uploaded_file.process_uploaded_file',
+                side_effect=fake_process)
+    def test_finish_batch(self, process):
+        batch = self.start()
+        with mock.patch.object(batch_upload, 'notify_finished') as notify:
+            for uploaded_file in batch.uploadedfile_set.all():
+                batch_upload.process_member(uploaded_file.id)
+            # The chord's callback comes too late
+            batch_upload.finish_batch(batch.id)
+
+        batch = models.UploadBatch.objects.get(pk=batch.pk)
+        self.assertTrue(batch.finished_at)
+        self.assertEquals((batch.num_succeeded, batch.num_failed), (2, 1))
+        self.assertFalse(os.path.exists(self.zip_path))
+        self.assertEquals(notify.call_count, 1)
+
+    @mock.patch('lizard_progress.process_uploaded_file.process_uploaded_file',
+                side_effect=fake_process)
+    def test_batch_with_removed_file_is_finished_later(self, process):
+        batch = self.start()
+        uploaded_files = list(batch.uploadedfile_set.order_by('id'))
+        uploaded_files[-1].delete()
+
+        with mock.patch.object(batch_upload, 'notify_finished') as notify:
+            for uploaded_file in uploaded_files:
+                batch_upload.process_member(uploaded_file.id)
+            self.assertFalse(notify.called)
+
+            self.assertEquals(batch_upload.finish_stale_batches(), 1)
+            self.assertEquals(batch_upload.finish_stale_batches(), 0)
+
+        batch = models.UploadBatch.objects.get(pk=batch.pk)
+        self.assertTrue(batch.finished_at)
+        self.assertEquals(batch.num_succeeded + batch.num_failed, 2)
+        self.assertEquals(notify.call_count, 1)
+
+    def test_bad_zipfile(self):
+        with open(self.zip_path, 'w') as f:
+            f.write('not a zip file')
+
+        self.assertRaises(
+            zipfile.BadZipfile, batch_upload.start_batch,
+            self.activity, self.user, self.zip_path)
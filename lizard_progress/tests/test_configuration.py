@@ -0,0 +1,69 @@
+"""Tests for configuration.py"""
+
+from lizard_progress import configuration
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import ActivityF
+from lizard_progress.tests.test_models import OrganizationF
+from lizard_progress.tests.test_models import ProjectF
+
+
+class TestConfigurationSnapshot(FixturesTestCase):
+    def setUp(self):
+        self.activity = ActivityF.create()
+
+    def test_snapshot_has_same_values_as_get(self):
+        config = configuration.Configuration(activity=self.activity)
+        values = dict(
+            (key, config.get(key)) for key in configuration.CONFIG_OPTIONS)
+
+        self.assertEquals(dict(config.build_snapshot()), values)
+
+    def test_snapshot_uses_activity_value(self):
+        option = configuration.CONFIG_OPTIONS['max_measurement_distance']
+        configuration.Configuration(activity=self.activity).set(option, 7.5)
+
+        self.assertEquals(
+            self.activity.config_value('max_measurement_distance'), 7.5)
+
+    def test_snapshot_is_kept_on_activity(self):
+        self.activity.config_value('max_measurement_distance')
+
+        with self.assertNumQueries(0):
+            for key in configuration.CONFIG_OPTIONS:
+                self.activity.config_value(key)
+
+    def test_setting_a_value_forgets_snapshot(self):
+        option = configuration.CONFIG_OPTIONS['maximum_z1z2_difference']
+        self.assertEquals(
+            self.activity.config_value('maximum_z1z2_difference'), 1)
+
+        configuration.Configuration(activity=self.activity).set(option, 3)
+        self.assertEquals(
+            self.activity.config_value('maximum_z1z2_difference'), 3)
+
+    def test_project_snapshot_has_only_project_options(self):
+        project = ProjectF.create()
+        snapshot = project.config_snapshot
+
+        self.assertEquals(
+            set(snapshot),
+            set(key for key, option in configuration.CONFIG_OPTIONS.items()
+                if option.for_project))
+
+    def test_organization_snapshot_uses_organization_value(self):
+        organization = OrganizationF.create()
+        option = configuration.CONFIG_OPTIONS['location_id_field']
+        configuration.Configuration(
+            organization=organization).set(option, 'ID')
+
+        snapshot = configuration.Configuration(
+            organization=organization).snapshot()
+        self.assertEquals(snapshot['location_id_field'], 'ID')
+
+    def test_snapshot_cant_be_changed(self):
+        snapshot = self.activity.config_snapshot
+
+        def change():
+            snapshot['location_id_field'] = 'ID'
+
+        self.assertRaises(TypeError, change)
@@ -0,0 +1,99 @@
+"""Tests for counters.py"""
+
+from lizard_progress import counters
+from lizard_progress import models
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import ActivityF
+from lizard_progress.tests.test_models import LocationF
+from lizard_progress.tests.test_models import MeasurementF
+
+
+class TestCounters(FixturesTestCase):
+    def setUp(self):
+        self.activity = ActivityF.create()
+        self.project = self.activity.project
+
+    def counts(self):
+        activity = models.Activity.objects.get(pk=self.activity.pk)
+        project = models.Project.objects.get(pk=self.project.pk)
+        return ((activity.num_locations, activity.num_complete_locations,
+                 activity.num_measurements),
+                (project.number_of_locations,
+                 project.number_of_complete_locations))
+
+    def test_locations_are_counted(self):
+        LocationF.create(activity=self.activity, location_code='a')
+        LocationF.create(
+            activity=self.activity, location_code='b', complete=True)
+        LocationF.create(
+            activity=self.activity, location_code='c', complete=True,
+            not_part_of_project=True)
+        self.assertEquals(self.counts(), ((2, 1, 0), (2, 1)))
+
+    def test_completeness_changes_are_counted(self):
+        location = LocationF.create(activity=self.activity)
+        location.complete = True
+        location.save()
+        self.assertEquals(self.counts(), ((1, 1, 0), (1, 1)))
+
+        location = models.Location.objects.get(pk=location.pk)
+        location.complete = False
+        location.save()
+        self.assertEquals(self.counts(), ((1, 0, 0), (1, 0)))
+
+    def test_measurements_are_counted(self):
+        location = LocationF.create(activity=self.activity, complete=True)
+        MeasurementF.create(location=location)
+        measurement = MeasurementF.create(location=location)
+        self.assertEquals(self.counts(), ((1, 1, 2), (1, 1)))
+
+        measurement.delete(notify=False, set_completeness=False)
+        self.assertEquals(self.counts(), ((1, 1, 1), (1, 1)))
+
+    def test_leaving_the_project(self):
+        location = LocationF.create(activity=self.activity, complete=True)
+        MeasurementF.create(location=location)
+        location.not_part_of_project = True
+        location.save()
+        self.assertEquals(self.counts(), ((0, 0, 0), (0, 0)))
+
+    def test_deleted_location_isnt_counted(self):
+        location = LocationF.create(activity=self.activity, complete=True)
+        MeasurementF.create(location=location)
+        models.Location.objects.filter(pk=location.pk).delete()
+        self.assertEquals(self.counts(), ((0, 0, 0), (0, 0)))
+
+    def test_recount_repairs_counters(self):
+        location = LocationF.create(activity=self.activity, complete=True)
+        MeasurementF.create(location=location)
+        other = ActivityF.create(name='Other activity', project=self.project)
+        LocationF.create(activity=other)
+
+        models.Activity.objects.filter(pk=self.activity.pk).update(
+            location_count=5, complete_location_count=5, measurement_count=5)
+        models.Project.objects.update(
+            location_count=5, complete_location_count=5)
+        counters.recount([self.activity.id])
+        self.assertEquals(self.counts(), ((1, 1, 1), (2, 1)))
+
+        models.Activity.objects.update(
+            location_count=5, complete_location_count=5, measurement_count=5)
+        models.Project.objects.update(
+            location_count=5, complete_location_count=5)
+        counters.recount()
+        self.assertEquals(self.counts(), ((1, 1, 1), (2, 1)))
+        self.assertEquals(
+            models.Activity.objects.get(pk=other.pk).num_locations, 1)
+
+    def test_project_list_sorts_on_progress(self):
+        LocationF.create(activity=self.activity, complete=True)
+        empty = models.Project.objects.create(
+            name='Empty project', slug='empty',
+            organization=self.project.organization)
+
+        projects = list(models.Project.objects.extra(
+            select={'progress': models.Project.PERCENTAGE_DONE_SQL},
+            order_by=['-progress']))
+        self.assertEquals(projects, [self.project, empty])
+        self.assertEquals(projects[0].progress, 100)
+        self.assertEquals(empty.percentage_done, 'N/A')
@@ -0,0 +1,113 @@
+"""Tests for the graph cache in crosssection_graph.py"""
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from django.test.utils import override_settings
+
+from lizard_progress import crosssection_graph
+from lizard_progress import tasks
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import LocationF
+from lizard_progress.tests.test_models import MeasurementF
+
+
+class FakeCanvas(object):
+    def __init__(self, size):
+        self.size = size
+
+    def print_png(self, f):
+        f.write(b'x' * self.size)
+
+
+class TestGraphCache(FixturesTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        patcher = mock.patch(
+            'lizard_progress.util.directories.BASE_DIR', self.tmp_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch(
+            'lizard_progress.crosssection_graph.graph',
+            return_value=FakeCanvas(100))
+        self.graph = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.location = LocationF.create()
+        self.measurement = MeasurementF.create(location=self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_graph_is_rendered_once(self):
+        path = crosssection_graph.cached_graph(
+            self.location, [self.measurement])
+        self.assertEquals(
+            crosssection_graph.cached_graph(
+                self.location, [self.measurement]), path)
+        self.assertEquals(self.graph.call_count, 1)
+        self.assertTrue(path.startswith(crosssection_graph.CACHE_DIRNAME))
+        self.assertEquals(
+            os.path.getsize(os.path.join(self.tmp_dir, path)), 100)
+
+    def test_graph_is_readable_by_the_web_server(self):
+        path = crosssection_graph.cached_graph(
+            self.location, [self.measurement])
+        mode = os.stat(os.path.join(self.tmp_dir, path)).st_mode
+        self.assertEquals(mode & 0o777, 0o644)
+
+    def test_failed_graph_leaves_no_file(self):
+        self.graph.return_value = mock.Mock()
+        self.graph.return_value.print_png.side_effect = ValueError
+        self.assertRaises(
+            ValueError, crosssection_graph.cached_graph,
+            self.location, [self.measurement])
+        self.assertEquals(os.listdir(os.path.join(
+            self.tmp_dir, crosssection_graph.CACHE_DIRNAME)), [])
+
+    def test_changed_measurement_is_rendered_again(self):
+        path = crosssection_graph.cached_graph(
+            self.location, [self.measurement])
+        self.measurement.save()
+        self.assertNotEquals(
+            crosssection_graph.cached_graph(
+                self.location, [self.measurement]), path)
+        self.assertEquals(self.graph.call_count, 2)
+
+    def test_least_recently_used_is_evicted(self):
+        measurements = [
+            MeasurementF.create(location=self.location) for i in range(3)]
+        paths = [
+            crosssection_graph.cached_graph(self.location, [measurement])
+            for measurement in measurements]
+
+        # Make the first one the most recently used
+        timestamps = [1000000010, 1000000001, 1000000002]
+        for path, timestamp in zip(paths, timestamps):
+            os.utime(os.path.join(self.tmp_dir, path), (timestamp, timestamp))
+
+        crosssection_graph.evict(max_size=200)
+        self.assertEquals(
+            [os.path.exists(os.path.join(self.tmp_dir, path))
+             for path in paths],
+            [True, False, True])
+
+    @override_settings(LIZARD_PROGRESS_GRAPH_CACHE_SIZE=250)
+    def test_cache_size_is_bounded_by_the_task(self):
+        for i in range(5):
+            crosssection_graph.cached_graph(
+                self.location, [MeasurementF.create(location=self.location)])
+        tasks.evict_crosssection_graphs_task()
+        self.assertEquals(
+            len(os.listdir(os.path.join(
+                self.tmp_dir, crosssection_graph.CACHE_DIRNAME))), 2)
+
+    def test_render_graphs(self):
+        crosssection_graph.render_graphs([self.location.id])
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmp_dir, crosssection_graph.cache_path(
+                self.location, [self.measurement]))))
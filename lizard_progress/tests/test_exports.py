@@ -0,0 +1,233 @@
+"""Tests for exports.py"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import zipfile
+
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from lxml import etree
+
+from lizard_progress import exports
+from lizard_progress import models
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import ExportRunF
+from lizard_progress.tests.test_models import LocationF
+from lizard_progress.tests.test_models import MeasurementF
+
+
+class MockProfile(object):
+    def __init__(self, profile_id):
+        self.id = profile_id
+
+
+class MockSeries(object):
+    def __init__(self, profile_ids):
+        self.profiles = [MockProfile(profile_id) for profile_id in profile_ids]
+
+
+class MockMetfile(object):
+    def __init__(self, profile_ids):
+        self.series = [MockSeries(profile_ids)]
+
+
+@override_settings(LIZARD_PROGRESS_EXPORT_PROCESSES=1)
+class TestRenderAllProfiles(FixturesTestCase):
+    def setUp(self):
+        self.measurements = []
+        for location_code, rel_file_path in (
+                ('A_1', 'a.met'), ('A_2', 'a.met'), ('B_1', 'b.met')):
+            location = LocationF.create(location_code=location_code)
+            self.measurements.append(MeasurementF.create(
+                location=location, rel_file_path=rel_file_path))
+
+    @mock.patch('lizard_progress.exports.file_reader.FileReader')
+    @mock.patch('lizard_progress.exports.parse_metfile')
+    def test_each_file_is_parsed_once(self, parse_metfile, file_reader):
+        parse_metfile.side_effect = [
+            MockMetfile(['A_1', 'A_2']), MockMetfile(['B_1'])]
+
+        with mock.patch.dict(
+                exports.PROFILE_RENDERERS,
+                {'csv': lambda measurement, profile: profile.id}):
+            results = list(exports.render_all_profiles(
+                self.measurements, ['csv']))
+
+        self.assertEquals(parse_metfile.call_count, 2)
+        self.assertEquals(
+            sorted((filename, content)
+                   for measurement, file_type, filename, content in results),
+            [('A_1.csv', 'A_1'), ('A_2.csv', 'A_2'), ('B_1.csv', 'B_1')])
+
+    @mock.patch('lizard_progress.exports.file_reader.FileReader')
+    @mock.patch('lizard_progress.exports.parse_metfile')
+    def test_render_profiles_doesnt_query(self, parse_metfile, file_reader):
+        export_run = ExportRunF.create(exporttype='csv')
+        for location_code in ('A_1', 'A_2'):
+            MeasurementF.create(
+                location=LocationF.create(
+                    activity=export_run.activity,
+                    location_code=location_code, complete=True),
+                rel_file_path='a.met')
+        measurements = list(export_run.measurements_to_export())
+        parse_metfile.return_value = MockMetfile(['A_1', 'A_2'])
+
+        with mock.patch.dict(
+                exports.PROFILE_RENDERERS,
+                {'csv': lambda measurement, profile: (
+                    measurement.location.activity.project.slug)}):
+            with self.assertNumQueries(0):
+                results = exports.render_profiles(
+                    ('a.met', measurements, ['csv']))
+
+        self.assertEquals(
+            [content for measurement, file_type, filename, content
+             in results],
+            [export_run.activity.project.slug] * 2)
+
+    @mock.patch('lizard_progress.exports.file_reader.FileReader')
+    @mock.patch('lizard_progress.exports.parse_metfile')
+    def test_missing_profile_raises(self, parse_metfile, file_reader):
+        parse_metfile.return_value = MockMetfile([])
+
+        self.assertRaises(ValueError, list, exports.render_all_profiles(
+            self.measurements, ['csv']))
+
+
+class TestUpdateZipfile(FixturesTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.zipfile_path = os.path.join(self.tmp_dir, 'export.zip')
+        self.export_run = ExportRunF.create(exporttype='csv')
+        self.measurements = [
+            MeasurementF.create(
+                location=LocationF.create(
+                    activity=self.export_run.activity,
+                    location_code=location_code, complete=True))
+            for location_code in ('A', 'B')]
+        self.written = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_entries(self, z, measurements):
+        entries = {}
+        for measurement in measurements:
+            filename = measurement.location.location_code + '.csv'
+            z.writestr(filename, 'content of ' + filename)
+            entries[measurement.id] = filename
+            self.written.append(filename)
+        return entries
+
+    def run_export(self):
+        self.export_run.manifest = exports.update_zipfile(
+            self.export_run, self.zipfile_path,
+            self.export_run.measurements_to_export(), self.write_entries)
+        self.export_run.save()
+
+    def test_first_run_writes_everything(self):
+        self.run_export()
+
+        self.assertEquals(sorted(self.written), ['A.csv', 'B.csv'])
+        self.assertTrue(self.export_run.manifest_is_current())
+
+    def test_second_run_only_writes_changed_entries(self):
+        self.run_export()
+        self.measurements[1].save()  # Updates its timestamp
+        self.assertFalse(self.export_run.manifest_is_current())
+
+        self.written = []
+        self.run_export()
+
+        self.assertEquals(self.written, ['B.csv'])
+        with zipfile.ZipFile(self.zipfile_path) as z:
+            self.assertEquals(sorted(z.namelist()), ['A.csv', 'B.csv'])
+            self.assertEquals(z.read('A.csv'), 'content of A.csv')
+            self.assertEquals(z.testzip(), None)
+        self.assertTrue(self.export_run.manifest_is_current())
+
+    def test_unchanged_entries_arent_decompressed(self):
+        self.run_export()
+        with zipfile.ZipFile(self.zipfile_path) as z:
+            before = z.getinfo('A.csv')
+        self.measurements[1].save()
+
+        with mock.patch.object(
+                zipfile.ZipFile, 'open', side_effect=AssertionError):
+            self.run_export()
+
+        with zipfile.ZipFile(self.zipfile_path) as z:
+            after = z.getinfo('A.csv')
+            self.assertEquals(z.testzip(), None)
+        self.assertEquals(
+            (after.CRC, after.compress_size, after.date_time),
+            (before.CRC, before.compress_size, before.date_time))
+
+    def test_older_timestamp_isnt_current(self):
+        self.run_export()
+        # Count, ids and latest timestamp stay the same
+        models.Measurement.objects.filter(pk=self.measurements[0].pk).update(
+            timestamp=self.measurements[0].timestamp -
+            datetime.timedelta(days=1))
+        self.assertFalse(self.export_run.manifest_is_current())
+
+
+RIBX_HEADER = b"""<?xml version="1.0" encoding="UTF-8"?>
+<DATA>
+  <ZA><A2>nl</A2><A6>1</A6></ZA>
+"""
+
+RIBX_INSPECTION = b"""
+  <ZB_C><CAA>{ref}</CAA><CBF>2019-12-01</CBF><CBG>10:00</CBG><CAB>PUT1</CAB></ZB_C>
+"""
+
+
+class TestMergeRibx(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.merged_path = os.path.join(self.tmp_dir, 'merged.ribx')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def ribx_file(self, name, refs, header=RIBX_HEADER):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(header)
+            for ref in refs:
+                f.write(RIBX_INSPECTION.replace(b'{ref}', ref))
+            f.write(b'</DATA>')
+        return path
+
+    def test_duplicate_inspections_are_left_out(self):
+        newest = self.ribx_file('newest.ribx', [b'STRENG1'])
+        oldest = self.ribx_file('oldest.ribx', [b'STRENG1', b'STRENG2'])
+
+        self.assertEquals(
+            exports.merge_ribx([newest, oldest], self.merged_path), "")
+
+        merged = etree.parse(self.merged_path).getroot()
+        self.assertEquals(
+            [elem.tag for elem in merged], ['ZA', 'ZB_C', 'ZB_C'])
+        self.assertEquals(
+            [elem.findtext('CAA') for elem in merged.findall('ZB_C')],
+            ['STRENG1', 'STRENG2'])
+
+    def test_missing_mandatory_tags(self):
+        ribx = self.ribx_file(
+            'no_header.ribx', [b'STRENG1'],
+            header=b'<?xml version="1.0" encoding="UTF-8"?><DATA>')
+
+        self.assertEquals(
+            exports.merge_ribx([ribx], self.merged_path),
+            "Geen A2 en/of A6 tag in Ribx")
+        self.assertFalse(os.path.exists(self.merged_path))
+
+    def test_no_files(self):
+        self.assertEquals(
+            exports.merge_ribx([], self.merged_path),
+            "Geen Ribx bestanden gevonden.")
@@ -0,0 +1,147 @@
+"""Tests for file_catalog.py"""
+
+import datetime
+import os
+import shutil
+import tempfile
+
+import mock
+
+from lizard_progress import file_catalog
+from lizard_progress import models
+from lizard_progress.models import CatalogFile
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import ActivityF
+from lizard_progress.util import directories
+
+
+class TestFileCatalog(FixturesTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        patcher = mock.patch(
+            'lizard_progress.util.directories.BASE_DIR', self.tmp_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.activity = ActivityF.create()
+        self.reports_dir = directories.abs_reports_dir(self.activity)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, directory, filename, size):
+        path = os.path.join(directory, filename)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def reports(self):
+        return dict(
+            (catalog_file.filename, catalog_file.file_size)
+            for catalog_file in CatalogFile.objects.filter(
+                activity=self.activity, kind=CatalogFile.KIND_REPORTS))
+
+    def test_scan(self):
+        self.write(self.reports_dir, 'a.pdf', 10)
+        path = self.write(self.reports_dir, 'b.pdf', 20)
+
+        self.assertEquals(
+            file_catalog.scan(CatalogFile.KIND_REPORTS, self.activity),
+            (2, 0, 0))
+        self.assertEquals(self.reports(), {'a.pdf': 10, 'b.pdf': 20})
+
+        self.assertEquals(
+            file_catalog.scan(CatalogFile.KIND_REPORTS, self.activity),
+            (0, 0, 0))
+
+        os.remove(path)
+        self.write(self.reports_dir, 'a.pdf', 30)
+        os.utime(os.path.join(self.reports_dir, 'a.pdf'),
+                 (1000000000, 1000000000))
+        self.assertEquals(
+            file_catalog.scan(CatalogFile.KIND_REPORTS, self.activity),
+            (0, 1, 1))
+        self.assertEquals(self.reports(), {'a.pdf': 30})
+
+    def test_scan_uses_accepted_files(self):
+        path = self.write(self.reports_dir, 'a.pdf', 10)
+        downloaded = datetime.datetime(2019, 1, 2, 3, 4, 5)
+        models.AcceptedFile.objects.create(
+            activity=self.activity, rel_file_path=directories.relative(path),
+            last_downloaded_at=downloaded)
+
+        file_catalog.scan(CatalogFile.KIND_REPORTS, self.activity)
+        self.assertEquals(
+            CatalogFile.objects.get().last_downloaded_at, downloaded)
+
+    def test_add_remove_and_download(self):
+        path = self.write(self.reports_dir, 'a.pdf', 10)
+        file_catalog.add(path, CatalogFile.KIND_REPORTS, self.activity)
+        self.assertEquals(self.reports(), {'a.pdf': 10})
+        self.assertTrue(CatalogFile.objects.get().uploaded_at)
+
+        file_catalog.register_download(directories.relative(path))
+        self.assertTrue(CatalogFile.objects.get().last_downloaded_at)
+
+        file_catalog.remove(path)
+        self.assertEquals(self.reports(), {})
+
+    def test_reconcile(self):
+        self.write(self.reports_dir, 'a.pdf', 10)
+        self.write(directories.abs_project_files_dir(self.activity.project),
+                   'manual.pdf', 10)
+        shapefile_dir = os.path.join(
+            directories.abs_shapefile_dir(self.activity), 'sub')
+        os.mkdir(shapefile_dir)
+        self.write(shapefile_dir, 'vakken.shp', 10)
+
+        self.assertEquals(file_catalog.reconcile(), (3, 0, 0))
+        self.assertEquals(
+            sorted(CatalogFile.objects.values_list('kind', flat=True)),
+            [CatalogFile.KIND_PROJECT, CatalogFile.KIND_REPORTS,
+             CatalogFile.KIND_SHAPEFILE])
+
+    def test_ensure_scanned_scans_once(self):
+        self.write(self.reports_dir, 'a.pdf', 10)
+        file_catalog.ensure_scanned(
+            CatalogFile.KIND_REPORTS, [self.activity])
+        self.assertEquals(self.reports(), {'a.pdf': 10})
+
+        self.write(self.reports_dir, 'b.pdf', 10)
+        with self.assertNumQueries(1):
+            file_catalog.ensure_scanned(
+                CatalogFile.KIND_REPORTS, [self.activity])
+        self.assertEquals(self.reports(), {'a.pdf': 10})
+
+    def test_ensure_scanned_if_changed(self):
+        results_dir = directories.abs_results_dir(self.activity)
+        file_catalog.ensure_scanned(
+            CatalogFile.KIND_RESULTS, [self.activity])
+
+        # A script adds a file after the scan
+        path = self.write(results_dir, 'result.zip', 10)
+        scan = models.CatalogScan.objects.get(
+            activity=self.activity, kind=CatalogFile.KIND_RESULTS)
+        modified = os.stat(results_dir).st_mtime
+        scan.scanned_at = (datetime.datetime.fromtimestamp(modified) -
+                           datetime.timedelta(seconds=1))
+        scan.save()
+
+        file_catalog.ensure_scanned(
+            CatalogFile.KIND_RESULTS, [self.activity])
+        self.assertFalse(CatalogFile.objects.filter(
+            kind=CatalogFile.KIND_RESULTS).exists())
+
+        file_catalog.ensure_scanned(
+            CatalogFile.KIND_RESULTS, [self.activity], if_changed=True)
+        self.assertEquals(
+            list(CatalogFile.objects.filter(
+                kind=CatalogFile.KIND_RESULTS).values_list(
+                'rel_file_path', flat=True)),
+            [directories.relative(path)])
+
+        # Unchanged since this scan
+        with mock.patch.object(file_catalog.Directory, 'scan') as scan:
+            file_catalog.ensure_scanned(
+                CatalogFile.KIND_RESULTS, [self.activity], if_changed=True)
+        self.assertFalse(scan.called)
@@ -0,0 +1,120 @@
+"""Tests for gwsw.py, against a stub GWSW server on localhost."""
+
+import BaseHTTPServer
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.test.utils import override_settings
+
+from lizard_progress import gwsw
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import UploadedFileF
+
+
+class StubGwswHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Accepts any upload as record 7, and returns no log for the first
+    server.logs_after requests for it."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.respond({'id': '7'})
+
+    def do_GET(self):
+        self.server.log_requests += 1
+        if self.server.log_requests > self.server.logs_after:
+            self.respond({'logcontent': [
+                {'type': 'commentaar', 'regelnummer': '1',
+                 'bericht': 'ok'},
+                {'type': 'fout', 'regelnummer': '3',
+                 'bericht': 'Onbekende code'}]})
+        else:
+            self.respond({'logcontent': None})
+
+    def respond(self, data):
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestGwswCheck(FixturesTestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), StubGwswHandler)
+        self.server.log_requests = 0
+        self.server.logs_after = 2
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.settings = override_settings(
+            GWSW_API_ENABLED=True,
+            GWSW_UPLOAD_URL=url + '/upload',
+            GWSW_GETLOG_URL=url + '/getlog/%s',
+            LIZARD_PROGRESS_GWSW_MAX_POLLS=4)
+        self.settings.enable()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(self.tmp_dir, 'inspection.ribx')
+        with open(path, 'w') as f:
+            f.write('<ribx/>')
+        self.uploaded_file = UploadedFileF.create(
+            rel_file_path=path, ready=True, success=True,
+            gwsw_status='pending')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def check(self):
+        # Tasks are eager in tests, polls are done right away
+        gwsw.submit_uploaded_file(
+            self.uploaded_file.id, self.uploaded_file.rel_file_path)
+        return self.uploaded_file.__class__.objects.get(
+            pk=self.uploaded_file.pk)
+
+    def test_errors_are_added_when_log_arrives(self):
+        uploaded_file = self.check()
+
+        self.assertEquals(self.server.log_requests, 3)
+        self.assertEquals(uploaded_file.gwsw_status, 'errors')
+        self.assertEquals(uploaded_file.gwsw_record_id, 7)
+        self.assertTrue(uploaded_file.success)
+        self.assertEquals(
+            list(uploaded_file.uploadedfileerror_set.values_list(
+                'line', 'error_code', 'error_message')),
+            [(3, 'GWSW', 'GWSW: Onbekende code')])
+
+    def test_polling_gives_up(self):
+        self.server.logs_after = 10
+
+        uploaded_file = self.check()
+
+        self.assertEquals(self.server.log_requests, 4)
+        self.assertEquals(uploaded_file.gwsw_status, 'failed')
+        self.assertFalse(uploaded_file.uploadedfileerror_set.exists())
+
+    def test_unreachable_api(self):
+        with override_settings(GWSW_UPLOAD_URL='http://127.0.0.1:1/'):
+            uploaded_file = self.check()
+
+        self.assertEquals(uploaded_file.gwsw_status, 'failed')
+        self.assertEquals(self.server.log_requests, 0)
+
+    @override_settings(LIZARD_PROGRESS_GWSW_INITIAL_WAIT=2,
+                       LIZARD_PROGRESS_GWSW_MAX_WAIT=30)
+    def test_poll_countdown_doubles(self):
+        self.assertEquals(
+            [gwsw.poll_countdown(attempt) for attempt in range(6)],
+            [2, 4, 8, 16, 30, 30])
@@ -0,0 +1,173 @@
+"""Tests for mapdata.py"""
+
+import errno
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import cache
+
+from lizard_progress import mapdata
+from lizard_progress import models
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import ActivityF
+from lizard_progress.tests.test_models import LocationF
+
+
+class TestMapLayers(FixturesTestCase):
+    def setUp(self):
+        cache.clear()
+        self.activity = ActivityF.create(name='Inpeiling')
+        self.location = LocationF.create(
+            activity=self.activity, location_code='LOC1')
+
+    def map_layers(self):
+        return mapdata.MapLayers(
+            self.activity.project.id, [(self.activity.id, self.activity.name)])
+
+    def test_layer_per_activity(self):
+        layers = json.loads(self.map_layers().geojson())
+
+        self.assertEquals(layers.keys(), ['Inpeiling'])
+        self.assertEquals(
+            [feature['properties']['code']
+             for feature in layers['Inpeiling']['features']], ['LOC1'])
+
+    def test_layers_are_cached(self):
+        layers = self.map_layers().geojson()
+
+        # Only the versions are looked up
+        with self.assertNumQueries(1):
+            self.assertEquals(self.map_layers().geojson(), layers)
+
+    def test_etag_stays_the_same(self):
+        self.assertEquals(self.map_layers().etag, self.map_layers().etag)
+
+    def test_saving_a_location_changes_etag(self):
+        etag = self.map_layers().etag
+        # Make sure the next version is different
+        models.CacheVersion.objects.filter(
+            key=mapdata.version_key(self.activity.id)).update(version=0)
+        etag = self.map_layers().etag
+
+        self.location.save()
+
+        self.assertNotEquals(self.map_layers().etag, etag)
+
+    def test_no_activities(self):
+        self.assertEquals(mapdata.MapLayers(1, []).geojson(), '{}')
+
+
+class TestActivityTile(FixturesTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        patcher = mock.patch(
+            'lizard_progress.mapdata.directories.abs_tile_cache_dir',
+            lambda activity_id: os.path.join(self.tmp_dir, str(activity_id)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_tile_bounds(self):
+        self.assertEquals(
+            mapdata.tile_bounds(0, 0, 0),
+            (-mapdata.WEB_MERCATOR_MAX, -mapdata.WEB_MERCATOR_MAX,
+             mapdata.WEB_MERCATOR_MAX, mapdata.WEB_MERCATOR_MAX))
+        self.assertEquals(
+            mapdata.tile_bounds(1, 1, 0),
+            (0, 0, mapdata.WEB_MERCATOR_MAX, mapdata.WEB_MERCATOR_MAX))
+
+    @mock.patch('lizard_progress.mapdata.query_tile', return_value=b'tile')
+    def test_tiles_are_kept_on_disk(self, query_tile):
+        mapdata.activity_tile(1, 1000.0, 3, 4, 5, 28992)
+        tile = mapdata.activity_tile(1, 1000.0, 3, 4, 5, 28992)
+
+        self.assertEquals(tile, b'tile')
+        self.assertEquals(query_tile.call_count, 1)
+
+    @mock.patch('lizard_progress.mapdata.query_tile', return_value=b'tile')
+    def test_new_version_purges_old_tiles(self, query_tile):
+        mapdata.activity_tile(1, 1000.0, 3, 4, 5, 28992)
+        mapdata.activity_tile(1, 2000.0, 3, 4, 5, 28992)
+
+        self.assertEquals(query_tile.call_count, 2)
+        self.assertEquals(
+            os.listdir(os.path.join(self.tmp_dir, '1')),
+            [mapdata.version_dirname(2000.0)])
+
+    @mock.patch('lizard_progress.mapdata.query_tile', return_value=b'tile')
+    def test_older_version_doesnt_purge_newer_tiles(self, query_tile):
+        mapdata.activity_tile(1, 2000.0, 3, 4, 5, 28992)
+        mapdata.activity_tile(1, 1000.0, 3, 4, 5, 28992)
+
+        self.assertEquals(
+            sorted(os.listdir(os.path.join(self.tmp_dir, '1'))),
+            [mapdata.version_dirname(1000.0),
+             mapdata.version_dirname(2000.0)])
+
+    @mock.patch('lizard_progress.mapdata.query_tile', return_value=b'tile')
+    def test_tile_returned_if_directory_was_purged(self, query_tile):
+        with mock.patch('lizard_progress.mapdata.os.rename',
+                        side_effect=OSError(errno.ENOENT, 'gone')):
+            tile = mapdata.activity_tile(1, 1000.0, 3, 4, 5, 28992)
+        self.assertEquals(tile, b'tile')
+
+    def test_large_activity_gets_tiles(self):
+        activity = ActivityF.create(name='Riolering')
+        LocationF.create(activity=activity, location_code='PUT1')
+
+        with self.settings(LIZARD_PROGRESS_MAP_TILES_FROM=1):
+            layers = json.loads(mapdata.MapLayers(
+                activity.project.id, [(activity.id, activity.name)],
+                tile_url=lambda activity_id: 'tiles/{z}/{x}/{y}.pbf'
+            ).query_layers())
+
+        self.assertEquals(
+            layers, {'Riolering': {'tiles': 'tiles/{z}/{x}/{y}.pbf'}})
+
+
+class TestNearestLocations(FixturesTestCase):
+    def setUp(self):
+        self.activity = ActivityF.create()
+        self.near = LocationF.create(
+            activity=self.activity, location_code='NEAR',
+            the_geom='POINT(425000 150000)')
+        self.far = LocationF.create(
+            activity=self.activity, location_code='FAR',
+            the_geom='POINT(425030 150000)')
+
+        click = GEOSGeometry('POINT(425001 150000)', srid=models.SRID)
+        click.transform(4326)
+        self.lng, self.lat = click.coords
+
+    def nearest(self, activity_ids, radius=50):
+        return mapdata.nearest_locations(
+            activity_ids, self.lng, self.lat, radius,
+            [models.Location.LOCATION_TYPE_POINT], models.SRID)
+
+    def test_finds_nearest(self):
+        self.assertEquals(self.nearest([self.activity.id]), [self.near.id])
+
+    def test_nothing_within_radius(self):
+        self.near.delete()
+        self.assertEquals(self.nearest([self.activity.id], radius=10), [])
+
+    def test_only_given_activities(self):
+        self.assertEquals(self.nearest([self.activity.id + 1]), [])
+        self.assertEquals(self.nearest([]), [])
+
+    def test_close_by_counts(self):
+        self.near.complete = True
+        self.near.save()
+
+        self.assertEquals(
+            mapdata.close_by_counts(
+                [self.near.id, self.far.id],
+                self.activity.project.organization_id, 10),
+            {self.near.id: 1})
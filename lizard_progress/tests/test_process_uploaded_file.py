@@ -0,0 +1,88 @@
+"""Tests for process_uploaded_file.py"""
+
+import os
+import shutil
+import tempfile
+
+from lizard_progress import models
+from lizard_progress import process_uploaded_file
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import ActivityF
+from lizard_progress.tests.test_models import LocationF
+from lizard_progress.tests.test_models import MeasurementF
+from lizard_progress.tests.test_models import UploadedFileF
+from lizard_progress.util import uploads
+
+
+class TestIdenticalUploads(FixturesTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.activity = ActivityF.create()
+
+        self.accepted_path = self.write_file('accepted', 'profiles.met')
+        models.AcceptedFile.create_from_path(
+            activity=self.activity, rel_file_path=self.accepted_path,
+            num_measurements=2)
+        MeasurementF.create(
+            location=LocationF.create(activity=self.activity),
+            rel_file_path=self.accepted_path)
+        self.replaced = MeasurementF.create(
+            location=LocationF.create(
+                activity=self.activity, location_code='LOC2'),
+            rel_file_path=self.accepted_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, dirname, filename, content='some profiles'):
+        os.mkdir(os.path.join(self.tmp_dir, dirname))
+        path = os.path.join(self.tmp_dir, dirname, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def upload(self, filename, content='some profiles'):
+        path = self.write_file('upload', filename, content)
+        return UploadedFileF.create(
+            activity=self.activity, rel_file_path=path,
+            content_hash=uploads.file_digest(path))
+
+    def test_accepted_file_has_content_hash(self):
+        accepted_file = models.AcceptedFile.objects.get(
+            activity=self.activity)
+        self.assertEquals(
+            accepted_file.content_hash,
+            uploads.file_digest(self.accepted_path))
+
+    def test_same_file_isnt_processed_again(self):
+        uploaded_file = self.upload('profiles.met')
+
+        self.assertTrue(
+            process_uploaded_file.is_accepted_already(uploaded_file))
+        self.assertTrue(uploaded_file.ready)
+        self.assertTrue(uploaded_file.success)
+        self.assertFalse(os.path.exists(uploaded_file.abs_file_path))
+
+    def test_other_name_or_content_is_processed(self):
+        self.assertFalse(process_uploaded_file.is_accepted_already(
+            self.upload('other.met')))
+        shutil.rmtree(os.path.join(self.tmp_dir, 'upload'))
+        self.assertFalse(process_uploaded_file.is_accepted_already(
+            self.upload('profiles.met', content='other profiles')))
+
+    def test_processed_if_a_measurement_was_replaced(self):
+        self.replaced.rel_file_path = '/other/file.met'
+        self.replaced.save()
+
+        self.assertFalse(process_uploaded_file.is_accepted_already(
+            self.upload('profiles.met')))
+
+    def test_identical_content_is_stored_once(self):
+        uploaded_file = self.upload('other.met')
+        target_path = os.path.join(self.tmp_dir, 'other.met')
+
+        process_uploaded_file.store_accepted_file(uploaded_file, target_path)
+
+        self.assertEquals(os.stat(target_path).st_ino,
+                          os.stat(self.accepted_path).st_ino)
+        self.assertFalse(os.path.exists(uploaded_file.abs_file_path))
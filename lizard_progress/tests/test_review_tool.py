@@ -28,7 +28,6 @@ class ReviewProjectF(factory.DjangoModelFactory):
     slug = factory.Sequence(lambda n: 'testreviewproject%d' % n)
     organization = factory.SubFactory(OrganizationF)
     contractor = None
-    reviews = None
     inspection_filler = None
 
 
@@ -109,7 +108,7 @@ class TestReviewProject(FixturesTestCase):
                                                        move=False)
         pr = models.ReviewProject.objects.get(pk=pr.pk)  # Refresh
 
-        reviews = pr.reviews
+        reviews = pr.get_reviews()
         pipes = reviews['pipes']
         man_holes = reviews['manholes']
 
@@ -120,6 +119,22 @@ class TestReviewProject(FixturesTestCase):
         self.assertEqual('142776.84', pipes[0]['Eindpunt x'])
         self.assertEqual('486430.19', pipes[0]['Eindpunt y'])
 
+    def test_inspection_elements_are_streamed(self):
+        tags = []
+        for elem in self.rp._iter_inspection_elements(self.ribx_file):
+            tags.append(elem.tag)
+            # Only the previous element is still there, cleared
+            previous = elem.xpath(
+                'preceding-sibling::ZB_A | preceding-sibling::ZB_C')
+            self.assertEquals(len(previous), 1 if len(tags) > 1 else 0)
+            self.assertFalse(any(len(p) for p in previous))
+            self.assertTrue(len(elem))
+
+        self.assertEqual(sorted(set(tags)), ['ZB_A', 'ZB_C'])
+        self.assertEqual(
+            len(tags),
+            len(etree.parse(self.ribx_file).xpath('//ZB_A | //ZB_C')))
+
     def test__manholes_to_points(self):
         with self.settings(CELERY_ALWAYS_EAGER=True,
                            CELERY_EAGER_PROPAGATES_EXCEPTIONS=True):
@@ -169,6 +184,22 @@ class TestReviewProject(FixturesTestCase):
         geojson = json.loads(pr.feature_collection_geojson)
         self.assertEquals(len(geojson['features']), 2)
 
+    def test_feature_collection_json_shows_current_completion(self):
+        with self.settings(CELERY_ALWAYS_EAGER=True,
+                           CELERY_EAGER_PROPAGATES_EXCEPTIONS=True):
+            pr = models.ReviewProject.create_from_ribx(self.name,
+                                                       self.ribx_file,
+                                                       self.organization,
+                                                       move=False)
+        pr.inspections.update(completion=100)
+
+        with self.assertNumQueries(1):
+            geojson = json.loads(pr.feature_collection_json())
+        self.assertEquals(
+            [feature['properties']['completion']
+             for feature in geojson['features']], [100, 100])
+        self.assertEquals(pr.calc_progress(), 100)
+
     def _calc_progress_manhole(self, manhole):
         progress = self.rp._calc_progress_manhole(manhole)
         self.assertEquals(progress, 0.0)
@@ -182,8 +213,93 @@ class TestReviewProject(FixturesTestCase):
                                    'review',
                                    'review_uncompleted.json')
         with open(review_file) as json_file:
-            review = ReviewProjectF(reviews=json.load(json_file))
-            uncompleted_manhole = review.reviews['manholes'][0]
+            reviews = json.load(json_file)
+            uncompleted_manhole = reviews['manholes'][0]
             self._calc_progress_manhole(uncompleted_manhole)
-            uncompleted_pipe = review.reviews['pipes'][0]
+            uncompleted_pipe = reviews['pipes'][0]
             self._calc_progress_pipe(uncompleted_pipe)
+
+    def _store_uncompleted_reviews(self):
+        review_file = os.path.join(self.test_files,
+                                   'review',
+                                   'review_uncompleted.json')
+        with open(review_file) as json_file:
+            reviews = json.load(json_file)
+        self.rp.store_reviews(reviews)
+        return reviews
+
+    def test_store_reviews(self):
+        reviews = self._store_uncompleted_reviews()
+        self.assertEquals(self.rp.inspections.count(), 10)
+        self.assertEquals(models.ReviewObservation.objects.filter(
+            inspection__review_project=self.rp).count(), 9)
+
+        stored = self.rp.get_reviews()
+        self.assertEquals(len(stored['pipes']), 4)
+        self.assertEquals(len(stored['manholes']), 6)
+        self.assertEquals(stored['pipes'][0]['AAA'], reviews['pipes'][0]['AAA'])
+        self.assertEquals(
+            [zc['Herstelmaatregel'] for zc in stored['pipes'][2]['ZC']],
+            [zc['Herstelmaatregel'] for zc in reviews['pipes'][2]['ZC']])
+        self.assertNotIn('ZC', stored['manholes'][0])
+
+        # Pipes 100, 50, 25, 0 and manholes 0, 0, 100, 100, 0, 0 percent
+        self.assertEquals(self.rp.progress, 38)
+
+    def test_iter_reviews_json(self):
+        self._store_uncompleted_reviews()
+        self.assertEquals(json.loads(''.join(self.rp.iter_reviews_json())),
+                          self.rp.get_reviews())
+
+    def test_update_reviews_only_changes_given_items(self):
+        self._store_uncompleted_reviews()
+        before = self.rp.get_reviews()
+        pipe = before['pipes'][3]
+
+        result = self.rp.update_reviews([{
+            'id': pipe['id'],
+            'version': pipe['version'],
+            'Opmerking': 'ok',
+            'ZC': [{'id': pipe['ZC'][0]['id'],
+                    'version': pipe['ZC'][0]['version'],
+                    'Herstelmaatregel': 'waarschuwing'}]}])
+        self.assertEquals(result['updated'], [{'id': pipe['id'], 'version': 2}])
+
+        after = self.rp.get_reviews()
+        self.assertEquals(after['pipes'][3]['Opmerking'], 'ok')
+        self.assertEquals(after['pipes'][3]['ZC'][0]['version'], 2)
+        self.assertEquals(after['pipes'][3]['ZC'][0]['Herstelmaatregel'],
+                          'waarschuwing')
+        self.assertEquals(after['pipes'][:3], before['pipes'][:3])
+        self.assertEquals(after['manholes'], before['manholes'])
+        self.assertEquals(
+            models.ReviewInspection.objects.get(pk=pipe['id']).completion, 100)
+        self.assertEquals(self.rp.progress, 48)
+
+    def test_update_reviews_without_changes(self):
+        self._store_uncompleted_reviews()
+        pipe = self.rp.get_reviews()['pipes'][0]
+        result = self.rp.update_reviews([pipe])
+        self.assertEquals(result['updated'], [])
+        self.assertEquals(result['conflicts'], [])
+
+    def test_update_reviews_conflicts(self):
+        self._store_uncompleted_reviews()
+        pipe = self.rp.get_reviews()['pipes'][0]
+        result = self.rp.update_reviews([
+            {'id': pipe['id'], 'version': 5, 'Herstelmaatregel': 'x'},
+            {'id': -1}])
+        self.assertEquals(result['conflicts'], [pipe['id']])
+        self.assertEquals(result['unknown'], [-1])
+        self.assertEquals(
+            models.ReviewInspection.objects.get(
+                pk=pipe['id']).herstelmaatregel, '')
+
+    def test_apply_reviews_matches_on_position(self):
+        reviews = self._store_uncompleted_reviews()
+        reviews['manholes'][0]['Herstelmaatregel'] = 'ingrijp'
+        result = self.rp.apply_reviews(reviews)
+        self.assertEquals(len(result['updated']), 1)
+        self.assertEquals(
+            self.rp.get_reviews()['manholes'][0]['Herstelmaatregel'],
+            'ingrijp')
@@ -0,0 +1,105 @@
+"""Tests for routing.py"""
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from django.test.utils import override_settings
+
+from lizard_progress import routing
+from lizard_progress.tests.base import FixturesTestCase
+from lizard_progress.tests.test_models import UploadedFileF
+
+
+class TestTaskRouter(FixturesTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.router = routing.TaskRouter()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def upload(self, size):
+        path = os.path.join(self.tmp_dir, 'file{}.met'.format(size))
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return UploadedFileF.create(rel_file_path=path)
+
+    def route(self, task, *args):
+        return self.router.route_for_task(
+            'lizard_progress.tasks.' + task, args)
+
+    @override_settings(LIZARD_PROGRESS_LARGE_UPLOAD_SIZE=100)
+    def test_upload_queue_depends_on_size(self):
+        self.assertEquals(routing.upload_queue(99), 'uploads')
+        self.assertEquals(routing.upload_queue(100), 'uploads_large')
+        self.assertEquals(routing.upload_queue(None), 'uploads')
+
+    def test_uploads_arent_looked_up_by_the_router(self):
+        with self.assertNumQueries(0):
+            self.assertEquals(
+                self.route('process_uploaded_file_task', 12345),
+                {'queue': 'uploads'})
+
+    @override_settings(
+        LIZARD_PROGRESS_LARGE_UPLOAD_SIZE=100,
+        CELERY_ROUTES=('lizard_progress.routing.TaskRouter',))
+    @mock.patch('lizard_progress.tasks.process_uploaded_file_task')
+    @mock.patch('lizard_progress.models.connection')
+    def test_schedule_processing_picks_the_queue(self, connection, task):
+        connection.on_commit.side_effect = lambda callback: callback()
+
+        self.upload(100).schedule_processing()
+
+        self.assertEquals(
+            task.apply_async.call_args[1]['queue'], 'uploads_large')
+
+    @override_settings(LIZARD_PROGRESS_LARGE_UPLOAD_SIZE=100)
+    @mock.patch('lizard_progress.tasks.process_uploaded_file_task')
+    @mock.patch('lizard_progress.models.connection')
+    def test_schedule_processing_without_router(self, connection, task):
+        connection.on_commit.side_effect = lambda callback: callback()
+
+        with self.settings(CELERY_ROUTES=None):
+            self.upload(100).schedule_processing()
+
+        self.assertNotIn('queue', task.apply_async.call_args[1])
+
+    def test_is_enabled(self):
+        with self.settings(CELERY_ROUTES=None):
+            self.assertFalse(routing.is_enabled())
+        with self.settings(
+                CELERY_ROUTES='lizard_progress.routing.TaskRouter'):
+            self.assertTrue(routing.is_enabled())
+        with self.settings(CELERY_ROUTES=({'add': {'queue': 'x'}},)):
+            self.assertFalse(routing.is_enabled())
+
+    def test_other_tasks(self):
+        self.assertEquals(
+            self.route('start_export_run', 1, None), {'queue': 'exports'})
+        self.assertEquals(
+            self.route('setup_project_using_ribx_task', 1, '', '', ''),
+            {'queue': 'review'})
+        self.assertEquals(
+            self.route('archive_task', 1), {'queue': 'maintenance'})
+        self.assertEquals(self.route('add', 1, 2), None)
+
+    @override_settings(LIZARD_PROGRESS_TASK_QUEUES={
+        'exports': {'concurrency': 3}})
+    def test_worker_commands(self):
+        app = mock.Mock()
+        app.conf.CELERY_DEFAULT_QUEUE = 'celery'
+
+        commands = dict(
+            (command.split(' -Q ')[1].split()[0], command)
+            for command in routing.worker_commands(app))
+
+        self.assertEquals(
+            sorted(commands), [
+                'exports', 'maintenance,celery', 'review', 'uploads',
+                'uploads_large'])
+        self.assertIn(' -c 3 ', commands['exports'])
+        self.assertTrue(commands['exports'].endswith(
+            '-- celeryd.prefetch_multiplier=1'))
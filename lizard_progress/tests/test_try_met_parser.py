@@ -139,6 +139,28 @@ class TestHDSR(TestOrganization):
             'hdsr/1 XY komt meerdere keren voor.met',
             set([(20, 'MET_XY_OCCURS_ONCE_IN_PROFILE')]))
 
+    def test_uploading_twice_updates_measurements(self, *args):
+        self.project_org.set_error_codes(())
+
+        self.try_file('hdsr/1 XY komt meerdere keren voor.met', set())
+        locations = models.Location.objects.filter(activity=self.activity)
+        num_measurements = models.Measurement.objects.filter(
+            location__activity=self.activity).count()
+        self.assertTrue(locations.exists())
+        self.assertEquals(num_measurements, locations.count())
+
+        self.try_file('hdsr/1 XY komt meerdere keren voor.met', set())
+        self.assertEquals(models.Measurement.objects.filter(
+            location__activity=self.activity).count(), num_measurements)
+
+        for location in locations:
+            self.assertTrue(location.complete)
+            self.assertTrue(location.one_measurement_uploaded)
+            self.assertEquals(
+                location.measured_date,
+                location.latest_measurement_date().date())
+            self.assertTrue(location.measurement.the_geom)
+
 
 @attr('slow')  # Exclude these with bin/test '-a!slow'
 @mock.patch('shutil.move')  # So that the file isn't moved for real in the end
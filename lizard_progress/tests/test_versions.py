@@ -0,0 +1,24 @@
+"""Tests for versions.py"""
+
+from lizard_progress import models
+from lizard_progress import versions
+from lizard_progress.tests.base import FixturesTestCase
+
+
+class TestVersions(FixturesTestCase):
+    def test_missing_keys_get_a_version(self):
+        current = versions.get_many(['a', 'b'])
+        self.assertEquals(sorted(current), ['a', 'b'])
+        self.assertEquals(versions.get_many(['a', 'b']), current)
+
+    def test_renew(self):
+        models.CacheVersion.objects.create(key='a', version=0)
+        versions.renew(['a', 'b'])
+        current = versions.get_many(['a', 'b'])
+        self.assertTrue(current['a'] > 0)
+        self.assertEquals(models.CacheVersion.objects.count(), 2)
+
+    def test_nothing_to_do(self):
+        with self.assertNumQueries(0):
+            self.assertEquals(versions.get_many([]), {})
+            versions.renew([None])
@@ -74,25 +74,102 @@ class TestReviewProjectViews(FixturesTestCase):
             self.assertIn('name', response.context_data['view'].form.errors)
             self.assertIn('ribx', response.context_data['view'].form.errors)
 
+    def _review_path(self):
+        return os.path.join('lizard_progress',
+                            'tests',
+                            'test_met_files',
+                            'review',
+                            'review_uncompleted.json')
+
+    def _store_empty_reviews(self):
+        """Store the reviewed inspections of review_uncompleted.json,
+        with their reviews removed."""
+        with open(self._review_path()) as json_file:
+            reviews = json.load(json_file)
+        for item in reviews['pipes'] + reviews['manholes']:
+            item['Herstelmaatregel'] = ''
+            for zc in item.get('ZC', []):
+                zc['Herstelmaatregel'] = ''
+        self.reviewproject.store_reviews(reviews)
+
     def test_upload_valid_reviews(self):
         # Starting with no reviews
-        self.assertFalse(self.reviewproject.reviews)
+        self.assertFalse(self.reviewproject.inspections.exists())
+        self._store_empty_reviews()
         url = reverse('lizard_progress_reviewproject',
                       kwargs={'review_id': self.reviewproject.id})
-        simple_review_path = os.path.join('lizard_progress',
-                                          'tests',
-                                          'test_met_files',
-                                          'review',
-                                          'simple.json')
         response = None
-        with open(simple_review_path, 'r') as json_file:
+        with open(self._review_path(), 'r') as json_file:
             response = self.client.post(url,
                                         {'reviews': json_file,
                                          'Upload reviews': ''})
 
         self.assertEquals(response.status_code, 302)
         updated_review = models.ReviewProject.objects.get(id=self.reviewproject.id)
-        self.assertEquals(updated_review.reviews, json.loads('{"a": "b"}'))
+        reviews = updated_review.get_reviews()
+        with open(self._review_path()) as json_file:
+            uploaded = json.load(json_file)
+        self.assertEquals(
+            [zc['Herstelmaatregel'] for zc in reviews['pipes'][0]['ZC']],
+            [zc['Herstelmaatregel'] for zc in uploaded['pipes'][0]['ZC']])
+        self.assertEquals(reviews['pipes'][0]['version'], 2)
+        self.assertEquals(reviews['pipes'][3]['version'], 1)
+        self.assertTrue(updated_review.progress)
+
+    def test_update_reviews(self):
+        self._store_empty_reviews()
+        pipe = self.reviewproject.get_reviews()['pipes'][1]
+        url = reverse('lizard_progress_update_reviews',
+                      kwargs={'review_id': self.reviewproject.id})
+
+        update = {'pipes': [{
+            'id': pipe['id'],
+            'version': pipe['version'],
+            'ZC': [{'id': pipe['ZC'][1]['id'],
+                    'Herstelmaatregel': 'ingrijp'}]}]}
+        response = self.client.post(url, json.dumps(update),
+                                    content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEquals(result['updated'],
+                          [{'id': pipe['id'], 'version': 2}])
+        self.assertEquals(result['conflicts'], [])
+        self.assertEquals(
+            self.reviewproject.get_reviews()['pipes'][1]['ZC'][1][
+                'Herstelmaatregel'], 'ingrijp')
+
+        # Sending it again with the old version is a conflict
+        response = self.client.post(url, json.dumps(update),
+                                    content_type='application/json')
+        self.assertEquals(json.loads(response.content)['conflicts'],
+                          [pipe['id']])
+
+    def test_update_reviews_with_invalid_items(self):
+        self._store_empty_reviews()
+        pipe = self.reviewproject.get_reviews()['pipes'][1]
+        url = reverse('lizard_progress_update_reviews',
+                      kwargs={'review_id': self.reviewproject.id})
+
+        for item in ({'version': 1},
+                     {'id': [pipe['id']]},
+                     {'id': 'abc'},
+                     {'id': pipe['id'], 'ZC': ['ingrijp']},
+                     {'id': pipe['id'], 'ZC': {'id': 1}},
+                     {'id': pipe['id'], 'ZC': [{'id': {}}]}):
+            response = self.client.post(
+                url, json.dumps({'pipes': [item]}),
+                content_type='application/json')
+            self.assertEquals(response.status_code, 400)
+
+    def test_download_reviews(self):
+        self._store_empty_reviews()
+        response = self.client.get(
+            reverse('lizard_progress_download_reviews',
+                    kwargs={'review_id': self.reviewproject.id}))
+        reviews = json.loads(b''.join(response.streaming_content))
+        self.assertEquals(len(reviews['pipes']), 4)
+        self.assertEquals(len(reviews['manholes']), 6)
+        self.assertEquals(reviews['project']['slug'], self.reviewproject.slug)
 
     def test_upload_invalid_reviews(self):
         url = reverse('lizard_progress_reviewproject',
@@ -132,7 +209,7 @@ class TestReviewProjectViews(FixturesTestCase):
             )
             reviewProject = models.ReviewProject.objects.get(
                             name='reviewproject with contractor')
-            self.assertTrue(reviewProject.reviews)
+            self.assertTrue(reviewProject.get_reviews())
             self.assertTrue(reviewProject.contractor)
 
 
@@ -294,3 +371,104 @@ class TestUploadReviewProjectViews(FixturesTestCase):
             {'Upload reviews': ''})
         self.assertEqual(302, response.status_code)
         self.assertTrue('/accounts/login/' in response.url)
+
+
+class TestDashboardCsvView(FixturesTestCase):
+
+    def setUp(self):
+        from lizard_progress.tests.test_models import LocationF
+        from lizard_progress.tests.test_models import MeasurementF
+
+        self.location = LocationF.create(location_code='B', complete=True)
+        self.activity = self.location.activity
+        MeasurementF.create(
+            location=self.location,
+            rel_file_path='x/20120301-134855-0-pilot.csv')
+        MeasurementF.create(
+            location=self.location,
+            rel_file_path='x/20120302-134855-0-Extra.csv')
+        LocationF.create(location_code='A', activity=self.activity)
+
+    def test_rows(self):
+        from lizard_progress.views.views import DashboardCsvView
+
+        view = DashboardCsvView()
+        view.activity = self.activity
+        self.assertEqual(
+            ''.join(view.iter_csv()).splitlines(), [
+                'Locatie ID,Geupload in',
+                'A,Nog niet aanwezig',
+                'B,"Extra.csv (2012-03-02), pilot.csv (2012-03-01)"'])
+
+
+class TestGetClosestTo(FixturesTestCase):
+
+    def setUp(self):
+        from lizard_progress.changerequests.tests.test_models import RequestF
+        from lizard_progress.tests.test_models import LocationF
+
+        self.location = LocationF.create(location_code='LOC')
+        self.activity = self.location.activity
+        self.project = self.activity.project
+        self.change_request = RequestF.create(
+            activity=self.activity, location_code='LOC',
+            the_geom='POINT(425010 150010)')
+
+        self.user = UserF.create(username='manager')
+        profile = UserProfileF.create(
+            user=self.user, organization=self.project.organization)
+        profile.roles.add(models.UserRole.objects.get(
+            code=models.UserRole.ROLE_MANAGER))
+
+    def test_clicked_location(self):
+        from django.contrib.sessions.backends.cache import SessionStore
+        from django.test.client import RequestFactory
+        from lizard_progress.views.views import get_closest_to
+
+        request = RequestFactory().get('/', {
+            'objType': 'location',
+            'objId': self.location.id,
+            'overlays[]': [self.activity.name]})
+        request.user = self.user
+        request.session = SessionStore()
+
+        response = get_closest_to(request, project_slug=self.project.slug)
+        self.assertEqual(200, response.status_code)
+        content = json.loads(response.content)
+        self.assertEqual(
+            content['objIds'], [self.location.id, self.change_request.id])
+        self.assertEqual(len(content['latlng']), 2)
+
+
+class TestChunkedUploadView(FixturesTestCase):
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.test.utils import override_settings
+        from lizard_progress.tests.test_models import ActivityF
+
+        buildout_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, buildout_dir)
+        settings = override_settings(BUILDOUT_DIR=buildout_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.activity = ActivityF.create()
+        self.client = ClientFactory.create(
+            role=models.UserRole.ROLE_UPLOADER,
+            organization=self.activity.contractor)
+
+    def test_first_offset_chunk_doesnt_complete(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        response = self.client.post(
+            reverse('lizard_progress_uploadreportsview', kwargs={
+                'project_slug': self.activity.project.slug,
+                'activity_id': self.activity.id}), {
+                'file': SimpleUploadedFile('report.pdf', b'hello '),
+                'upload_id': 'abc123',
+                'offset': '0',
+                'size': '11'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(json.loads(response.content), {'received': 6})
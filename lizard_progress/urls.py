@@ -25,6 +25,8 @@ from lizard_progress.views import DownloadHomeView
 from lizard_progress.views import DownloadView
 from lizard_progress.views import DownloadDocumentsView
 from lizard_progress.views import DownloadOrganizationDocumentView
+from lizard_progress.views import InlineMapGeoJsonView
+from lizard_progress.views import InlineMapTileView
 from lizard_progress.views import InlineMapViewNew
 from lizard_progress.views import ProjectsView
 from lizard_progress.views import UploadDialogView
@@ -107,6 +109,9 @@ activity_urls = [
     url('files/$',
         login_required(views.activity.UploadedFilesView.as_view()),
         name='lizard_progress_uploaded_files_api'),
+    url('batches/$',
+        login_required(views.activity.UploadBatchesView.as_view()),
+        name='lizard_progress_upload_batches_api'),
     # CSV file generation
     url('dashboardcsv/$', login_required(DashboardCsvView.as_view()),
         name='lizard_progress_dashboardcsvview'),
@@ -125,6 +130,14 @@ project_urls = [
     url('^map_new/$', login_required(InlineMapViewNew.as_view()),
         name='lizard_progress_inlinemapview_new'),
 
+    url('^map_new/geojson/$', login_required(InlineMapGeoJsonView.as_view()),
+        name='lizard_progress_map_geojson'),
+
+    url(r'^map_new/tiles/(?P<activity_id>\d+)/(?P<z>\d+)/(?P<x>\d+)/'
+        r'(?P<y>\d+)\.pbf$',
+        login_required(InlineMapTileView.as_view()),
+        name='lizard_progress_map_tile'),
+
     url('^map_new/.*get_closest_to.*$', login_required(views.get_closest_to),
         name='lizard_progress_get_closest_to'),
 
@@ -203,6 +216,9 @@ reviewproject_urls = [
         name='lizard_progress_reviewproject'),
 
     # Upload new reviews
+    url(r'^update/$',
+        login_required(views.UpdateReviewProjectReviewsView.as_view()),
+        name='lizard_progress_update_reviews'),
 
     # Apply filter
 
@@ -36,6 +36,10 @@ An action consists in putting an extra element into the observation
 with the tag <Trigger> and the action code ('Waarschuwing' or 'Ingrijp')
 as content.
 
+Testing observations one by one against every rule is slow for large
+review projects, so a FilterTable compiles its rules into a
+CompiledRules object (see there) that gives the same results.
+
 """
 
 import re
@@ -338,14 +342,32 @@ class Rule(object):
 class FilterTable(object):
     """Implements a set of filter rules."""
 
-    def __init__(self, rules=[]):
-        self.rules = rules
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else []
+        self._compiled = None
 
     def add_rule(self, rule):
         if rule.is_valid():
             self.rules.append(rule)
+            self._compiled = None
+
+    @property
+    def compiled(self):
+        if self._compiled is None:
+            self._compiled = CompiledRules(self.rules)
+        return self._compiled
 
     def test_observation(self, observation):
+        return self.compiled.classify_observation(observation)
+
+    def test_observations(self, observations):
+        """Test a list of observations given as dicts of tag: raw
+        content, like the ZC dicts of a review project."""
+        return self.compiled.classify_dicts(observations)
+
+    def test_observation_linear(self, observation):
+        """Test the observation against each rule in turn. This is what
+        the compiled rules do faster; kept as the reference for them."""
         res = 'NORULE'
         for r in self.rules:
             curr = r.test_observation(observation)
@@ -422,6 +444,7 @@ class FilterTable(object):
             flds.append(Field(str(row[trf_pos])))
             rule = Rule(ObservationMask(flds), warn=r[-2], intervene=r[-1])
             self.rules.append(rule)
+        self._compiled = None
 
     def __str__(self):
         rs = ''
@@ -432,6 +455,232 @@ class FilterTable(object):
         return rs
 
 
+# Marks an element that an observation doesn't have, in column arrays
+MISSING = object()
+
+_OPERATORS = {'<': operator.lt,
+              '<=': operator.le,
+              '==': operator.eq,
+              '=': operator.eq,
+              '>=': operator.ge,
+              '>': operator.gt,
+              None: operator.eq,
+              'or': operator.or_,
+              'in': operator.contains}
+
+
+def _compile_eval(op, thr):
+    """Return a function of one value that gives the same result as
+    _eval(value, op, thr), with the threshold converted only once."""
+    if op not in _OPERATORS:
+        def evaluate(val):
+            # _eval fails on this too, but only when it is used
+            raise KeyError(op)
+        return evaluate
+
+    compare = _OPERATORS[op]
+    try:
+        float_thr = float(thr)
+    except (ValueError, TypeError):
+        float_thr = thr
+
+    def evaluate(val):
+        # Like _eval: the threshold is only converted if the value is
+        try:
+            val = float(val)
+            right = float_thr
+        except (ValueError, TypeError):
+            right = thr
+
+        try:
+            if op == 'in':
+                return bool(compare(right, val))
+            return bool(compare(val, right))
+        except TypeError:
+            return False
+
+    return evaluate
+
+
+class CompiledRule(object):
+    """A rule, with its mask turned into conditions on the contents of
+    an observation (a dict of tag: parsed content) and its thresholds
+    into functions."""
+
+    def __init__(self, rule):
+        trigger_field = rule.mask.get_trigger_field()
+        self.trigger_tag = trigger_field.tag
+
+        # Each condition is (tag, set of contents), or (tag, None) if any
+        # content will do.
+        self.conditions = []
+        for field in rule.mask.fields:
+            if field.is_trigger() or field.is_empty():
+                continue
+            if field.content == '*':
+                values = None
+            elif isinstance(field.content, list):
+                values = frozenset(field.content)
+            else:
+                values = frozenset([field.content])
+            self.conditions.append((field.tag, values))
+
+        self.intervene = _compile_eval(
+            rule.interveneOperator, rule.interveneThreshold)
+        self.warn = _compile_eval(rule.warnOperator, rule.warnThreshold)
+
+    def applies_to(self, contents):
+        if self.trigger_tag not in contents:
+            return False
+
+        for tag, values in self.conditions:
+            if values is None:
+                continue
+            content = contents.get(tag, MISSING)
+            # Like ObservationMask.applies_to, an observation without the
+            # tag and a '*' content match any mask field.
+            if content is MISSING or content == '*':
+                continue
+            if isinstance(content, list):
+                if values.isdisjoint(content):
+                    return False
+            elif content not in values:
+                return False
+        return True
+
+    def test(self, contents):
+        if not self.applies_to(contents):
+            return 'NORULE'
+
+        val = contents[self.trigger_tag]
+        if self.intervene(val):
+            return 'INTERVENE'
+        if self.warn(val):
+            return 'WARN'
+        return 'NOACTION'
+
+
+class CompiledRules(object):
+    """The valid rules of a filter table, indexed by the main code
+    (tag A) of their masks.
+
+    An observation is only tested against the rules for its main code
+    and the rules that don't depend on it, in their original order, so
+    the result is the same as testing it against all rules. Contents are
+    parsed once per distinct raw value."""
+
+    INDEX_TAG = 'A'
+
+    def __init__(self, rules):
+        self.rules = []
+        self.index = {}
+        self.unindexed = []
+
+        for rule in rules:
+            if not rule.mask.is_valid():
+                # Rule.test_observation returns MASKINVALID, which is
+                # ignored.
+                continue
+            position = len(self.rules)
+            compiled = CompiledRule(rule)
+            self.rules.append(compiled)
+
+            main_codes = [values for tag, values in compiled.conditions
+                          if tag == self.INDEX_TAG and values is not None]
+            if main_codes:
+                for code in main_codes[0]:
+                    self.index.setdefault(code, []).append(position)
+            else:
+                self.unindexed.append(position)
+
+        self._candidates = {}
+        self._parsed = {}
+
+    def candidates(self, contents):
+        """The rules that may apply to an observation, in order."""
+        main_code = contents.get(self.INDEX_TAG, MISSING)
+        if main_code is MISSING or main_code == '*':
+            return self.rules
+
+        key = (tuple(main_code) if isinstance(main_code, list)
+               else main_code)
+        if key not in self._candidates:
+            codes = main_code if isinstance(main_code, list) else [main_code]
+            positions = set(self.unindexed)
+            for code in codes:
+                positions.update(self.index.get(code, ()))
+            self._candidates[key] = [
+                self.rules[position] for position in sorted(positions)]
+        return self._candidates[key]
+
+    def classify(self, contents):
+        """Classify an observation given as a dict of tag: parsed
+        content, like FilterTable.test_observation_linear does."""
+        res = 'NORULE'
+        for rule in self.candidates(contents):
+            curr = rule.test(contents)
+            if curr in ('WARN', 'INTERVENE'):
+                return curr
+            if curr == 'NOACTION':
+                res = curr
+        return res
+
+    def classify_observation(self, observation):
+        """Classify an Observation instance."""
+        contents = {}
+        for field in observation.fields:
+            if field.tag is not None and field.tag not in contents:
+                contents[field.tag] = field.content
+        return self.classify(contents)
+
+    def parse(self, tag, value):
+        """Return the content that Field(tag, value) has, and whether
+        Observation.add_field would add that field. Cached per value."""
+        if not tag:
+            return None, False
+        # With the type, so that e.g. True and 1 are different keys
+        key = (type(value), value)
+        try:
+            return self._parsed[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable value
+            key = None
+
+        content = _parse_content(value)[0]
+        result = (content, bool(content) or content in ['', None])
+        if key is not None:
+            self._parsed[key] = result
+        return result
+
+    def _contents(self, items):
+        contents = {}
+        for tag, value in items:
+            content, valid = self.parse(tag, value)
+            if valid:
+                contents[_parse_tag(tag)['tag']] = content
+        return contents
+
+    def classify_dicts(self, observations):
+        """Classify observations given as dicts of tag: raw content,
+        like the ZC dicts of a review project."""
+        return [self.classify(self._contents(observation.items()))
+                for observation in observations]
+
+    def classify_columns(self, columns):
+        """Classify observations given as columns: a dict of tag: list
+        of raw contents, one per observation, all of the same length.
+        MISSING means an observation doesn't have that element."""
+        tags = list(columns)
+        rows = zip(*[columns[tag] for tag in tags])
+        return [
+            self.classify(self._contents(
+                (tag, value) for tag, value in zip(tags, row)
+                if value is not MISSING))
+            for row in rows]
+
+
 class AutoReviewer(object):
 
     TRIGGER_CODES = Rule.TRIGGER_CODES
@@ -478,6 +727,12 @@ class AutoReviewer(object):
     def test_observation(self, obs):
         return self.filterTable.test_observation(obs)
 
+    def test_observations(self, observations):
+        return self.filterTable.test_observations(observations)
+
+    def test_columns(self, columns):
+        return self.filterTable.compiled.classify_columns(columns)
+
 
 if __name__ == '__main__':
 
@@ -1,5 +1,10 @@
-"""Coordinates and projection constants and helpers"""
+"""Coordinates and projection constants and helpers
+
+Proj objects are made once per process, see projection(). To transform
+many coordinates, pass them all at once to transform_arrays() or
+transform_points(), pyproj transforms NumPy arrays in one call."""
 import logging
+import numpy as np
 from pyproj import Proj, Geod
 from pyproj import transform
 
@@ -21,11 +26,6 @@ GOOGLE = ('+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 '
           '+nadgrids=@null +no_defs +over')
 WGS84 = ('+proj=latlong +datum=WGS84')
 
-rd_projection = Proj(RD)
-google_projection = Proj(GOOGLE)
-wgs84_projection = Proj(WGS84)
-geodesic = Geod('+ellps=sphere')
-
 srs_to_mapnik_projection = {
     'EPSG:28992': RD,
     'EPSG:900913': GOOGLE,
@@ -39,6 +39,31 @@ string_to_srs = {
     'wgs84': 'EPSG:4326',
 }
 
+# Proj objects by Proj4 string, see projection()
+_projections = {}
+
+
+def proj4(name):
+    """Return the Proj4 string of a projection, given as "rd", "google"
+    or "wgs84", as an srs like "EPSG:28992", or as a Proj4 string."""
+    name = string_to_srs.get(name, name)
+    return srs_to_mapnik_projection.get(name, name)
+
+
+def projection(name):
+    """Return a Proj object for a projection (see proj4()). They are
+    made once per process, making one is much slower than using it."""
+    key = proj4(name)
+    if key not in _projections:
+        _projections[key] = Proj(key)
+    return _projections[key]
+
+
+rd_projection = projection(RD)
+google_projection = projection(GOOGLE)
+wgs84_projection = projection(WGS84)
+geodesic = Geod('+ellps=sphere')
+
 string_to_srid = {
     'rd': 28992,
     'google': 900913,
@@ -67,21 +92,41 @@ def transform_point(x, y, from_proj=None, to_proj='google'):
         raise ValueError("Value '%s' of to_proj invalid." % to_proj)
     else:
         to_srid = string_to_srid[to_proj]
-        to_proj = Proj(srs_to_mapnik_projection[string_to_srs[to_proj]])
+        to_proj = projection(to_proj)
 
     if from_proj is None:
         from_proj = Setting.get('projection')
-        from_proj = Proj(srs_to_mapnik_projection[from_proj])
+        from_proj = projection(from_proj)
     elif from_proj not in string_to_srs:
         raise ValueError("Value '%s' of from_proj invalid." % from_proj)
     else:
-        from_proj = Proj(srs_to_mapnik_projection[string_to_srs[from_proj]])
+        from_proj = projection(from_proj)
 
     p = Point(*transform(from_proj, to_proj, x, y))
     p.srid = to_srid
     return p
 
 
+def transform_arrays(x, y, from_proj='rd', to_proj='wgs84'):
+    """Transform arrays of x and y coordinates from from_proj to to_proj
+    (see proj4()) in one call. Returns two NumPy arrays of floats."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    source = projection(from_proj)
+    target = projection(to_proj)
+    if source is target or not x.size:
+        return x.copy(), y.copy()
+    return transform(source, target, x, y)
+
+
+def transform_points(points, from_proj='rd', to_proj='wgs84'):
+    """Transform a sequence of (x, y) points in one call. Returns an
+    array of shape (n, 2)."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    x, y = transform_arrays(points[:, 0], points[:, 1], from_proj, to_proj)
+    return np.column_stack((x, y))
+
+
 def google_to_rd(x, y):
     """Return RD coordinates from GOOGLE coordinates."""
     return transform(google_projection, rd_projection, x, y)
@@ -20,6 +20,10 @@ BASE_DIR = getattr(
     settings,
     'LIZARD_PROGRESS_ROOT',
     os.path.join(settings.BUILDOUT_DIR, 'var', 'lizard_progress'))
+TILE_CACHE_DIR = getattr(
+    settings,
+    'LIZARD_PROGRESS_TILE_CACHE_DIR',
+    os.path.join(settings.BUILDOUT_DIR, 'var', 'tile_cache'))
 FTP_READONLY_DIRNAME = 'ftp_readonly'
 AUTOSYNC_DIRNAME = 'autosync'
 
@@ -161,6 +165,11 @@ def abs_organization_files_dir(organization):
     return mk_abs(os.path.join(organization.name, 'files'))
 
 
+def abs_tile_cache_dir(activity_id):
+    """Directory with the cached map tiles of an activity."""
+    return os.path.join(TILE_CACHE_DIR, str(activity_id))
+
+
 def abs_files_in(abs_dir):
     for f in os.listdir(abs_dir):
         if os.path.isfile(os.path.join(abs_dir, f)):
@@ -176,8 +185,10 @@ def all_abs_files_in(abs_path, extension=None):
 
 
 def human_size(abs_path):
-    size = os.stat(abs_path).st_size
+    return format_size(os.stat(abs_path).st_size)
+
 
+def format_size(size):
     if size < 1000:
         return "{0} bytes".format(size)
 
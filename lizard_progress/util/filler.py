@@ -33,11 +33,25 @@ a string in which case the are checked for equality.
 If an inspection does not contain a branch in the rule-tree or function on the
 branch return nothing, no rules are applicable to this inspection and thus it
 can be skipped.
+
+For large review projects, the same rules can be applied to all inspections at
+once: build_rule_table() turns the rules into a table, observation_table()
+puts the inspections of all pipes in one table (one row per ZC), and
+fill_observations() joins the two on A, B and C and evaluates the conditions
+as vectorized operations. apply_rule_table() does all of that for a reviews
+dict, with the same result as apply_rules().
 """
 
 import itertools
 import csv
 
+import numpy as np
+import pandas as pd
+
+# Herstelmaatregel codes ordered by priority, if several rules apply to an
+# inspection the one with the highest priority wins.
+CODES = ['', 'waarschuwing', 'ingrijp', 'remove']
+
 # lizard_progres.util.tests.test_filler
 
 def parse_insp_filler(inspection_filler,
@@ -134,9 +148,11 @@ def _generate_expr_func(expr):
     if not expr:
         return lambda x: False
     elif expr[0] == '>':
-        return lambda x: _try_convert(x, None, float) and (float(x) > float(expr[1:]))
+        threshold = float(expr[1:])
+        return lambda x: _try_convert(x, None, float) and (float(x) > threshold)
     elif expr[0] == '<':
-        return lambda x: _try_convert(x, None, float) and (float(x) < float(expr[1:]))
+        threshold = float(expr[1:])
+        return lambda x: _try_convert(x, None, float) and (float(x) < threshold)
     else:
         return lambda x: str(x) == str(expr)
 
@@ -234,3 +250,133 @@ def _apply_rule(rule_tree, zc):
         if(zc['Herstelmaatregel'] == 'remove'):
             return None
     return zc
+
+
+def build_rule_table(rules):
+    """Build a table of a list of (flat) rules, to be used by
+    fill_observations().
+
+    Has one row per rule, with columns A, B and C, whether the rule
+    removes the inspection, and the parsed 'ingrijp' and 'waarschuwing'
+    expressions (operator: '>', '<', '=' or '' for none, the expression and
+    its number if it is a condition). Duplicate rules are kept, they are
+    combined when the rules are applied.
+
+    :arg
+        rules (list): flattened rules, see _flatten_rule()"""
+    columns = ['A', 'B', 'C', 'remove',
+               'ingrijp_op', 'ingrijp_value', 'ingrijp_number',
+               'waarschuwing_op', 'waarschuwing_value',
+               'waarschuwing_number']
+    rows = []
+    for rule in rules:
+        assert(len(rule) == 5)
+        waarschuwing = rule[3]
+        ingrijp = rule[4]
+        remove = ingrijp.lower() == 'remove'
+        if remove:
+            ingrijp = waarschuwing = ''
+        rows.append(list(rule[:3]) + [remove] +
+                    list(_parse_expr(ingrijp)) +
+                    list(_parse_expr(waarschuwing)))
+    return pd.DataFrame(rows, columns=columns)
+
+
+def _parse_expr(expr):
+    """Return (operator, expression, number) of an expression, see
+    _generate_expr_func()."""
+    if not expr:
+        return '', '', np.nan
+    elif expr[0] in '><':
+        return expr[0], expr, float(expr[1:])
+    else:
+        return '=', expr, np.nan
+
+
+def observation_table(reviews):
+    """Put the inspections (ZC) of all pipes in reviews in one table, with
+    columns pipe (index of the pipe), A, B, C, D and Herstelmaatregel. Rows
+    are in the order of the pipes and their inspections."""
+    columns = ['pipe', 'A', 'B', 'C', 'D', 'Herstelmaatregel']
+    data = dict((column, []) for column in columns)
+    for index, pipe in enumerate(reviews['pipes']):
+        for zc in pipe['ZC']:
+            data['pipe'].append(index)
+            data['A'].append(zc.get('A', ''))
+            data['B'].append(zc.get('B', ''))
+            data['C'].append(zc.get('C', ''))
+            data['D'].append(zc.get('D', ''))
+            data['Herstelmaatregel'].append(zc['Herstelmaatregel'])
+    return pd.DataFrame(data, columns=columns)
+
+
+def _matches(op, value, number, kwant, numeric):
+    """Vectorized version of the functions of _generate_expr_func()."""
+    # As in _generate_expr_func(), a kwantiteit that isn't a number (or
+    # is 0) never meets a condition
+    is_number = numeric.notnull().values & (numeric.values != 0)
+    greater = (op == '>') & is_number & (numeric.values > number)
+    smaller = (op == '<') & is_number & (numeric.values < number)
+    equal = (op == '=') & (kwant == value)
+    return greater | smaller | equal
+
+
+def fill_observations(rule_table, observations):
+    """Apply the rules in rule_table (see build_rule_table()) to a table
+    of observations (see observation_table()) at once.
+
+    Observations that already have a Herstelmaatregel are ignored.
+
+    :return
+        a tuple of the new Herstelmaatregel column and a boolean mask of
+        the observations that should be removed, both Series with the
+        index of observations.
+    """
+    herstelmaatregel = observations['Herstelmaatregel'].copy()
+
+    empty = observations[herstelmaatregel == '']
+    merged = empty[['A', 'B', 'C', 'D']].reset_index().merge(
+        rule_table, on=['A', 'B', 'C'], how='inner')
+
+    if len(merged):
+        kwant = merged['D'].values
+        numeric = pd.to_numeric(merged['D'], errors='coerce')
+
+        ingrijp = _matches(
+            merged['ingrijp_op'].values, merged['ingrijp_value'].values,
+            merged['ingrijp_number'].values, kwant, numeric)
+        waarschuwing = _matches(
+            merged['waarschuwing_op'].values,
+            merged['waarschuwing_value'].values,
+            merged['waarschuwing_number'].values, kwant, numeric)
+
+        priority = np.where(
+            merged['remove'].values, 3,
+            np.where(ingrijp, 2, np.where(waarschuwing, 1, 0)))
+
+        # Combine the rules that apply to the same observation
+        best = pd.Series(priority).groupby(merged['index'].values).max()
+        herstelmaatregel.loc[best.index] = np.array(CODES, dtype=object)[
+            best.values]
+
+    return herstelmaatregel, herstelmaatregel == 'remove'
+
+
+def apply_rule_table(rule_table, reviews):
+    """Apply the rules in rule_table (see build_rule_table()) to the
+    reviews, like apply_rules() does with a rule tree."""
+    observations = observation_table(reviews)
+    herstelmaatregel, remove = fill_observations(rule_table, observations)
+    herstelmaatregel = herstelmaatregel.values
+    remove = remove.values
+
+    row = 0
+    for pipe in reviews['pipes']:
+        filled_zcs = []
+        for zc in pipe['ZC']:
+            if not remove[row]:
+                zc['Herstelmaatregel'] = herstelmaatregel[row]
+                filled_zcs.append(zc)
+            row += 1
+        pipe['ZC'] = filled_zcs
+    return reviews
@@ -26,11 +26,8 @@ def rd_to_wgs84_extent(rd_extent, extra_border=0.1):
     breadth is added on all sides (so it's a 20% total increase per
     side).
     """
-    _topleft = rd_extent[0:2]
-    _bottomright = rd_extent[2:4]
-
-    topleft = coordinates.rd_to_wgs84(*_topleft)
-    bottomright = coordinates.rd_to_wgs84(*_bottomright)
+    topleft, bottomright = coordinates.transform_points(
+        rd_extent, 'rd', 'wgs84').tolist()
 
     # To make sure we zoom in "correctly", with everything in view,
     # we now increase this extent some arbitrary percentage...
@@ -58,11 +55,8 @@ def rd_to_google_extent(rd_extent, extra_border=0.1):
 
     """
 
-    topleft = rd_extent[0:2]
-    bottomright = rd_extent[2:4]
-
-    google_topleft = coordinates.rd_to_google(*topleft)
-    google_bottomright = coordinates.rd_to_google(*bottomright)
+    google_topleft, google_bottomright = coordinates.transform_points(
+        rd_extent, 'rd', 'google').tolist()
 
     # To make sure we zoom in "correctly", with everything in view,
     # we now increase this extent some arbitrary percentage...
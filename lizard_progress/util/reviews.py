@@ -0,0 +1,114 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Helpers to store the reviews of a review project as rows.
+
+The reviews of a review project used to be one JSON document with lists
+of pipes and manholes, each with their observations (ZC). They are now
+stored as a ReviewInspection row per pipe or manhole and a
+ReviewObservation row per observation. These functions split the dicts
+of that document into the columns of those rows and join them again;
+they don't use the models, so that migrations can use them too."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import geojson
+
+from lizard_progress.util import coordinates
+
+PIPE = 'pipe'
+MANHOLE = 'manhole'
+
+# Kinds of inspections and their key in the reviews document
+KINDS = ((PIPE, 'pipes'), (MANHOLE, 'manholes'))
+
+HERSTELMAATREGEL = 'Herstelmaatregel'
+OPMERKING = 'Opmerking'
+
+# Keys that are stored in columns of their own, not in data
+COLUMN_KEYS = ('ZC', 'id', 'version', HERSTELMAATREGEL, OPMERKING)
+
+
+def split(item):
+    """Return (data, herstelmaatregel, opmerking) of a pipe, manhole or
+    observation dict. Data is the dict without its review fields, ids
+    and observations."""
+    data = dict((key, value) for key, value in item.items()
+                if key not in COLUMN_KEYS)
+    return (data,
+            item.get(HERSTELMAATREGEL) or '',
+            item.get(OPMERKING) or '')
+
+
+def join(data, herstelmaatregel, opmerking, **extra):
+    """Inverse of split(), extra keys (id, version, ZC) are added."""
+    item = dict(data)
+    item[HERSTELMAATREGEL] = herstelmaatregel
+    item[OPMERKING] = opmerking
+    item.update(extra)
+    return item
+
+
+def completion(kind, herstelmaatregel, observations):
+    """Percentage of an inspection that has been reviewed. A manhole has
+    only its own review, a pipe is the percentage of its observations
+    that have one. observations is a list of their herstelmaatregels."""
+    if kind == MANHOLE:
+        return 100 if herstelmaatregel else 0
+    if not observations:
+        return 0
+    return sum(100 for value in observations if value) / len(observations)
+
+
+# Keys of the RD coordinates of manholes and pipes
+COORDINATE_KEYS = {
+    MANHOLE: (('x', 'y'),),
+    PIPE: (('Beginpunt x', 'Beginpunt y'), ('Eindpunt x', 'Eindpunt y')),
+}
+
+
+def _rd_coordinates(kind, data):
+    """List of (x, y) points of a pipe or manhole, or None if its
+    coordinates are missing."""
+    try:
+        return [(float(data[x_key]), float(data[y_key]))
+                for x_key, y_key in COORDINATE_KEYS[kind]]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def geometries(kind, datas):
+    """GeoJSON geometries (in WGS84) of a list of pipes or manholes of
+    the same kind, as strings, or None for those whose coordinates are
+    missing. All coordinates are transformed in one call."""
+    points = [_rd_coordinates(kind, data) for data in datas]
+    present = [item_points for item_points in points if item_points]
+    if not present:
+        return [None] * len(points)
+
+    transformed = iter(coordinates.transform_points(
+        [point for item_points in present for point in item_points],
+        'rd', 'wgs84').tolist())
+
+    result = []
+    for item_points in points:
+        if not item_points:
+            result.append(None)
+            continue
+        wgs84 = [next(transformed) for point in item_points]
+        if kind == MANHOLE:
+            geom = geojson.Point(wgs84[0])
+        else:
+            geom = geojson.LineString(wgs84)
+        result.append(geojson.dumps(geom, sort_keys=True))
+    return result
+
+
+def geometry(kind, data):
+    """GeoJSON geometry (in WGS84) of a pipe or manhole, as a string, or
+    None if its coordinates are missing."""
+    return geometries(kind, [data])[0]
@@ -35,6 +35,7 @@ HCTag,Hoofdcode,Kar 1 Tag,Kar 1 val,Kar 2 Tag,Kar 2 val,Kwant 1,Plaats omtrek,Wa
 """
 
 from lizard_progress.util.autoreviewer import AutoReviewer
+from lizard_progress.util.autoreviewer import MISSING
 from lizard_progress.util.autoreviewer import Observation
 from lizard_progress.util.autoreviewer import Field
 from lizard_progress.models import ReviewProject
@@ -44,6 +45,7 @@ from lizard_progress.tests.base import FixturesTestCase
 
 import os
 import factory
+import random
 
 import logging
 logger = logging.getLogger(__name__)
@@ -57,7 +59,6 @@ class ReviewProjectF(factory.DjangoModelFactory):
     slug = factory.Sequence(lambda n: 'testreviewproject%d' % n)
     organization = factory.SubFactory(OrganizationF)
     contractor = None
-    reviews = None
     inspection_filler = None
 
 
@@ -94,6 +95,73 @@ class TestAutoReviewerFromFile(FixturesTestCase):
             self.assertEquals(res, expected)
 
 
+class TestCompiledRules(FixturesTestCase):
+    """The compiled rules should give the same results as testing each
+    rule in turn, for the default rules and those from a file."""
+
+    MAIN_CODES = ['BAA', 'BAB', 'BAC', 'BAF', 'BAG', 'BAI', 'BAJ', 'BAO',
+                  'BBB', 'BBF', 'BZF']
+    CONTENTS = ['A', 'B', 'C', 'D', 'E', 'I', 'Z', '0', '1', '5', '6', '10',
+                '11', '25', '26', 'B, C', '*', None, '']
+    TAGS = ['A', 'B', 'C', 'D', 'G', 'R']
+
+    def setUp(self):
+        filterfile = os.path.join('lizard_progress',
+                                  'util',
+                                  'tests',
+                                  'test_autoreviewer_files',
+                                  'filter_complete_valid.xlsx')
+        self.reviewers = [AutoReviewer(), AutoReviewer(filterfile)]
+
+        # Random observations, where each element may be missing
+        rnd = random.Random(42)
+        self.observations = []
+        for i in range(2000):
+            self.observations.append(dict(
+                (tag, rnd.choice(
+                    self.MAIN_CODES if tag == 'A' else self.CONTENTS))
+                for tag in self.TAGS if rnd.random() < 0.7))
+
+    def linear_results(self, ar):
+        results = []
+        for zc in self.observations:
+            obs = Observation()
+            for k in zc.keys():
+                obs.add_field(Field(k, zc.get(k)))
+            results.append(ar.filterTable.test_observation_linear(obs))
+        return results
+
+    def test_all_outcomes_occur(self):
+        self.assertEquals(
+            sorted(set(self.linear_results(self.reviewers[0]))),
+            ['INTERVENE', 'NOACTION', 'NORULE', 'WARN'])
+
+    def test_observations_give_same_results(self):
+        for ar in self.reviewers:
+            expected = self.linear_results(ar)
+            self.assertEquals(
+                ar.test_observations(self.observations), expected)
+
+    def test_columns_give_same_results(self):
+        for ar in self.reviewers:
+            columns = dict(
+                (tag, [zc.get(tag, MISSING) for zc in self.observations])
+                for tag in self.TAGS)
+            self.assertEquals(
+                ar.test_columns(columns), self.linear_results(ar))
+
+    def test_observation_instances_give_same_results(self):
+        ar = self.reviewers[0]
+        obs = Observation([Field('A', 'BAO'), Field('R', '0'), Field('G', '0')])
+        self.assertEquals(ar.test_observation(obs), 'INTERVENE')
+        self.assertEquals(
+            ar.filterTable.test_observation_linear(obs), 'INTERVENE')
+
+    def test_reviewers_dont_share_rules(self):
+        self.assertEquals(self.reviewers[0].count_rules(), 19)
+        self.assertEquals(self.reviewers[1].count_rules(), 20)
+
+
 class TestAutoReviewerRIBX(FixturesTestCase):
     def setUp(self):
         self.filterfile = os.path.join('lizard_progress',
@@ -126,9 +194,9 @@ class TestAutoReviewerRIBX(FixturesTestCase):
 
         pr = ReviewProject.objects.get(pk=pr.pk)  # Refresh
 
-        self.assertIsNotNone(pr.reviews)
+        reviews = pr.get_reviews()
 
-        rev_pipes = pr.reviews['pipes']
+        rev_pipes = reviews['pipes']
 
         for pipe in rev_pipes:
 
@@ -0,0 +1,60 @@
+"""Tests for util/coordinates.py"""
+
+from __future__ import unicode_literals, division
+from __future__ import print_function, absolute_import
+
+from django.test import TestCase
+
+import geojson
+import json
+import numpy as np
+
+from lizard_progress.util import coordinates
+from lizard_progress.util import reviews
+
+
+class TestProjection(TestCase):
+    def test_projections_are_cached(self):
+        self.assertIs(coordinates.projection('rd'),
+                      coordinates.projection('EPSG:28992'))
+        self.assertIs(coordinates.projection('rd'),
+                      coordinates.rd_projection)
+
+
+class TestTransformPoints(TestCase):
+    def test_same_as_one_by_one(self):
+        points = [(155000, 463000), (142739.23, 486443.21),
+                  (147779.16, 491974.99)]
+        result = coordinates.transform_points(points, 'rd', 'wgs84')
+        self.assertEquals(result.shape, (3, 2))
+        for point, transformed in zip(points, result):
+            self.assertTrue(np.allclose(
+                transformed, coordinates.rd_to_wgs84(*point)))
+
+    def test_arrays(self):
+        x, y = coordinates.transform_arrays(
+            np.array([155000.0] * 1000), np.array([463000.0] * 1000),
+            'rd', 'google')
+        self.assertEquals(len(x), 1000)
+        self.assertTrue(np.allclose(
+            (x[-1], y[-1]), coordinates.rd_to_google(155000, 463000)))
+
+    def test_empty(self):
+        self.assertEquals(
+            coordinates.transform_points([], 'rd', 'wgs84').shape, (0, 2))
+
+
+class TestReviewGeometries(TestCase):
+    def test_geometries(self):
+        pipe = {'Beginpunt x': '142739.23', 'Beginpunt y': '486443.21',
+                'Eindpunt x': '142776.84', 'Eindpunt y': '486430.19'}
+        result = reviews.geometries(reviews.PIPE, [pipe, {}, pipe])
+        self.assertIsNone(result[1])
+        self.assertEquals(result[0], result[2])
+
+        line = json.loads(result[0])
+        self.assertEquals(line['type'], 'LineString')
+        self.assertTrue(np.allclose(
+            line['coordinates'][1],
+            coordinates.rd_to_wgs84(142776.84, 486430.19)))
+        self.assertTrue(geojson.loads(result[0]).is_valid)
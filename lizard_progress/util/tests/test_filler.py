@@ -12,9 +12,15 @@ from lizard_progress.util.filler import parse_insp_filler
 from lizard_progress.util.filler import build_rule_tree
 from lizard_progress.util.filler import _apply_rule
 from lizard_progress.util.filler import apply_rules
+from lizard_progress.util.filler import build_rule_table
+from lizard_progress.util.filler import observation_table
+from lizard_progress.util.filler import fill_observations
+from lizard_progress.util.filler import apply_rule_table
 
+import copy
 import json
 import os
+import random
 
 # lizard_progress.util.tests.test_filler
 
@@ -545,3 +551,66 @@ class TestApplyFiller(FixturesTestCase):
         reviews = json.loads(reviews)
         result = apply_rules(self.rule_tree_complex2, reviews)
         self.assertEquals(len(result['pipes'][0]['ZC']), 0)
+
+
+class TestRuleTable(FixturesTestCase):
+
+    def setUp(self):
+        self.filler_files = os.path.join('lizard_progress',
+                                         'util',
+                                         'tests',
+                                         'test_filler_files',
+                                         'fillers')
+
+    def rules(self, filename):
+        with open(os.path.join(self.filler_files, filename)) as filler:
+            return parse_insp_filler(filler)
+
+    def test_build_rule_table(self):
+        rule_table = build_rule_table(self.rules('complex_filler2.csv'))
+        self.assertEquals(len(rule_table), 3)
+        self.assertEquals(list(rule_table['remove']), [True, False, True])
+        self.assertEquals(rule_table['ingrijp_op'][1], '>')
+        self.assertEquals(rule_table['ingrijp_number'][1], 4.0)
+
+    def test_fill_observations(self):
+        rule_table = build_rule_table(self.rules('filler_with_remove.csv'))
+        observations = observation_table({'pipes': [
+            {'ZC': [{'A': 'c', 'B': 'd', 'C': 'c', 'D': '4',
+                     'Herstelmaatregel': ''},
+                    {'A': 'c', 'B': 'd', 'C': 'e', 'D': '4',
+                     'Herstelmaatregel': ''}]},
+            {'ZC': [{'A': 'd', 'Herstelmaatregel': ''},
+                    {'A': 'c', 'B': 'd', 'C': 'c', 'D': '5',
+                     'Herstelmaatregel': 'aaa'}]}]})
+
+        herstelmaatregel, remove = fill_observations(
+            rule_table, observations)
+        self.assertEquals(list(observations['pipe']), [0, 0, 1, 1])
+        self.assertEquals(list(herstelmaatregel),
+                          ['waarschuwing', 'remove', '', 'aaa'])
+        self.assertEquals(list(remove), [False, True, False, False])
+
+    def test_same_result_as_rule_tree(self):
+        values = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'c2', '',
+                  '0', '3', '-2', '4.4', '10.00', '-0.4']
+        rnd = random.Random(42)
+        reviews = {'manholes': [], 'pipes': []}
+        for i in range(200):
+            zcs = []
+            for j in range(rnd.randint(0, 5)):
+                zc = {'Herstelmaatregel': rnd.choice(['', '', 'aaa'])}
+                for key in 'ABCD':
+                    if rnd.random() < 0.9:
+                        zc[key] = rnd.choice(values)
+                zcs.append(zc)
+            reviews['pipes'].append({'ZC': zcs})
+
+        for filename in ['simple_filler.csv', 'complex_filler.csv',
+                         'complex_filler2.csv', 'filler_with_remove.csv',
+                         'unflattenned_filler.csv']:
+            rules = self.rules(filename)
+            self.assertEquals(
+                apply_rule_table(build_rule_table(rules),
+                                 copy.deepcopy(reviews)),
+                apply_rules(build_rule_tree(rules), copy.deepcopy(reviews)))
@@ -0,0 +1,72 @@
+"""Tests for util/uploads.py"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from lizard_progress.util import uploads
+
+
+class TestChunkedUpload(TestCase):
+    def setUp(self):
+        self.buildout_dir = tempfile.mkdtemp()
+        self.settings = override_settings(BUILDOUT_DIR=self.buildout_dir)
+        self.settings.enable()
+        self.upload = uploads.ChunkedUpload('p1a2b3', '1-2')
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.buildout_dir)
+
+    def test_chunks_are_assembled(self):
+        self.upload.write_chunk([b'hello '], 0)
+        self.upload.write_chunk([b'world'], 6)
+
+        path = self.upload.complete('test.txt', size=11)
+        self.assertEquals(open(path, 'rb').read(), b'hello world')
+        self.assertEquals(self.upload.received, 0)
+
+    def test_chunk_can_be_sent_again(self):
+        self.upload.write_chunk([b'hello '], 0)
+        self.upload.write_chunk([b'hello '], 0)
+
+        self.assertEquals(self.upload.received, 6)
+
+    def test_gap_is_refused(self):
+        self.upload.write_chunk([b'hello '], 0)
+
+        try:
+            self.upload.write_chunk([b'world'], 10)
+            self.fail("No OffsetMismatch raised")
+        except uploads.OffsetMismatch as e:
+            self.assertEquals(e.received, 6)
+
+    def test_size_and_checksum_are_checked(self):
+        self.upload.write_chunk([b'hello'], 0)
+
+        self.assertRaises(
+            uploads.UploadError, self.upload.complete, 'test.txt', size=11)
+        self.assertRaises(
+            uploads.UploadError, self.upload.complete, 'test.txt',
+            md5=hashlib.md5(b'world').hexdigest())
+
+    def test_invalid_upload_id(self):
+        self.assertRaises(
+            uploads.UploadError, uploads.ChunkedUpload, '../etc', '1-2')
+
+    def test_abandoned_uploads_are_removed(self):
+        self.upload.write_chunk([b'hello'], 0)
+        current = uploads.ChunkedUpload('current', '1-2')
+        current.write_chunk([b'hello'], 0)
+
+        old = time.time() - 3 * 24 * 60 * 60
+        os.utime(self.upload.staging_path, (old, old))
+
+        self.assertEquals(uploads.remove_abandoned(), 1)
+        self.assertEquals(self.upload.received, 0)
+        self.assertEquals(current.received, 5)
@@ -0,0 +1,158 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Resumable, chunked uploads.
+
+A client picks an upload id for a file and sends it in chunks. Each
+chunk says at which byte offset it starts, and is written into one
+staging file at that offset. The client can ask how many bytes were
+received, to resume an interrupted upload from there. When the last
+chunk is in, the size (and optionally an MD5 checksum) is checked and
+the staging file is renamed to its final place, without copying it.
+Staging files of uploads that are abandoned are removed after a while
+by remove_abandoned(), see tasks.remove_abandoned_uploads_task.
+"""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import fcntl
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+
+UPLOAD_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def uploads_dir():
+    """Directory where uploaded files are put before processing."""
+    return os.path.join(
+        settings.BUILDOUT_DIR, 'var', 'lizard_progress', 'uploaded_files')
+
+
+def partial_dir():
+    """Directory with the staging files of uploads in progress."""
+    return os.path.join(uploads_dir(), 'partial')
+
+
+def partial_upload_max_age():
+    """Seconds after which an upload that isn't written to anymore is
+    considered abandoned."""
+    return getattr(
+        settings, 'LIZARD_PROGRESS_PARTIAL_UPLOAD_MAX_AGE', 2 * 24 * 60 * 60)
+
+
+def remove_abandoned(max_age=None):
+    """Remove the staging files that weren't written to for max_age
+    seconds. Returns the number of removed files."""
+    if max_age is None:
+        max_age = partial_upload_max_age()
+    directory = partial_dir()
+    if not os.path.isdir(directory):
+        return 0
+
+    removed = 0
+    oldest = time.time() - max_age
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            # Completed or removed in the meantime
+            pass
+    return removed
+
+
+class UploadError(ValueError):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """A chunk doesn't start at or before the end of what we have."""
+    def __init__(self, received):
+        self.received = received
+        super(OffsetMismatch, self).__init__(
+            "Chunk doesn't connect, {} bytes received so far.".format(
+                received))
+
+
+class ChunkedUpload(object):
+    """The staging file of an upload. Upload ids are chosen by clients,
+    so owner (for instance activity and user ids) is part of the staging
+    file's name, so that nobody can write into someone else's upload."""
+
+    def __init__(self, upload_id, owner):
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            raise UploadError("Invalid upload id.")
+        self.staging_path = os.path.join(
+            partial_dir(), '{}-{}.part'.format(owner, upload_id))
+
+    @property
+    def received(self):
+        """Number of bytes received so far."""
+        try:
+            return os.path.getsize(self.staging_path)
+        except OSError:
+            return 0
+
+    def write_chunk(self, chunks, offset):
+        """Write the byte strings in chunks starting at offset. Offset
+        may be lower than what we have (a chunk is sent again), but not
+        higher. Return the number of bytes received so far."""
+        dirname = os.path.dirname(self.staging_path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # Create the file if it isn't there, without truncating it. Append
+        # mode doesn't allow seeking, so the chunk is written in 'r+b'.
+        open(self.staging_path, 'ab').close()
+        with open(self.staging_path, 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0, os.SEEK_END)
+            if offset > f.tell():
+                raise OffsetMismatch(f.tell())
+            f.seek(offset)
+            f.truncate()
+            for chunk in chunks:
+                f.write(chunk)
+            return f.tell()
+
+    def complete(self, filename, size=None, md5=None):
+        """Check the staging file and move it into a new directory under
+        uploads_dir() as filename. Return its new path."""
+        received = self.received
+        if size is not None and received != size:
+            raise UploadError(
+                "Expected {} bytes, received {}.".format(size, received))
+        if (md5 is not None and
+                file_digest(self.staging_path, 'md5') != md5.lower()):
+            self.abort()
+            raise UploadError("Checksum of the uploaded file is wrong.")
+
+        # Create a temp dir in which our file definitely doesn't exist yet
+        tmpdir = tempfile.mkdtemp(dir=uploads_dir())
+        path = os.path.join(tmpdir, os.path.basename(filename))
+        os.rename(self.staging_path, path)
+        return path
+
+    def abort(self):
+        if os.path.exists(self.staging_path):
+            os.remove(self.staging_path)
+
+
+def file_digest(path, algorithm='sha256', blocksize=1024 * 1024):
+    """Return the hex digest of the file at path, read block by block."""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,79 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Versions of cached data (models.CacheVersion).
+
+Map layers (mapdata.py), permissions (access.py) and change request
+counts (changerequests/stats.py) are cached with a version in their
+key, and signals renew the version when the data changes. The cache
+may be local to each process (e.g. LocMemCache), so the versions are
+kept in the database, where every process sees a renewed version."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import time
+
+from django.db import IntegrityError
+from django.db import transaction
+
+
+def get_many(keys):
+    """Return a dictionary of key -> version, with one query. Keys that
+    don't have a version yet get one."""
+    # Need to import here to prevent circular imports
+    from lizard_progress.models import CacheVersion
+
+    keys = set(keys)
+    if not keys:
+        return {}
+
+    current = dict(CacheVersion.objects.filter(
+        key__in=keys).values_list('key', 'version'))
+    missing = keys - set(current)
+    if missing:
+        now = time.time()
+        try:
+            with transaction.atomic():
+                CacheVersion.objects.bulk_create([
+                    CacheVersion(key=key, version=now) for key in missing])
+            current.update((key, now) for key in missing)
+        except IntegrityError:
+            # Created by another process in the meantime
+            current.update(CacheVersion.objects.filter(
+                key__in=missing).values_list('key', 'version'))
+    return current
+
+
+def get(key):
+    return get_many([key])[key]
+
+
+def renew(keys):
+    """Give these keys a new version, so that data cached with the old
+    one isn't used anymore."""
+    # Need to import here to prevent circular imports
+    from lizard_progress.models import CacheVersion
+
+    keys = set(key for key in keys if key is not None)
+    if not keys:
+        return
+
+    now = time.time()
+    if CacheVersion.objects.filter(key__in=keys).update(
+            version=now) == len(keys):
+        return
+
+    missing = keys - set(CacheVersion.objects.filter(
+        key__in=keys).values_list('key', flat=True))
+    try:
+        with transaction.atomic():
+            CacheVersion.objects.bulk_create([
+                CacheVersion(key=key, version=now) for key in missing])
+    except IntegrityError:
+        # Created by another process in the meantime, that version is
+        # new as well
+        pass
@@ -24,6 +24,7 @@ from django.http import HttpResponse
 from django.http import HttpResponseForbidden
 from django.http import HttpResponseRedirect
 from django.core.urlresolvers import reverse
+from django.db.models import Q
 
 import osgeo.ogr
 
@@ -36,7 +37,10 @@ from lizard_progress.views.views import ProjectsMixin
 from lizard_progress.views.views import UiView
 
 from lizard_progress import configuration
+from lizard_progress import counters
+from lizard_progress import file_catalog
 from lizard_progress import forms
+from lizard_progress import mapdata
 from lizard_progress import models
 from lizard_progress.util import dates
 from lizard_progress.util import geo
@@ -236,6 +240,20 @@ class UploadedFilesView(UploadHomeView):
             content_type="application/json")
 
 
+class UploadBatchesView(UploadHomeView):
+    """Return the progress of this activity's unfinished upload batches,
+    and those finished in the last day, as a JSON array."""
+    def get(self, request, *args, **kwargs):
+        since = datetime.datetime.now() - datetime.timedelta(days=1)
+        return HttpResponse(
+            json.dumps([
+                batch.as_dict()
+                for batch in models.UploadBatch.objects.filter(
+                    Q(finished_at__isnull=True) | Q(finished_at__gte=since),
+                    activity=self.activity).select_related('uploaded_by')]),
+            content_type="application/json")
+
+
 class PlanningView(ActivityView):
     template_name = 'lizard_progress/planning.html'
     active_menu = 'planning'
@@ -322,6 +340,8 @@ class PlanningView(ActivityView):
         ]
 
         models.Location.objects.bulk_create(new_locations)
+        counters.recount([activity.id])
+        mapdata.forget_activity(activity.id)
 
         # Move RIBX file to project files
         newribxpath = os.path.join(
@@ -331,6 +351,8 @@ class PlanningView(ActivityView):
         if os.path.exists(newribxpath):
             os.remove(newribxpath)
         shutil.move(ribxpath, newribxpath)
+        file_catalog.add(newribxpath, models.CatalogFile.KIND_PROJECT,
+                         activity.project)
 
     def post_shapefile(self, request, *args, **kwargs):
         shapefilepath = self.__save_uploaded_files(request)
@@ -798,6 +820,7 @@ class UploadDateShapefiles(PlanningView):
         for date, ids in locations_to_change.iteritems():
             models.Location.objects.filter(
                 id__in=ids).update(planned_date=date)
+        mapdata.forget_activity(self.activity_id)
 
         return Info(planned=planned,
                     already_planned=already_planned,
@@ -15,17 +15,19 @@ from django.http import HttpResponse
 from django.http import HttpResponseForbidden
 from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
 from django.views.generic import View
 from django.views.static import serve
 
 from lizard_progress.views.action import Action
 
+from lizard_progress import access
+from lizard_progress import file_catalog
 from lizard_progress import models
 from lizard_progress import tasks
 from lizard_progress.util import directories
 
 from lizard_progress.models import Project
-from lizard_progress.models import has_access
 from lizard_progress.models import Organization
 from lizard_progress.views.views import ProjectsView
 
@@ -54,13 +56,23 @@ def file_download(request, path):
     # Only works for Apache and Nginx, under Linux right now
 
     # Download a file. Here we must update its modification date.
+    rel_path = directories.relative(path)
     accepted_files = models.AcceptedFile.objects.filter(
-        rel_file_path=directories.relative(path))
+        rel_file_path=rel_path)
     if accepted_files:
         accepted_file = accepted_files[0]
         accepted_file.last_downloaded_at = datetime.now()
         accepted_file.save(update_fields=['last_downloaded_at'])
+    file_catalog.register_download(rel_path)
 
+    return protected_file_response(request, path)
+
+
+def protected_file_response(request, path, attachment=True):
+    """Return a response that lets the webserver send the file at path
+    (relative to directories.BASE_DIR) using X-Sendfile or
+    X-Accel-Redirect. Access should have been checked already. Without
+    a webserver in front (DEBUG, or not Linux) Django serves the file."""
     if settings.DEBUG or not platform.system() == 'Linux' or "+" in \
             path:
         logger.debug(
@@ -76,8 +88,9 @@ def file_download(request, path):
     response['X-Sendfile'] = directories.absolute(path)  # Apache
     response['X-Accel-Redirect'] = os.path.join(
         '/protected', path)  # Nginx
-    response['Content-Disposition'] = (
-        'attachment; filename="{filename}"'.format(filename=filename))
+    if attachment:
+        response['Content-Disposition'] = (
+            'attachment; filename="{filename}"'.format(filename=filename))
 
     # Unset the Content-Type as to allow for the webserver
     # to determine it.
@@ -111,6 +124,7 @@ class DownloadOrganizationDocumentView(View):
 
         if os.path.exists(path) and os.path.isfile(path):
             os.remove(path)
+            file_catalog.remove(path)
         else:
             raise http.Http404()
 
@@ -128,13 +142,17 @@ class DownloadDocumentsView(ProjectsView):
                        })
 
     def _organization_files(self):
-        for path in directories.abs_files_in(
-                directories.abs_organization_files_dir(self.organization)):
+        file_catalog.ensure_scanned(
+            models.CatalogFile.KIND_ORGANIZATION, [self.organization])
+        for catalog_file in models.CatalogFile.objects.filter(
+                organization=self.organization,
+                kind=models.CatalogFile.KIND_ORGANIZATION):
             yield {
                 'type': 'Handleidingen e.d.',
-                'filename': os.path.basename(path),
-                'size': directories.human_size(path),
-                'url': self._make_url('organization', path)
+                'filename': catalog_file.filename,
+                'size': catalog_file.human_size,
+                'url': self._make_url(
+                    'organization', catalog_file.rel_file_path)
                 }
 
     def files(self):
@@ -179,94 +197,94 @@ class DownloadHomeView(ProjectsView):
             })
 
     def _project_files(self):
-
-        for path in directories.abs_files_in(
-                directories.abs_project_files_dir(self.project)):
+        file_catalog.ensure_scanned(
+            models.CatalogFile.KIND_PROJECT, [self.project])
+        for catalog_file in models.CatalogFile.objects.filter(
+                project=self.project, kind=models.CatalogFile.KIND_PROJECT):
             yield {
                 'type': 'Handleidingen e.d.',
-                'filename': os.path.basename(path),
-                'size': directories.human_size(path),
+                'filename': catalog_file.filename,
+                'size': catalog_file.human_size,
                 'url': self._make_url('organization',
                                       self.project,
                                       None,
-                                      path)
+                                      catalog_file.rel_file_path)
                 }
 
+    @cached_property
+    def visible_activities(self):
+        """The project's activities this user can see, by id."""
+        return dict(
+            (activity.id, activity)
+            for activity in self.project.activity_set.all()
+            if self.permissions.can_see_activity(activity))
+
+    def _activity_catalog_files(self, kind, if_changed=False):
+        """Yield (activity, catalog file) of the files of this kind of
+        the visible activities, with one query. If if_changed is true,
+        directories that changed since they were scanned are scanned
+        first, see file_catalog.ensure_scanned()."""
+        activities = self.visible_activities
+        if not activities:
+            return
+        file_catalog.ensure_scanned(
+            kind, activities.values(), if_changed=if_changed)
+        for catalog_file in models.CatalogFile.objects.filter(
+                activity_id__in=activities.keys(), kind=kind):
+            yield activities[catalog_file.activity_id], catalog_file
+
     def _reports_files(self):
-        for activity in self.project.activity_set.all():
-            if has_access(self.user, self.project, activity.contractor):
-                for path in directories.abs_files_in(
-                        directories.abs_reports_dir(activity)):
-
-                    accepted_files = models.AcceptedFile.objects.filter(
-                        activity=activity,
-                        rel_file_path=directories.relative(path))
-                    uploaded_at = None
-                    last_downloaded_at = None
-                    if accepted_files:
-                        accepted_file = accepted_files[0]
-                        uploaded_at = accepted_file.uploaded_at
-                        last_downloaded_at = accepted_file.last_downloaded_at
-
-                    yield {
-                        'type': 'Rapporten {}'.format(activity),
-                        'filename': os.path.basename(path),
-                        'size': directories.human_size(path),
-                        'url': self._make_url('reports',
-                                              self.project,
-                                              activity,
-                                              path),
-                        'uploaded': uploaded_at,
-                        'last_downloaded': last_downloaded_at
-                    }
+        for activity, catalog_file in self._activity_catalog_files(
+                models.CatalogFile.KIND_REPORTS):
+            yield {
+                'type': 'Rapporten {}'.format(activity),
+                'filename': catalog_file.filename,
+                'size': catalog_file.human_size,
+                'url': self._make_url('reports',
+                                      self.project,
+                                      activity,
+                                      catalog_file.rel_file_path),
+                'uploaded': catalog_file.uploaded_at,
+                'last_downloaded': catalog_file.last_downloaded_at
+            }
 
     def _results_files(self):
-        for activity in self.project.activity_set.all():
-            if has_access(self.user, self.project, activity.contractor):
-                for path in directories.abs_files_in(
-                        directories.abs_results_dir(activity)):
-                    yield {
-                        'type': 'Resultaten {}'.format(activity),
-                        'filename': os.path.basename(path),
-                        'size': directories.human_size(path),
-                        'url': self._make_url(
-                            'results', self.project,
-                            activity, path)
-                        }
+        # Scripts put results there, without updating the catalog
+        for activity, catalog_file in self._activity_catalog_files(
+                models.CatalogFile.KIND_RESULTS, if_changed=True):
+            yield {
+                'type': 'Resultaten {}'.format(activity),
+                'filename': catalog_file.filename,
+                'size': catalog_file.human_size,
+                'url': self._make_url(
+                    'results', self.project,
+                    activity, catalog_file.rel_file_path)
+                }
 
     def _shapefile_files(self):
-        for activity in self.project.activity_set.all():
-            if has_access(self.user, self.project, activity.contractor):
-                for path in directories.all_abs_files_in(
-                        directories.abs_shapefile_dir(activity)):
-
-                    accepted_files = models.AcceptedFile.objects.filter(
-                        activity=activity,
-                        rel_file_path=directories.relative(path))
-                    uploaded_at = None
-                    last_downloaded_at = None
-                    if accepted_files:
-                        accepted_file = accepted_files[0]
-                        uploaded_at = accepted_file.uploaded_at
-                        last_downloaded_at = accepted_file.last_downloaded_at
-
-                    yield {
-                        'type': 'Ingevulde monstervakken shapefile {}'
-                        .format(activity.contractor.name),
-                        'filename': os.path.basename(path),
-                        'size': directories.human_size(path),
-                        'url': self._make_url(
-                            'contractor_monstervakken', self.project,
-                            activity, path),
-                        'uploaded': uploaded_at,
-                        'last_downloaded': last_downloaded_at
-                    }
+        for activity, catalog_file in self._activity_catalog_files(
+                models.CatalogFile.KIND_SHAPEFILE):
+            yield {
+                'type': 'Ingevulde monstervakken shapefile {}'
+                .format(activity.contractor.name),
+                'filename': catalog_file.filename,
+                'size': catalog_file.human_size,
+                'url': self._make_url(
+                    'contractor_monstervakken', self.project,
+                    activity, catalog_file.rel_file_path),
+                'uploaded': catalog_file.uploaded_at,
+                'last_downloaded': catalog_file.last_downloaded_at
+            }
 
     def _monstervakken_files(self):
-        if has_access(self.user, self.project):
-            for path in directories.all_abs_files_in(
-                directories.abs_hydrovakken_dir(self.project),
-                    extension=".shp"):
+        if self.permissions.can_see(self.project):
+            file_catalog.ensure_scanned(
+                models.CatalogFile.KIND_HYDROVAKKEN, [self.project])
+            for catalog_file in models.CatalogFile.objects.filter(
+                    project=self.project,
+                    kind=models.CatalogFile.KIND_HYDROVAKKEN,
+                    rel_file_path__endswith='.shp'):
+                path = catalog_file.rel_file_path
                 yield {
                     'description':
                     "Monstervakken {project}".format(project=self.project),
@@ -312,8 +330,7 @@ class DownloadHomeView(ProjectsView):
         csvs = []
 
         for activity in self.project.activity_set.all():
-            if has_access(
-                    self.request.user, self.project, activity.contractor):
+            if self.permissions.can_see_activity(activity):
                 url = reverse(
                     'lizard_progress_dashboardcsvview',
                     kwargs={
@@ -330,7 +347,7 @@ class DownloadHomeView(ProjectsView):
         return [
             exportrun
             for exportrun in models.ExportRun.all_in_project(
-                self.project, self.request.user)
+                self.project, self.request.user, self.permissions)
             ]
 
     @property
@@ -367,9 +384,8 @@ class DownloadView(View):
         else:
             activity = None
 
-        if not has_access(
-                request.user, project,
-                activity.contractor if activity else None):
+        if not access.for_request(request).can_see(
+                project, activity.contractor_id if activity else None):
             return HttpResponseForbidden()
 
         if filetype == 'reports':
@@ -420,6 +436,7 @@ class DownloadView(View):
         path = os.path.join(directory, filename)
         if os.path.exists(path) and os.path.isfile(path):
             os.remove(path)
+            file_catalog.remove(path)
         else:
             raise http.Http404()
 
@@ -441,9 +458,8 @@ def start_export_run_view(request, project_slug, export_run_id):
         logger.debug("Wrong project slug")
         return HttpResponseForbidden()
 
-    if not models.has_access(
-            request.user, export_run.activity.project,
-            export_run.activity.contractor):
+    if not access.for_request(request).can_see_activity(
+            export_run.activity):
         logger.debug("No access")
         return HttpResponseForbidden()
 
@@ -475,9 +491,8 @@ def download_export_run(request, project_slug, export_run_id):
     if export_run.activity.project.slug != project_slug:
         return HttpResponseForbidden()
 
-    if not has_access(
-            request.user, export_run.activity.project,
-            export_run.activity.contractor):
+    if not access.for_request(request).can_see_activity(
+            export_run.activity):
         return HttpResponseForbidden()
 
     file_path = export_run.rel_file_path
@@ -493,11 +508,9 @@ def delete_measurement(request, activity, measurement):
     still there.
     """
     # We need write access in this project.
-    if not models.has_write_access(
-            request.user,
-            project=activity.project,
-            contractor=activity.contractor):
-        http.HttpResponseForbidden()
+    if not access.for_request(request).can_write(
+            activity.project_id, activity.contractor_id):
+        return http.HttpResponseForbidden()
 
     # Actually delete it.
     measurement.delete(
@@ -523,7 +536,7 @@ def measurement_download_or_delete(
 
     logger.debug("Incoming programfile request for %s", filename)
 
-    if not has_access(request.user, project, activity.contractor):
+    if not access.for_request(request).can_see_activity(activity):
         logger.warn("Not allowed to access %s", filename)
         return http.HttpResponseForbidden()
 
@@ -7,24 +7,28 @@ import json
 import logging
 import os
 import shutil
-import tempfile
+import uuid
+import zipfile
 
-from django.conf import settings
 from django.contrib import messages
 from django.core.urlresolvers import reverse
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseRedirect
 from django.http import Http404
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
 from django.http import HttpResponseForbidden
 from django.shortcuts import get_object_or_404
 from django.views.generic import TemplateView
 
+from lizard_progress import batch_upload
 from lizard_progress import configuration
+from lizard_progress import file_catalog
 from lizard_progress import forms
 from lizard_progress import tasks
 from lizard_progress import models
 from lizard_progress.util import directories
+from lizard_progress.util import uploads
 from lizard_progress.views.views import ProjectsView
 from lizard_progress.views.views import ViewContextMixin
 from lizard_progress.views.activity import ActivityView
@@ -83,18 +87,35 @@ class UploadDialogView(TemplateView):
 
 
 class UploadView(ActivityView):
+    def get(self, request, *args, **kwargs):
+        """Return the number of bytes received so far of the upload with
+        id 'upload_id', so that a client can resume from there."""
+        if not self.activity.can_upload(request.user):
+            raise PermissionDenied()
+
+        try:
+            upload = self.chunked_upload(request.GET.get('upload_id'))
+        except uploads.UploadError as e:
+            return HttpResponseBadRequest(unicode(e))
+
+        return json_response({
+            'upload_id': request.GET['upload_id'],
+            'received': upload.received})
+
     def post(self, request, *args, **kwargs):
         """Handle file upload.
 
         HTTP 200 (OK) is returned, even if processing fails. Not very RESTful,
         but the only way to show custom error messages when using Plupload.
 
-        If we have the whole file (chunk == chunks-1), then process it.
+        Files can be sent in chunks, see util.uploads. All chunks of a
+        file have the same 'upload_id', and each either has the byte
+        'offset' it starts at, or the chunk number 'chunk' and
+        'chunk_size'. The file is complete if 'size' bytes were
+        received, or after chunk number 'chunks' - 1 if 'chunks' is
+        given. 'size' and 'md5' are checked then. If there is no
+        upload_id, the file is assumed to be sent in one request.
         """
-
-        # Note that the whole chunking thing is currently turned off
-        # in Javascript because it is buggy.
-
         # Usually we return JSON, but not with the simple upload form (for IE)
         return_json = not request.POST.get("simple-upload")
 
@@ -103,24 +124,45 @@ class UploadView(ActivityView):
 
         uploaded_file = request.FILES['file']
         filename = request.POST.get('filename', uploaded_file.name)
-        chunk = int(request.POST.get('chunk', 0))
-        chunks = int(request.POST.get('chunks', 1))
-
-        # Create a temp dir in which our file definitely doesn't exist yet
-        basedir = os.path.join(
-            settings.BUILDOUT_DIR, 'var', 'lizard_progress', 'uploaded_files')
-        if not os.path.exists(basedir):
-            os.makedirs(basedir)
-        tmpdir = tempfile.mkdtemp(dir=basedir)
-
-        path = os.path.join(tmpdir, filename)
-
-        with open(path, 'wb' if chunk == 0 else 'ab') as f:
-            for chunk_bytes in uploaded_file.chunks():
-                f.write(chunk_bytes)
+        try:
+            chunk = int(request.POST.get('chunk', 0))
+            chunks = request.POST.get('chunks')
+            chunks = int(chunks) if chunks else None
+            size = request.POST.get('size')
+            size = int(size) if size else None
+            offset = request.POST.get('offset')
+            if offset:
+                offset = int(offset)
+            elif chunk == 0:
+                offset = 0
+            else:
+                offset = chunk * int(request.POST['chunk_size'])
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest(
+                "Incorrect or missing chunk parameters.")
+
+        upload_id = request.POST.get('upload_id')
+        try:
+            upload = self.chunked_upload(upload_id or uuid.uuid4().hex)
+            received = upload.write_chunk(uploaded_file.chunks(), offset)
+            if (not upload_id or
+                    (chunks is not None and chunk == chunks - 1) or
+                    (size is not None and received >= size)):
+                # We have the whole file.
+                path = upload.complete(
+                    filename, size=size, md5=request.POST.get('md5') or None)
+            else:
+                path = None
+        except uploads.UploadError as e:
+            logger.warn("Upload of %s failed: %s", filename, e)
+            if return_json:
+                return json_response({
+                    'error': {'details': unicode(e)},
+                    'received': getattr(e, 'received', None)})
+            messages.error(request, unicode(e))
+            return HttpResponseRedirect(self.url)
 
-        if chunk == chunks - 1:
-            # We have the whole file.
+        if path is not None:
             if return_json:
                 return self.process_file(path)
             else:
@@ -128,10 +170,15 @@ class UploadView(ActivityView):
                 return HttpResponseRedirect(self.url)
         else:
             if return_json:
-                return json_response({})
+                return json_response({'received': received})
             else:
                 return HttpResponseRedirect(self.url)
 
+    def chunked_upload(self, upload_id):
+        """Uploads are kept apart per activity and user."""
+        return uploads.ChunkedUpload(
+            upload_id, '{}-{}'.format(self.activity.id, self.user.id))
+
     def process_file(self, path):
         raise NotImplementedError
 
@@ -145,6 +192,16 @@ class UploadView(ActivityView):
 
 class UploadMeasurementsView(UploadView):
     def process_file(self, path):
+        if batch_upload.is_batch(path):
+            # Each file in a zip file is processed as an uploaded file
+            try:
+                batch_upload.start_batch(self.activity, self.user, path)
+            except zipfile.BadZipfile:
+                os.remove(path)
+                return json_response({'error': {
+                    'details': "Dit is geen geldig zipbestand."}})
+            return json_response({})
+
         uploaded_file = models.UploadedFile.objects.create(
             activity=self.activity,
             uploaded_by=self.user,
@@ -177,6 +234,8 @@ class UploadReportsView(UploadView):
         rel_file = os.path.join(directories.relative(dst), file_name)
         models.AcceptedFile.create_from_path(activity=self.activity,
                                              rel_file_path=rel_file)
+        file_catalog.add(os.path.join(dst, file_name),
+                         models.CatalogFile.KIND_REPORTS, self.activity)
         return json_response({})
 
 
@@ -204,6 +263,8 @@ class UploadShapefilesView(UploadView):
         rel_file = os.path.join(directories.relative(dst), file_name)
         models.AcceptedFile.create_from_path(activity=self.activity,
                                              rel_file_path=rel_file)
+        file_catalog.add(os.path.join(dst, file_name),
+                         models.CatalogFile.KIND_SHAPEFILE, self.activity)
 
         return json_response({})
 
@@ -283,15 +344,18 @@ class UploadOrganizationFileView(ProjectsView):
         uploaded_file = request.FILES['file']
         filename = request.POST.get('filename', uploaded_file.name)
 
-        with open(os.path.join(
-                directories.abs_organization_files_dir(organization),
-                filename), "wb") as f:
+        path = os.path.join(
+            directories.abs_organization_files_dir(organization), filename)
+        with open(path, "wb") as f:
             for chunk in uploaded_file.chunks():
                 f.write(chunk)
+        file_catalog.add(
+            path, models.CatalogFile.KIND_ORGANIZATION, organization)
 
         # Put shapefile parts into zip files
         tasks.shapefile_vacuum.delay(
-            directories.abs_organization_files_dir(organization))
+            directories.abs_organization_files_dir(organization),
+            models.CatalogFile.KIND_ORGANIZATION, organization.id)
 
         return json_response({})
 
@@ -304,15 +368,17 @@ class UploadProjectFileView(ProjectsView):
         uploaded_file = request.FILES['file']
         filename = request.POST.get('filename', uploaded_file.name)
 
-        with open(os.path.join(
-                directories.abs_project_files_dir(project),
-                filename), "wb") as f:
+        path = os.path.join(
+            directories.abs_project_files_dir(project), filename)
+        with open(path, "wb") as f:
             for chunk in uploaded_file.chunks():
                 f.write(chunk)
+        file_catalog.add(path, models.CatalogFile.KIND_PROJECT, project)
 
         # Put shapefile parts into zip files
         tasks.shapefile_vacuum.delay(
-            directories.abs_project_files_dir(project))
+            directories.abs_project_files_dir(project),
+            models.CatalogFile.KIND_PROJECT, project.id)
 
         return json_response({})
 
@@ -350,6 +416,8 @@ class UploadHydrovakkenView(ProjectsView):
                 for chunk in uploaded_file.chunks():
                     f.write(chunk)
 
+        file_catalog.scan(models.CatalogFile.KIND_HYDROVAKKEN, self.project)
+
         filepath = os.path.join(abs_hydrovakken_dir, request.FILES['shp'].name)
 
         error_message = models.Hydrovak.reload_from(
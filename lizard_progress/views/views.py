@@ -10,6 +10,7 @@ protected_file_download - to download some uploaded files
 """
 
 import csv
+import geojson
 import logging
 import os
 import shutil
@@ -27,24 +28,35 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
 from django.db import connection
+from django.db import transaction
 from django.http import Http404
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
 from django.http import HttpResponseRedirect
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.template import RequestContext
 from django.template.loader import render_to_string
 from django.utils.functional import cached_property
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
 from django.utils.text import Truncator
 from django.utils.translation import ugettext as _
 from django.views.generic.base import TemplateView
+from django.views.generic.base import View
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.views.static import serve
 
+from lizard_progress import access
 from lizard_progress import configuration
 from lizard_progress import crosssection_graph
+from lizard_progress import file_catalog
 from lizard_progress import forms
+from lizard_progress import mapdata
 from lizard_progress import models
 from lizard_progress.changerequests.models import Request
+from lizard_progress.changerequests.stats import RequestStats
 from lizard_progress.email_notifications.models import NotificationSubscription
 from lizard_progress.email_notifications.models import NotificationType
 from lizard_progress.matplotlib_settings import SCREEN_DPI
@@ -52,11 +64,10 @@ from lizard_progress.models import Location
 from lizard_progress.models import MeasurementTypeAllowed
 from lizard_progress.models import Project
 from lizard_progress.models import ReviewProject
-from lizard_progress.models import has_access
 from lizard_progress.models import has_access_reviewproject
 from lizard_progress.models import Activity
-from lizard_progress.models import UserProfile
 from lizard_progress.models import AvailableMeasurementType
+from lizard_progress.util import coordinates
 from lizard_progress.util import directories
 from lizard_progress.util import geo
 from lizard_progress.forms import NewReviewProjectForm
@@ -118,12 +129,9 @@ class ProjectsMixin(object):
             except Project.DoesNotExist:
                 raise Http404()
 
-            if has_access(project=self.project, userprofile=self.profile):
+            if self.permissions.can_see(self.project):
                 self.has_full_access = all(
-                    has_access(
-                        project=self.project,
-                        contractor=activity.contractor,
-                        userprofile=self.profile)
+                    self.permissions.can_see_activity(activity)
                     for activity in self.project.activity_set.all())
             else:
                 raise PermissionDenied()
@@ -154,23 +162,29 @@ class ProjectsMixin(object):
     def generate_project_list(self):
         """Returns a list of projects the current user has access to."""
 
-        projecttable = [p for p in Project.objects.prefetch_related(
-            'organization', 'project_type', 'activity_set__contractor', 'activity_set__measurement_type')
-            .filter(is_archived=False) if has_access(project=p, userprofile=self.profile)]
+        key, descending = self.order
+        projects = Project.objects.select_related(
+            'organization', 'project_type').filter(
+            is_archived=False,
+            id__in=self.permissions.visible_project_ids())
+
+        # Progress is stored in the projects, so the database can sort on
+        # it. Projects without locations (N/A) go last when the most
+        # complete come first, and first otherwise.
+        if key == 'percentage_done':
+            projects = projects.extra(
+                select={'progress': Project.PERCENTAGE_DONE_SQL},
+                order_by=['-progress' if descending else 'progress'])
+        elif key != 'num_open_requests':
+            projects = projects.order_by(('-' if descending else '') + key)
+
+        projects = list(projects)
+
+        if key == 'num_open_requests':
+            request_stats = RequestStats.for_projects(projects)
+            projects.sort(key=lambda p: request_stats.open(project=p),
+                          reverse=descending)
 
-        NAs = [p for p in projecttable if getattr(p, self.order[0]) == "N/A"]
-        notNAs = [p for p in projecttable if p not in NAs]
-
-        sortedprojects = sorted(notNAs, reverse=self.order[1],
-                                key=lambda a: getattr(a, self.order[0]))
-
-        # Append keyless elements if ASC, otherwise insert
-        if self.order[1]:
-            sortedprojects += NAs
-        else:
-            sortedprojects = NAs + sortedprojects
-
-        projects = sortedprojects
         return projects
 
     @cached_property
@@ -180,17 +194,21 @@ class ProjectsMixin(object):
         if not self.project:
             return
         for activity in self.project.activity_set.all():
-            if has_access(
-                    project=self.project,
-                    contractor=activity.contractor,
-                    userprofile=self.profile):
+            if self.permissions.can_see_activity(activity):
                 yield activity
 
+    @cached_property
+    def permissions(self):
+        """What the current user can see and change, see access.py."""
+        return access.for_request(
+            self.request, getattr(self, 'profile', None))
+
     def projects_archived(self):
         """Returns a list of archived projects the current user has
         access to."""
 
-        return [p for p in Project.objects.filter(is_archived=True) if has_access(self.request.user, p)]
+        return list(Project.objects.filter(
+            is_archived=True, id__in=self.permissions.visible_project_ids()))
 
     @cached_property
     def organization(self):
@@ -208,44 +226,37 @@ class ProjectsMixin(object):
             self.profile and
             self.profile.has_role(models.UserRole.ROLE_UPLOADER))
 
+    @cached_property
+    def request_stats(self):
+        """Numbers of change requests in the current project, or in the
+        listed projects."""
+        if self.project:
+            return RequestStats.for_projects([self.project.id])
+        return RequestStats.for_projects(
+            project.id for project in self.projects)
+
     @cached_property
     def total_requests(self):
-        from lizard_progress.changerequests.models import Request
+        if not self.profile:
+            return 0
+        organization_id = self.profile.organization_id
         if self.user_has_manager_role():
-            if 'tot_requests' not in self.request.session:
-                self.request.session['tot_requests'] = Request.objects.filter(
-                    request_status=Request.REQUEST_STATUS_OPEN,
-                    activity__project__organization=self.profile.organization,
-                    activity__project__is_archived=False
-                ).count()
-                return self.request.session['tot_requests']
+            return sum(
+                self.request_stats.open(project=project)
+                for project in self.projects
+                if project.organization_id == organization_id)
         else:
-            if 'tot_requests' not in self.request.session:
-                self.request.session['tot_requests'] = Request.objects.filter(
-                    request_status=Request.REQUEST_STATUS_OPEN,
-                    activity__contractor=self.profile.organization,
-                    activity__project__is_archived=False
-                ).count()
-                return self.request.session['tot_requests']
+            return self.request_stats.open(contractor=organization_id)
 
     def total_activity_requests(self, activity):
-        from lizard_progress.changerequests.models import Request
         if self.user_is_manager():
-            return Request.objects.filter(
-                request_status=Request.REQUEST_STATUS_OPEN,
-                activity__project__organization=self.profile.organization,
-                activity=activity
-            ).count()
+            return self.request_stats.open(activity=activity)
         else:
-            return Request.objects.filter(
-                request_status=Request.REQUEST_STATUS_OPEN,
-                activity__contractor=self.profile.organization,
-                activity=activity
-            ).count()
+            return self.request_stats.open(
+                activity=activity, contractor=self.profile.organization_id)
 
     @cached_property
     def activity_requests(self):
-        # TODO: refactor this. Too many separate database queries.
         for activity in self.activities:
             yield activity, self.total_activity_requests(activity)
 
@@ -282,13 +293,11 @@ class ProjectsMixin(object):
         #    yield project, self.num_project_requests(project), mtypes
 
     def num_project_requests(self, project):
-        # TODO: refactor with database-level annotations/aggregations.
-        # Way too many requests!
         if self.user_is_manager():
-            return project.num_open_requests
+            return self.request_stats.open(project=project)
         else:
-            return project.num_open_requests_for_contractor(
-                self.profile.organization)
+            return self.request_stats.open(
+                project=project, contractor=self.profile.organization_id)
 
     def user_is_manager(self):
         """User is a manager if his organization owns this projects
@@ -367,9 +376,9 @@ class ReviewProjectMixin(object):
     def dispatch(self, request, *args, **kwargs):
 
         self.all_review_projects = ReviewProject.objects.filter(
-            organization=self.organization).defer('reviews', 'feature_collection_geojson')\
+            organization=self.organization).defer('feature_collection_geojson')\
             | ReviewProject.objects.filter(
-                contractor=self.organization).defer('reviews', 'feature_collection_geojson')
+                contractor=self.organization).defer('feature_collection_geojson')
 
         self.reviewproject_id = kwargs.get('review_id')
 
@@ -547,226 +556,122 @@ class InlineMapViewNew(KickOutMixin, ProjectsMixin, TemplateView):
 
         return (minx, miny, maxx, maxy)
 
-    def locations_geojson(self):
-        """A FeatureCollection of locations."""
-        import geojson
-
-        activities = Activity.objects.filter(project=self.project)\
-            .filter(measurement_type__slug__in=['dwarsprofiel',
-                                                'dwarsprofielen_inpeiling',
-                                                'dwarsprofielen_uitpeiling',
-                                                'ribx_reiniging_riool',
-                                                'ribx_reiniging_kolken',
-                                                'ribx_reiniging_inspectie_riool'])
-
-        chreqs = Request.objects.filter(activity__in=activities).distinct()
-        layers = {}
+    def geojson_url(self):
+        return reverse('lizard_progress_map_geojson', kwargs={
+            'project_slug': self.project.slug})
+
+    def change_request_geojson(self):
+        """If called from a ChangeReq page (Toon op kaart - link),
+        then pass the change request info as a FeatureCollection,
+        otherwise null."""
+        if 'change_request' not in self.kwargs:
+            return 'null'
+
+        q = """select json_build_object(
+        'type', 'Feature',
+        'geometry', ST_AsGeoJSON(ST_Transform(cr.the_geom, 4326))::json,
+        'properties', json_build_object(
+        'type', 'request',
+        'id', cr.id,
+        'req_id', cr.id,
+        'req_type', cr.request_type,
+        'loc_type', lnew.location_type,
+        'loc_id', lnew.id,
+        'code', cr.location_code,
+        'old_code', cr.old_location_code,
+        'motivation', cr.motivation,
+        'status', cr.request_status
+        )) as features
+        from changerequests_request cr
+        inner join lizard_progress_activity a on cr.activity_id = a.id
+        inner join lizard_progress_location lnew on cr.location_code = lnew.location_code
+        left join lizard_progress_location lold on cr.old_location_code = lold.location_code
+        where cr.id = %s"""
 
         cursor = connection.cursor()
         try:
-            # Activities (Locations)
-            for a in activities:
-                q = """select json_build_object(
-                'type', 'Feature',
-                'geometry', ST_AsGeoJSON(ST_Transform(l.the_geom, 4326))::json,
-                'properties', json_build_object(
-                  'type', 'location',
-                  'id', l.id,
-                  'loc_id', l.id,
-                  'code', l.location_code,
-                  'activity', a.name,
-                  'contractor', o.name,
-                  'loc_type', l.location_type,
-                  'planned_date', l.planned_date,
-                  'complete', l.complete,
-                  'measured_date', l.measured_date,
-                  'work_impossible', l.work_impossible,
-                  'not_part_of_project', l.not_part_of_project,
-                  'new', l.new
-                )) as features
-                from public.lizard_progress_location l
-                inner join lizard_progress_activity a on a.id = l.activity_id
-                inner join lizard_progress_organization o on o.id = a.contractor_id
-                where l.the_geom is not null and l.activity_id = {}""".format(str(a.id))
-
-                cursor.execute(q)
-                locfeatures = [json.loads(r[0]) for r in cursor.fetchall()]
-                layers[a.name] = geojson.FeatureCollection(locfeatures)
-
-            # Change Requests. Moving requests will be collected separated since they
-            # should provide an additional old/new  location status
-            # TODO: dat kan waarschijnlijk eleganter
-            for cr in chreqs:
-                q = """select json_build_object(
-                'type', 'Feature',
-                'geometry', ST_AsGeoJSON(ST_Transform(cr.the_geom, 4326))::json,
-                'properties', json_build_object(
-                  'activity', 'a.name',
-                  'type', 'request',
-                  'id', cr.id,
-                  'req_type', cr.request_type,
-                  'loc_type', loc.location_type,
-                  'loc_id', loc.id,
-                  'loc_geom', ST_AsGeoJSON(ST_Transform(loc.the_geom, 28992))::json,
-                  'same_geom', ST_Equals(loc.the_geom, cr.the_geom),
-                  'code', cr.location_code,
-                  'motivation', cr.motivation,
-                  'status', cr.request_status
-                )) as features
-                from changerequests_request cr
-                inner join lizard_progress_activity a on cr.activity_id = a.id
-                left join lizard_progress_location loc on cr.location_code = loc.location_code
-                and cr.activity_id = loc.activity_id
-                where cr.activity_id in ({0})
-                and cr.request_type != 2"""\
-                    .format(
-                    ', '.join(map(str, activities.values_list('id', flat=True))))
-
-                cursor.execute(q)
-                reqfeatures = [json.loads(r[0]) for r in cursor.fetchall()]
-
-                # Append accepted moving requests to mark 'old' locations:
-                # geom of an accepted request is original (old) geom of the location
-                q = """select json_build_object(
-                'type', 'Feature',
-                'geometry', ST_AsGeoJSON(ST_Transform(cr.the_geom, 4326))::json,
-                'properties', json_build_object(
-                  'type', 'request',
-                  'old', 1,
-                  'id', cr.id,
-                  'req_type', cr.request_type,
-                  'loc_type', loc.location_type,
-                  'loc_id', loc.id,
-                  'code', cr.location_code,
-                  'motivation', cr.motivation,
-                  'status', cr.request_status
-                )) as features
-                from changerequests_request cr
-                join lizard_progress_location loc on cr.location_code = loc.location_code
-                  and cr.activity_id = loc.activity_id
-                where cr.activity_id in ({0})
-                  and cr.request_type = 2"""\
-                    .format(
-                    ', '.join(map(str, activities.values_list('id', flat=True))))
-
-                cursor.execute(q)
-                reqfeatures += [json.loads(r[0]) for r in cursor.fetchall()]
-
-                # Append location references of not accepted moving requests to mark 'old' locations
-                q = """select json_build_object(
-                'type', 'Feature',
-                'geometry', ST_AsGeoJSON(ST_Transform(loc.the_geom, 4326))::json,
-                'properties', json_build_object(
-                  'type', 'request',
-                  'old', 1,
-                  'id', cr.id,
-                  'req_type', cr.request_type,
-                  'loc_type', loc.location_type,
-                  'loc_id', loc.id,
-                  'code', cr.location_code,
-                  'motivation', cr.motivation,
-                  'status', cr.request_status
-                )) as features
-                from changerequests_request cr
-                join lizard_progress_location loc on cr.location_code = loc.location_code
-                  and cr.activity_id = loc.activity_id
-                where cr.activity_id in ({0})
-                  and cr.request_type = 2 and cr.request_status != 2"""\
-                    .format(
-                    ', '.join(map(str, activities.values_list('id', flat=True))))
-
-                cursor.execute(q)
-                reqfeatures += [json.loads(r[0]) for r in cursor.fetchall()]
-
-                # Append not accepted (both open and rejected) moving requests to mark 'new' locations
-                q = """select json_build_object(
-                'type', 'Feature',
-                'geometry', ST_AsGeoJSON(ST_Transform(cr.the_geom, 4326))::json,
-                'properties', json_build_object(
-                  'type', 'request',
-                  'old', 0,
-                  'id', cr.id,
-                  'req_type', cr.request_type,
-                  'loc_type', loc.location_type,
-                  'loc_id', loc.id,
-                  'code', cr.location_code,
-                  'motivation', cr.motivation,
-                  'status', cr.request_status
-                )) as features
-                from changerequests_request cr
-                join lizard_progress_location loc on cr.location_code = loc.location_code
-                  and cr.activity_id = loc.activity_id
-                where cr.activity_id in ({0})
-                  and cr.request_type = 2 and cr.request_status != 2"""\
-                    .format(
-                    ', '.join(map(str, activities.values_list('id', flat=True))))
-
-                cursor.execute(q)
-                reqfeatures += [json.loads(r[0]) for r in cursor.fetchall()]
-
-                # Append accepted moving requests to mark 'new' locations
-                q = """select json_build_object(
-                'type', 'Feature',
-                'geometry', ST_AsGeoJSON(ST_Transform(loc.the_geom, 4326))::json,
-                'properties', json_build_object(
-                  'type', 'request',
-                  'old', 0,
-                  'id', cr.id,
-                  'req_type', cr.request_type,
-                  'loc_type', loc.location_type,
-                  'loc_id', loc.id,
-                  'code', cr.location_code,
-                  'motivation', cr.motivation,
-                  'status', cr.request_status
-                )) as features
-                from changerequests_request cr
-                join lizard_progress_location loc on cr.location_code = loc.location_code
-                  and cr.activity_id = loc.activity_id
-                where cr.activity_id in ({0})
-                  and cr.request_type = 2 and cr.request_status = 2"""\
-                    .format(
-                    ', '.join(map(str, activities.values_list('id', flat=True))))
-
-                cursor.execute(q)
-                reqfeatures += [json.loads(r[0]) for r in cursor.fetchall()]
-
-                layers['Aanvragen'] = geojson.FeatureCollection(reqfeatures)
-
-            # If called from a ChangeReq page (Toon op kaart - link),
-            # then pass the change request info
-            if 'change_request' in self.kwargs:
-                q = """select json_build_object(
-                'type', 'Feature',
-                'geometry', ST_AsGeoJSON(ST_Transform(cr.the_geom, 4326))::json,
-                'properties', json_build_object(
-                'type', 'request',
-                'id', cr.id,
-                'req_id', cr.id,
-                'req_type', cr.request_type,
-                'loc_type', lnew.location_type,
-                'loc_id', lnew.id,
-                'code', cr.location_code,
-                'old_code', cr.old_location_code,
-                'motivation', cr.motivation,
-                'status', cr.request_status
-                )) as features
-                from changerequests_request cr
-                inner join lizard_progress_activity a on cr.activity_id = a.id
-                inner join lizard_progress_location lnew on cr.location_code = lnew.location_code
-                left join lizard_progress_location lold on cr.old_location_code = lold.location_code
-                where cr.id = {}"""\
-                    .format(self.kwargs.get('change_request', -1))
-
-                cursor.execute(q)
-                features = [json.loads(r[0]) for r in cursor.fetchall()]
-                layers['OoI'] = geojson.FeatureCollection(features)
+            cursor.execute(q, [self.kwargs['change_request']])
+            features = [json.loads(r[0]) for r in cursor.fetchall()]
         finally:
             cursor.close()
 
-        cursor.close()
+        return json.dumps(geojson.FeatureCollection(features))
+
+
+class InlineMapGeoJsonView(KickOutMixin, ProjectsMixin, View):
+    """The layers of the project map as JSON, see lizard_progress.mapdata.
+
+    The layers are cached, and the ETag and Last-Modified headers
+    change when a location or change request of the project changes,
+    so that browsers can use their copy until then."""
+
+    def get(self, request, *args, **kwargs):
+        activities = Activity.objects.filter(
+            project=self.project,
+            measurement_type__slug__in=mapdata.MAP_MEASUREMENT_TYPES
+        ).order_by('id').values_list('id', 'name')
+        layers = mapdata.MapLayers(
+            self.project.id, activities, tile_url=self.tile_url)
+
+        @condition(etag_func=lambda request: layers.etag,
+                   last_modified_func=lambda request: layers.last_modified)
+        def layers_response(request):
+            return HttpResponse(
+                layers.geojson(), content_type='application/json')
+
+        response = layers_response(request)
+        patch_cache_control(response, private=True, max_age=0)
+        return response
+
+    def tile_url(self, activity_id):
+        """URL template of the activity's vector tiles, for Leaflet."""
+        return reverse('lizard_progress_map_tile', kwargs={
+            'project_slug': self.project.slug,
+            'activity_id': activity_id,
+            'z': 0, 'x': 0, 'y': 0,
+        }).replace('/0/0/0.pbf', '/{z}/{x}/{y}.pbf')
+
+
+class InlineMapTileView(KickOutMixin, ProjectsMixin, View):
+    """A Mapbox Vector Tile with the locations and change requests of
+    one activity, see mapdata.activity_tile()."""
+
+    def get(self, request, *args, **kwargs):
+        activity = get_object_or_404(
+            Activity, pk=kwargs['activity_id'], project=self.project)
+        z, x, y = int(kwargs['z']), int(kwargs['x']), int(kwargs['y'])
+        if z > 30 or x >= 2 ** z or y >= 2 ** z:
+            raise Http404()
+
+        version = mapdata.activity_versions([activity.id])[activity.id]
+
+        @condition(etag_func=lambda request: '{}-{}-{}-{}'.format(
+            mapdata.version_dirname(version), z, x, y))
+        def tile_response(request):
+            return HttpResponse(
+                mapdata.activity_tile(
+                    activity.id, version, z, x, y, models.SRID),
+                content_type='application/vnd.mapbox-vector-tile')
+
+        response = tile_response(request)
+        patch_cache_control(response, private=True, max_age=0)
+        return response
+
+
+def popup_latlngs(geometries):
+    """Return the [lat, lng] of the popup of each geometry, with the
+    coordinates of all of them transformed in one call. Lines point
+    to the middle of their first segment."""
+    points = []
+    for g in geometries:
+        if isinstance(g.coords[0], tuple):
+            points.append(((g.coords[0][0] + g.coords[1][0]) / 2,
+                           (g.coords[0][1] + g.coords[1][1]) / 2))
+        else:
+            points.append(g.coords[:2])
+    return [[lat, lng] for lng, lat in coordinates.transform_points(
+        points, 'EPSG:{}'.format(models.SRID), 'wgs84').tolist()]
 
-        res = json.dumps(layers)
-        return (res)
 
 @login_required
 def get_closest_to(request, *args, **kwargs):
@@ -776,97 +681,83 @@ def get_closest_to(request, *args, **kwargs):
     When clicked on a location or a request, selects it and its relations within active overlays.
 
     Returns array of html for found objects + some service info for the leaflet popup.
+
+    The nearest locations are found with a KNN search (mapdata.nearest_locations),
+    and everything the popups show is fetched beforehand in a few queries.
     """
-    locations = None
     response = {}
     html = []
     tab_titles = []
     obj_ids = []
     latlng = []
-    locationIds, changeRequests = [], []
+    locationIds, changeRequests = [], None
 
-    lat = request.GET.get('lat', None)
-    lng = request.GET.get('lng', None)
     objType = request.GET.get('objType', 'location')
     objId = request.GET.get('objId', None)
-    radius = request.GET.get('radius', 50)
     overlays = request.GET.getlist('overlays[]', [])
 
-    proj = Project.objects.get(slug=kwargs['project_slug'])
+    proj = get_object_or_404(
+        Project.objects.select_related('organization'),
+        slug=kwargs['project_slug'])
+    if not access.for_request(request).can_see(proj):
+        raise PermissionDenied()
+    profile = models.UserProfile.get_by_user(request.user)
 
-    # Unclickable items work-around
-    ALWAYS_VICINITY = len(overlays) > 2 and False
+    # Overlays are named after activities
+    activity_ids = list(Activity.objects.filter(
+        project=proj, name__in=overlays).values_list('id', flat=True))
 
-    if not objId or ALWAYS_VICINITY:
+    if not objId:
         # Clicked on the basemap, search objects in the vicinity of the clicked point
         # considering active overlays
-        # NN search is more efficiently carried out by postgis
-
-        cursor = connection.cursor()
         try:
-            q = """SELECT DISTINCT ON (loc.location_type) loc.id FROM lizard_progress_location loc
-            INNER JOIN lizard_progress_activity a ON a.id = loc.activity_id
-            AND a.name IN ({3})
-            AND (ST_Expand(loc.the_geom, {2}) &&
-            ST_Transform(ST_GeomFromEWKT('SRID=4326;POINT({0} {1})'), 28992)::geometry)
-            ORDER BY loc.location_type, ST_Distance(loc.the_geom,
-            ST_Transform(ST_GeomFromEWKT('SRID=4326;POINT({0} {1})'), 28992)::geometry) ASC;"""\
-                .format(lng, lat, radius,
-                        ', '.join(map(lambda _: '\'' + str(_) + '\'', overlays)))
-
-            cursor.execute(q)
-            locationIds = [l[0] for l in cursor.fetchall()]
-        finally:
-            cursor.close()
+            lat = float(request.GET['lat'])
+            lng = float(request.GET['lng'])
+            radius = float(request.GET.get('radius', 50))
+        except (KeyError, ValueError):
+            return http.HttpResponseBadRequest()
+
+        locationIds = mapdata.nearest_locations(
+            activity_ids, lng, lat, radius,
+            [location_type for location_type, description
+             in Location.LOCATION_TYPE_CHOICES],
+            models.SRID)
     else:
         if objType == 'location':
-            rootLocation = Location.objects.get(id=objId)
-            locations = Location.objects.filter(location_code=rootLocation.location_code)\
-                                        .filter(activity__name__in=overlays)
-            locationIds = Location.objects.filter(location_code=rootLocation.location_code)\
-                                          .filter(activity__name__in=overlays).values_list('id', flat=True)
+            rootLocation = get_object_or_404(
+                Location, id=objId, activity__project=proj)
+            locationIds = list(Location.objects.filter(
+                location_code=rootLocation.location_code,
+                activity_id__in=activity_ids).values_list('id', flat=True))
         else:
-            changeRequests = [Request.objects.get(id=objId)]
-            locationIds = Location.objects.filter(activity=changeRequests[0].activity)\
-                                          .filter(location_code=changeRequests[0].location_code)\
-                                          .filter(activity__name__in=overlays)\
-                                          .values_list('id', flat=True)
+            changeRequests = list(Request.objects.filter(
+                id=objId, activity__project=proj).select_related(
+                'activity__contractor', 'activity__project'))
+            if changeRequests:
+                locationIds = list(Location.objects.filter(
+                    activity=changeRequests[0].activity_id,
+                    location_code=changeRequests[0].location_code,
+                    activity_id__in=activity_ids).values_list('id', flat=True))
+
     # If nothing found, return empty response
     if not (locationIds or changeRequests):
         return HttpResponse(json.dumps(response), content_type="application/json")
 
+    locations = []
     if locationIds:
-        # Take the first from the query result and select all locations with the same location code
-        # (i.e. select the location with all its activities).
-        locations = Location.objects.filter(id__in=locationIds)
-
-        g = locations[0].the_geom
-        g.transform(4326)
-
-        # If object is a pipe, point the popup to its middlepoint.
-        if isinstance(g.coords[0], tuple):
-            lng = (g.coords[0][0] + g.coords[1][0]) / 2
-            lat = (g.coords[0][1] + g.coords[1][1]) / 2
-        else:
-            lng, lat = g.coords[0], g.coords[1]
-
-        all_loc_activities = Activity.objects.filter(id__in=locations.values_list('activity_id'))
+        # Select the locations with everything their popups show
+        locations = list(Location.objects.filter(id__in=locationIds).select_related(
+            'activity__contractor', 'activity__project__organization'
+        ).prefetch_related('measurement_set'))
 
         # #############################
         # Create html for sewer objects
         # #############################
-        for loc in [l for l in locations if l.location_type in ['pipe', 'manhole', 'drain']]:
-            g = loc.the_geom
-            g.transform(4326)
-
-            # If object is a pipe, point the popup to its middlepoint.
-            if isinstance(g.coords[0], tuple):
-                lng = (g.coords[0][0] + g.coords[1][0]) / 2
-                lat = (g.coords[0][1] + g.coords[1][1]) / 2
-            else:
-                lng, lat = g.coords[0], g.coords[1]
-
-            latlng.append([lat, lng])
+        sewer_objects = [l for l in locations if l.location_type in ['pipe', 'manhole', 'drain']]
+        # If object is a pipe, point the popup to its middlepoint.
+        sewer_latlngs = popup_latlngs([loc.the_geom for loc in sewer_objects])
+        for loc, loc_latlng in zip(sewer_objects, sewer_latlngs):
+            latlng.append(loc_latlng)
             html.append(render_to_string('lizard_progress/measurement_types/ribx_newmap.html',
                                          {'locations': [loc]}, context_instance=RequestContext(request)))
             tab_titles.append(loc.location_type + ' ' + loc.location_code + ' ' +
@@ -877,14 +768,16 @@ def get_closest_to(request, *args, **kwargs):
         # Create html for crossection measurements
         # ########################################
         xsects = [l for l in locations if l.location_type in ['point']]
+        close_by_counts = mapdata.close_by_counts(
+            [loc.id for loc in xsects if loc.the_geom],
+            proj.organization_id, Location.CLOSE_BY_DISTANCE)
 
-        for loc in xsects:
-            g = loc.the_geom
-            g.transform(4326)
-            latlng.append([g.coords[1], g.coords[0]])
+        xsect_latlngs = popup_latlngs([loc.the_geom for loc in xsects])
+        for loc, loc_latlng in zip(xsects, xsect_latlngs):
+            latlng.append(loc_latlng)
 
             multiple_projects_graph_url = None
-            if loc.close_by_locations_of_same_organisation().count() > 1:
+            if close_by_counts.get(loc.id, 0) > 1:
                 organization = loc.activity.project.organization
                 multiple_projects_graph_url = reverse(
                     'crosssection_graph', kwargs=dict(
@@ -893,7 +786,7 @@ def get_closest_to(request, *args, **kwargs):
             lhtml = render_to_string('lizard_progress/measurement_types/metfile_newmap.html',
                                      {'image_graph_url': 'xsecimage?loc_id={}'.format(loc.id),
                                       'location': loc,
-                                      'measurements': loc.measurement_set.all().count(),
+                                      'measurements': len(loc.measurement_set.all()),
                                       'title': loc.location_code + ' ' + loc.activity.name,
                                       'multiple_projects_graph_url': multiple_projects_graph_url})
             tab_titles.append(loc.location_type + ' ' + loc.location_code + ' ' +
@@ -905,25 +798,27 @@ def get_closest_to(request, *args, **kwargs):
     # ###############################
     # Create html for Change Requests
     # ###############################
-    if not changeRequests:
-        changeRequests = Request.objects.\
-            filter(location_code__in=locations.values_list('location_code'))\
-            .filter(activity__in=all_loc_activities)
-
-    for cr in changeRequests:
-        g = cr.the_geom
-        g.transform(4326)
-        latlng.append([g.coords[1], g.coords[0]])
+    if changeRequests is None:
+        changeRequests = Request.objects.filter(
+            location_code__in=set(loc.location_code for loc in locations),
+            activity__in=set(loc.activity_id for loc in locations)
+        ).select_related('activity__contractor', 'activity__project')
+
+    # All requests are in this project
+    user_is_manager = profile.is_manager_in(proj)
+    changeRequests = list(changeRequests)
+    cr_latlngs = popup_latlngs([cr.the_geom for cr in changeRequests])
+    for cr, cr_latlng in zip(changeRequests, cr_latlngs):
+        latlng.append(cr_latlng)
         html.append(
             render_to_string(
                 'changerequests/detail_popup_newmap.html',
                 {'cr': cr},
                 context_instance=RequestContext(
                     request,
-                    {'user_is_manager': UserProfile.get_by_user(
-                        request.user).is_manager_in(cr.project),
-                     'user_is_contractor': UserProfile.get_by_user(
-                         request.user).organization == cr.activity.contractor}
+                    {'user_is_manager': user_is_manager,
+                     'user_is_contractor': (
+                         profile.organization_id == cr.activity.contractor_id)}
                 )
             )
         )
@@ -936,19 +831,18 @@ def get_closest_to(request, *args, **kwargs):
         'objIds': obj_ids,
         'latlng': latlng
     }
-    # return HttpResponse(json.dumps(response), content_type="application/json")
     return HttpResponse(json.dumps(response), content_type="application/json")
 
 
 def xsecimage(request, *args, **kwargs):
 
-    from . import crosssection_graph as xsgr
-    from lizard_progress.models import Measurement
+    from lizard_progress.views.download import protected_file_response
     loc = Location.objects.get(id=request.GET.get('loc_id'))
-    if Measurement.objects.filter(location=loc):
-        canvas = xsgr.graph(loc, Measurement.objects.filter(location=loc))
-        response = HttpResponse(content_type='image/png')
-        canvas.print_png(response)
+    measurements = crosssection_graph.location_measurements(loc)
+    if measurements:
+        response = protected_file_response(
+            request, crosssection_graph.cached_graph(loc, measurements),
+            attachment=False)
     else:
         response = HttpResponse()
 
@@ -973,7 +867,7 @@ class DashboardView(ProjectsView):
 
     @cached_property
     def num_open_requests(self):
-        return self.project.num_open_requests
+        return self.request_stats.open(project=self.project)
 
     @cached_property
     def breadcrumbs(self):
@@ -1022,6 +916,13 @@ class ActivitiesView(ProjectsView):
         return crumbs
 
 
+class Echo(object):
+    """File-like object for csv.writer that returns what is written,
+    instead of keeping it."""
+    def write(self, value):
+        return value
+
+
 class DashboardCsvView(ProjectsView):
     """Returns a CSV file for a contractor and measurement type."""
 
@@ -1055,41 +956,50 @@ class DashboardCsvView(ProjectsView):
         return "%s (%s-%s-%s)" % (orig_filename, datestr[:4],
                                   datestr[4:6], datestr[6:])
 
-    def get(self, request, project_slug, activity_id):
-        """Returns a CSV file for this activity."""
-
-        self.activity = models.Activity.objects.get(pk=activity_id)
-
-        # Setup HttpResponse and a CSV writer
-        response = http.HttpResponse(content_type="text/csv")
-        writer = csv.writer(response)
-
-        filename = '%s_%s.csv' % (self.activity.project.slug, activity_id)
+    # The file names of each location's measurements, in one query
+    LOCATIONS_SQL = """
+    select l.location_code, l.complete,
+      array_remove(array_agg(m.rel_file_path), null)
+    from lizard_progress_location l
+    left join lizard_progress_measurement m on m.location_id = l.id
+    where l.activity_id = %s
+    group by l.id
+    order by l.location_code, l.timestamp
+    """
 
-        response['Content-Disposition'] = ('attachment; filename=%s' %
-                                           (filename,))
+    def iter_locations(self):
+        """Yield (location_code, complete, rel_file_paths) of the
+        activity's locations, read from a server-side cursor so that
+        they aren't all in memory at once."""
+        with transaction.atomic():
+            connection.ensure_connection()
+            cursor = connection.connection.cursor(
+                name='lizard_progress_dashboardcsv')
+            cursor.itersize = 2000
+            try:
+                cursor.execute(self.LOCATIONS_SQL, [self.activity.id])
+                for row in cursor:
+                    yield row
+            finally:
+                cursor.close()
 
-        locations = self.activity.location_set.all().\
-                    prefetch_related('measurement_set')
+    def iter_csv(self):
+        """Yield the lines of the CSV file, while it is being sent."""
+        writer = csv.writer(Echo())
 
-        # Write header row
-        writer.writerow(['Locatie ID', 'Geupload in'])
+        yield writer.writerow(['Locatie ID', 'Geupload in'])
 
-        # Write rest of the rows
-        for location in locations:
+        for location_code, complete, rel_file_paths in self.iter_locations():
             # Row has the location's id first, then some information
             # per measurement type.
-            row = [location.location_code]
-            if location.complete:
-                # Nice sorted list of filenames and dates.
-                filenames = [self.clean_filename(measurement.rel_file_path)
-                             for measurement in
-                             location.measurement_set.all()]
-
-                # Case insensitive sort
+            row = [location_code]
+            if complete:
+                # Nice sorted list of filenames and dates, case
+                # insensitive.
                 filenames = sorted(
-                    filenames,
-                    cmp=lambda a, b: cmp(a.lower(), b.lower()))
+                    (self.clean_filename(rel_file_path)
+                     for rel_file_path in rel_file_paths),
+                    key=lambda filename: filename.lower())
 
                 row.append(', '.join(filenames))
             else:
@@ -1099,9 +1009,21 @@ class DashboardCsvView(ProjectsView):
                 # that the whole measurement isn't there yet.
                 row.append('Nog niet aanwezig')
 
-            writer.writerow(row)
+            yield writer.writerow(row)
+
+    def get(self, request, project_slug, activity_id):
+        """Returns a CSV file for this activity. The rows are written
+        while the response is sent."""
+
+        self.activity = models.Activity.objects.select_related(
+            'project').get(pk=activity_id)
+
+        filename = '%s_%s.csv' % (self.activity.project.slug, activity_id)
 
-        # Return
+        response = StreamingHttpResponse(
+            self.iter_csv(), content_type="text/csv")
+        response['Content-Disposition'] = ('attachment; filename=%s' %
+                                           (filename,))
         return response
 
 
@@ -1133,7 +1055,7 @@ def dashboard_graph(
     project = get_object_or_404(Project, slug=project_slug)
     activity = get_object_or_404(models.Activity, pk=activity_id)
 
-    if (not has_access(request.user, project, activity.contractor) or
+    if (not access.for_request(request).can_see_activity(activity) or
             activity.project != project):
         raise PermissionDenied()
 
@@ -1314,6 +1236,7 @@ class NewProjectView(ProjectsView):
         for filename in os.listdir(org_files_dir):
             shutil.copy(os.path.join(org_files_dir, filename),
                         os.path.join(abs_project_files_dir, filename))
+        file_catalog.scan(models.CatalogFile.KIND_PROJECT, project)
 
         return HttpResponseRedirect(
             reverse('lizard_progress_dashboardview',
@@ -1552,9 +1475,9 @@ class DownloadReviewProjectReviewsView(KickOutMixin, ReviewProjectMixin,
 
     def get(self, request, *args, **kwargs):
         reviewproject = ReviewProject.objects.get(id=self.reviewproject_id)
-        reviews = reviewproject.reviews
-        response = HttpResponse(json.dumps(reviews, indent=2),
-                                content_type="application/json")
+        # The document is made from the inspection rows while it is sent
+        response = StreamingHttpResponse(reviewproject.iter_reviews_json(),
+                                         content_type="application/json")
         response['Content-Disposition'] = \
             'attachment; filename="{reviewproject}-reviews.json"'.format(
                 reviewproject=reviewproject.name
@@ -1562,6 +1485,53 @@ class DownloadReviewProjectReviewsView(KickOutMixin, ReviewProjectMixin,
         return response
 
 
+class UpdateReviewProjectReviewsView(KickOutMixin, ReviewProjectMixin, View):
+    """Partial update of the reviews. POST a JSON document like the
+    downloaded one, containing only the pipes and manholes that were
+    reviewed, with their ids and versions. Returns the new versions and
+    the ids that conflicted, see ReviewProject.update_reviews()."""
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        return super(UpdateReviewProjectReviewsView, self).dispatch(
+            request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        if not self.reviewproject.can_upload(self.user):
+            raise PermissionDenied()
+
+        try:
+            reviews = json.loads(request.body)
+            items = [item for key in ('pipes', 'manholes')
+                     for item in reviews.get(key) or []]
+        except (ValueError, AttributeError):
+            return HttpResponseBadRequest("Invalid JSON.")
+        if not all(self._valid_item(item) for item in items):
+            return HttpResponseBadRequest(
+                "Every item needs an id, and its ZC must be a list of "
+                "objects.")
+
+        result = self.reviewproject.update_reviews(items)
+        result['progress'] = self.reviewproject.progress
+        return HttpResponse(json.dumps(result),
+                            content_type="application/json")
+
+    @staticmethod
+    def _valid_item(item):
+        """Items and their observations are looked up by their integer
+        ids, observations without an id by their position."""
+        def is_id(value):
+            return (isinstance(value, (int, long)) and
+                    not isinstance(value, bool))
+
+        if not isinstance(item, dict) or not is_id(item.get('id')):
+            return False
+        observations = item.get('ZC') or []
+        return isinstance(observations, list) and all(
+            isinstance(zc, dict) and ('id' not in zc or is_id(zc['id']))
+            for zc in observations)
+
+
 class DownloadReviewProjectShapefilesView(KickOutMixin, ReviewProjectMixin,
                                           TemplateView):
 
@@ -1644,9 +1614,8 @@ def multiproject_crosssection_graph(request, organization_id, location_id):
 
     location = get_object_or_404(models.Location, id=location_id)
 
-    canvas = crosssection_graph.locations_close_by_graph(
-        organization, location)
+    from lizard_progress.views.download import protected_file_response
+    path = crosssection_graph.cached_graph(
+        location, crosssection_graph.close_by_measurements(location))
 
-    response = HttpResponse(content_type='image/png')
-    canvas.print_png(response)
-    return response
+    return protected_file_response(request, path, attachment=False)